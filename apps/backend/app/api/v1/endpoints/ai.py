@@ -1,9 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from typing import Dict, List, Optional, Set
-import re
 import logging
 import os
-import shutil
 import uuid
 from urllib.parse import urlparse
 from fastapi.responses import StreamingResponse
@@ -13,19 +11,25 @@ from pydantic import BaseModel
 
 from app.api import deps
 from app.services.ai_engine import AIEngine
+from app.services.batch_generation import BatchGeneration, build_item_request
+from app.services.provider_health import monitor as provider_health
+from app.services.client_registry import registry as client_registry
+from app.services.model_catalog import model_catalog
+from app.services import upload_reuse
 from app.models.apikey import ApiKey
-from app.models.project import Episode
+from app.models.project import Episode, Project
 from app.models.asset import Asset
 from app.models.style import Style
-from app.core.config import settings
 from app.core.director_trace import DirectorTrace
 from app.core.provider_platform import (
     normalize_platform,
     resolve_base_url,
     requires_api_key,
 )
-from app.utils.http_client import request as http_request
-from app.utils.ollama_client import list_ollama_models
+from app.utils import asset_store, http_client, image_variants
+from app.utils.base64_cache import base64_cache
+from app.utils.composite_cache import composite_cache
+from app.utils.remote_cache import remote_cache
 from app.utils.think_filter import sanitize_think_payload, strip_think_segments
 
 logger = logging.getLogger(__name__)
@@ -42,141 +46,18 @@ class GenerateRequest(BaseModel):
     data: Optional[dict] = None
 
 
-class TestConnectionRequest(BaseModel):
-    api_key_id: int
-
-
-_MODEL_TYPES = ("text", "image", "video", "audio")
-
-
-def _new_model_groups() -> Dict[str, List[str]]:
-    return {k: [] for k in _MODEL_TYPES}
-
-
-def _append_group(groups: Dict[str, List[str]], model_type: str, model_id: str):
-    if model_type not in groups:
-        return
-    if model_id not in groups[model_type]:
-        groups[model_type].append(model_id)
-
-
-def _normalize_capability_token(value: str) -> str:
-    return str(value or "").strip().lower().replace("-", "_")
-
-
-def _collect_modalities(model_row: dict) -> Set[str]:
-    tokens: Set[str] = set()
-    for key in ("modality", "modalities", "input_modalities", "output_modalities"):
-        val = model_row.get(key)
-        if isinstance(val, str):
-            token = _normalize_capability_token(val)
-            if token:
-                tokens.add(token)
-        elif isinstance(val, list):
-            for item in val:
-                token = _normalize_capability_token(item)
-                if token:
-                    tokens.add(token)
-
-    capabilities = model_row.get("capabilities")
-    if isinstance(capabilities, dict):
-        for k, v in capabilities.items():
-            key_token = _normalize_capability_token(k)
-            if isinstance(v, bool):
-                if v:
-                    tokens.add(key_token)
-            elif isinstance(v, str):
-                val_token = _normalize_capability_token(v)
-                if val_token in {"true", "yes", "enabled", "supported"}:
-                    tokens.add(key_token)
-            elif isinstance(v, (int, float)):
-                if v:
-                    tokens.add(key_token)
-    return tokens
-
-
-def _infer_model_capabilities(platform: str, model_id: str, model_row: Optional[dict] = None) -> Set[str]:
-    text_words = (
-        "chat",
-        "gpt",
-        "claude",
-        "deepseek",
-        "qwen",
-        "llama",
-        "gemini",
-        "doubao",
-        "text",
-        "instruct",
-        "reasoner",
-    )
-    image_words = (
-        "image",
-        "vision",
-        "flux",
-        "sd",
-        "stable_diffusion",
-        "dall",
-        "dalle",
-        "seedream",
-        "nano_banana",
-        "recraft",
-        "pixart",
-        "cogview",
-    )
-    video_words = (
-        "video",
-        "sora",
-        "seedance",
-        "runway",
-        "pika",
-        "veo",
-        "kling",
-        "wanx",
-        "hunyuan_video",
-        "i2v",
-        "t2v",
-    )
-    audio_words = (
-        "audio",
-        "speech",
-        "tts",
-        "voice",
-        "whisper",
-        "asr",
-        "transcribe",
-    )
-
-    value = _normalize_capability_token(model_id)
-    capabilities: Set[str] = set()
-
-    if any(word in value for word in text_words):
-        capabilities.add("text")
-    if any(word in value for word in image_words):
-        capabilities.add("image")
-    if any(word in value for word in video_words):
-        capabilities.add("video")
-    if any(word in value for word in audio_words):
-        capabilities.add("audio")
-
-    if isinstance(model_row, dict):
-        tokens = _collect_modalities(model_row)
-        if any(tok in tokens for tok in {"text", "chat", "completion"}):
-            capabilities.add("text")
-        if any(tok in tokens for tok in {"image", "vision"}):
-            capabilities.add("image")
-        if "video" in tokens:
-            capabilities.add("video")
-        if any(tok in tokens for tok in {"audio", "speech", "tts", "asr", "transcription"}):
-            capabilities.add("audio")
-
-    if platform == "ollama":
-        # Ollama /api/tags does not provide reliable capability metadata.
-        capabilities.add("text")
+class BatchGenerateRequest(BaseModel):
+    project_id: int
+    episode_id: int
+    item_ids: List[str]
+    type: str = "image"
+    generation_mode: Optional[str] = None
+    concurrency: Optional[int] = None
 
-    if not capabilities:
-        capabilities.add("text")
 
-    return capabilities
+class TestConnectionRequest(BaseModel):
+    api_key_id: int
+    refresh: bool = False  # bypass the cached model catalog
 
 
 @router.post("/test-connection")
@@ -208,58 +89,14 @@ async def test_connection(
         if requires_api_key(platform) and not real_key:
             raise HTTPException(status_code=400, detail="Auth failed: API Key is required")
 
-        model_groups = _new_model_groups()
-        model_capabilities: Dict[str, List[str]] = {}
-
-        if platform == "ollama":
-            available_models = list_ollama_models(base_url, real_key)
-            for model_id in available_models:
-                caps = sorted(_infer_model_capabilities(platform, model_id))
-                model_capabilities[model_id] = caps
-                for cap in caps:
-                    _append_group(model_groups, cap, model_id)
-        else:
-            # Prefer raw HTTP for compatibility across OpenAI-compatible providers.
-            headers = {"Content-Type": "application/json"}
-            if real_key:
-                headers["Authorization"] = f"Bearer {real_key}"
-
-            models_res = http_request(
-                "GET",
-                f"{base_url.rstrip('/')}/models",
-                headers=headers,
-                timeout=(10.0, 30.0),
-            )
-            if models_res.status_code != 200:
-                raise RuntimeError(models_res.text)
-
-            payload = models_res.json() if models_res.content else {}
-            rows = payload.get("data", []) if isinstance(payload, dict) else []
-            available_models = sorted(
-                [str(model.get("id")) for model in rows if isinstance(model, dict) and model.get("id")]
-            )
-            for row in rows:
-                if not isinstance(row, dict):
-                    continue
-                model_id = str(row.get("id") or "").strip()
-                if not model_id:
-                    continue
-                caps = sorted(_infer_model_capabilities(platform, model_id, row))
-                model_capabilities[model_id] = caps
-                for cap in caps:
-                    _append_group(model_groups, cap, model_id)
-
-        # Keep deterministic order consistent with available_models
-        for model_type in _MODEL_TYPES:
-            ordered = [m for m in available_models if m in set(model_groups[model_type])]
-            model_groups[model_type] = ordered
+        catalog = model_catalog.get(platform, base_url, real_key, refresh=req.refresh)
 
         return {
             "status": "success",
             "message": "Connection Successful",
-            "models": available_models,
-            "models_by_type": model_groups,
-            "model_capabilities": model_capabilities,
+            "models": catalog.models,
+            "models_by_type": catalog.models_by_type,
+            "model_capabilities": catalog.model_capabilities,
         }
 
     except Exception as e:
@@ -539,6 +376,33 @@ async def get_storyboard_prompts(
     return {"status": "success", "records": records}
 
 
+@router.get("/cache/stats")
+async def get_cache_stats(current_user=Depends(deps.get_current_user)):
+    return {
+        "remote": remote_cache.stats(),
+        "base64": base64_cache.stats(),
+        "composite": composite_cache.stats(),
+        "clients": client_registry.stats(),
+        "model_catalog": model_catalog.stats(),
+        "uploads": upload_reuse.stats(),
+    }
+
+
+@router.get("/providers/health")
+async def get_provider_health(refresh: bool = False, current_user=Depends(deps.get_current_user)):
+    """
+    Rolling probe statistics per API key, plus outbound retry counters and
+    per-host circuit breakers. `refresh=true` schedules a probe round now.
+    """
+    if refresh:
+        provider_health.poke()
+    return {
+        "interval": provider_health.interval,
+        "keys": provider_health.stats(current_user.id),
+        "http": http_client.stats(),
+    }
+
+
 @router.post("/upload-reference")
 async def upload_reference_image(
     file: UploadFile = File(...),
@@ -554,20 +418,9 @@ async def upload_reference_image(
     if safe_ext not in {".png", ".jpg", ".jpeg", ".webp"}:
         safe_ext = ".png"
 
-    subdir = "references"
-    if category in {"character", "scene"}:
-        subdir = f"references/{category}"
-
-    assets_dir = os.path.join(settings.ASSETS_DIR, subdir)
-    os.makedirs(assets_dir, exist_ok=True)
-
-    filename = f"ref_{uuid.uuid4().hex}{safe_ext}"
-    file_path = os.path.join(assets_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    image_url = f"/assets/{subdir}/{filename}"
+    # 按内容寻址存储：重复上传同一张参考图只占一份空间
+    image_url = asset_store.put_stream(file.file, safe_ext)
+    image_variants.prewarm(asset_store.path_for_url(image_url))
     return {"url": image_url}
 
 
@@ -586,59 +439,10 @@ async def generate_content(
 
     # --- Prompt Resolution Logic ---
     if episode.ai_config and "generated_script" in episode.ai_config:
-        script_data = episode.ai_config["generated_script"]
-        characters = script_data.get("characters", [])
-        scenes = script_data.get("scenes", [])
-        referenced_images = []
-
-        if req.type != "text":
-            matches = re.finditer(
-                r"\{\{(char|character|scene)_([a-zA-Z0-9_]+)\}\}", req.prompt
-            )
-            for match in matches:
-                tag_type = match.group(1)
-                tag_suffix = match.group(2)
-
-                if tag_type == "character":
-                    tag_type = "char"
-
-                possible_ids = [tag_suffix]
-                possible_ids.append(f"{tag_type}_{tag_suffix}")
-
-                item = None
-                if tag_type == "char":
-                    item = next(
-                        (c for c in characters if str(c.get("id")) in possible_ids),
-                        None,
-                    )
-                elif tag_type == "scene":
-                    item = next(
-                        (s for s in scenes if str(s.get("id")) in possible_ids), None
-                    )
-
-                if item:
-                    if not item.get("image_url"):
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Referenced {tag_type} '{item.get('name') or item.get('location_name')}' does not have a generated image yet. Please generate it first.",
-                        )
-                    referenced_images.append(item.get("image_url"))
-
-        req.prompt = AIEngine.resolve_prompt_tags(
-            req.prompt,
-            script_data,
-            text_mode=req.type == "text",
+        req.prompt, req.data = AIEngine.prepare_generation_request(
+            episode.ai_config["generated_script"], req.prompt, req.type, req.data
         )
 
-        if req.type != "text" and referenced_images:
-            if req.data is None:
-                req.data = {}
-            req.data["reference_images"] = referenced_images
-            if "image" not in req.data and len(referenced_images) > 0:
-                req.data["image"] = referenced_images[0]
-            if "input_reference" not in req.data and len(referenced_images) > 0:
-                req.data["input_reference"] = referenced_images[0]
-
     req_data = req.data if isinstance(req.data, dict) else {}
     trace_id = str(req_data.get("trace_id") or uuid.uuid4().hex)
     if isinstance(req.data, dict):
@@ -720,3 +524,61 @@ async def generate_content(
             raise
 
     return StreamingResponse(trace_stream(), media_type="text/event-stream")
+
+
+@router.post("/generate/batch")
+async def generate_batch(
+    req: BatchGenerateRequest,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_user),
+):
+    if req.type not in {"image", "video"}:
+        raise HTTPException(status_code=400, detail="Batch generation supports image or video only")
+    if not req.item_ids:
+        raise HTTPException(status_code=400, detail="item_ids is empty")
+
+    episode = (
+        db.query(Episode)
+        .join(Project, Project.id == Episode.project_id)
+        .filter(
+            Episode.id == req.episode_id,
+            Episode.project_id == req.project_id,
+            Project.user_id == current_user.id,  # 🔒 隔离
+        )
+        .first()
+    )
+    if not episode:
+        raise HTTPException(status_code=404, detail="Episode not found")
+    if not episode.ai_config or "generated_script" not in episode.ai_config:
+        raise HTTPException(status_code=400, detail="Episode has no generated script")
+
+    script_data = episode.ai_config["generated_script"]
+    items = []
+    skipped = []
+    seen: Set[str] = set()
+    for item_id in req.item_ids:
+        item_id = str(item_id)
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        try:
+            item_req = build_item_request(script_data, item_id, req.type, req.generation_mode)
+            item_req["prompt"], item_req["data"] = AIEngine.prepare_generation_request(
+                script_data, strip_think_segments(item_req["prompt"]), req.type, item_req["data"]
+            )
+            items.append(item_req)
+        except HTTPException as e:
+            skipped.append({"item_id": item_id, "error": e.detail})
+
+    if not items:
+        raise HTTPException(status_code=400, detail={"message": "No generatable items", "skipped": skipped})
+
+    batch = BatchGeneration(
+        user_id=current_user.id,
+        episode_id=episode.id,
+        media_type=req.type,
+        items=items,
+        concurrency=req.concurrency,
+        skipped=skipped,
+    )
+    return StreamingResponse(batch.stream(), media_type="text/event-stream")
@@ -4,14 +4,19 @@ from sqlalchemy.orm import Session
 
 from app.api import deps
 from app.models.apikey import ApiKey
+from app.models.apikey_limit import ApiKeyLimit
 from app.models.user import User
-from app.schemas.apikey import ApiKeyCreate, ApiKeyOut, ApiKeyUpdate
+from app.schemas.apikey import ApiKeyCreate, ApiKeyOut, ApiKeyUpdate, ApiKeyLimitIn, ApiKeyLimitOut
 from app.core.provider_platform import (
     normalize_platform,
     resolve_base_url,
     resolve_endpoint,
     requires_api_key,
 )
+from app.services import key_pool
+from app.services.client_registry import registry as client_registry
+from app.services.model_catalog import model_catalog
+from app.utils.rate_governor import MODALITIES, default_limits, rate_governor
 
 router = APIRouter()
 
@@ -53,6 +58,11 @@ def _normalize_key_payload(
         ),
     }
 
+
+def _catalog_scope(key: ApiKey):
+    """(base_url, credential) the model catalog cache was keyed by; keyless entries drop every catalog for the URL."""
+    return resolve_base_url(normalize_platform(key.platform), key.base_url), (key.encrypted_key or None)
+
 @router.get("/", response_model=List[ApiKeyOut])
 def read_apikeys(
     db: Session = Depends(deps.get_db),
@@ -147,6 +157,7 @@ def update_apikey(
     key = db.query(ApiKey).filter(ApiKey.id == id, ApiKey.user_id == current_user.id).first()
     if not key:
         raise HTTPException(status_code=404, detail="Key not found")
+    previous_scope = _catalog_scope(key)
         
     if key_in.key not in (None, ""):
         key.encrypted_key = key_in.key # 存明文
@@ -174,6 +185,8 @@ def update_apikey(
     
     db.commit()
     db.refresh(key)
+    client_registry.invalidate(key.id)
+    model_catalog.invalidate(*previous_scope)
     
     masked = _mask_key(key.encrypted_key)
     
@@ -201,6 +214,98 @@ def delete_apikey(
     key = db.query(ApiKey).filter(ApiKey.id == id, ApiKey.user_id == current_user.id).first()
     if not key:
         raise HTTPException(status_code=404, detail="Key not found")
+    db.query(ApiKeyLimit).filter(ApiKeyLimit.api_key_id == key.id).delete()
     db.delete(key)
     db.commit()
+    rate_governor.invalidate_limits(id)
+    client_registry.invalidate(id)
+    model_catalog.invalidate(*_catalog_scope(key))
     return {"status": "success"}
+
+
+def _get_owned_key(db: Session, id: int, user: User) -> ApiKey:
+    key = db.query(ApiKey).filter(ApiKey.id == id, ApiKey.user_id == user.id).first()
+    if not key:
+        raise HTTPException(status_code=404, detail="Key not found")
+    return key
+
+
+def _limits_out(db: Session, key_id: int) -> List[ApiKeyLimitOut]:
+    rows = {
+        row.modality: row
+        for row in db.query(ApiKeyLimit).filter(ApiKeyLimit.api_key_id == key_id).all()
+    }
+    results = []
+    for modality in MODALITIES:
+        limits = default_limits(modality)
+        row = rows.get(modality)
+        results.append(ApiKeyLimitOut(
+            modality=modality,
+            requests_per_minute=row.requests_per_minute if row and row.requests_per_minute is not None else limits.rpm,
+            burst=row.burst if row and row.burst is not None else limits.burst,
+            max_in_flight=row.max_in_flight if row and row.max_in_flight is not None else limits.max_in_flight,
+            custom=row is not None,
+        ))
+    return results
+
+
+@router.get("/governor")
+def read_governor_stats(
+    db: Session = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    各 Key 的限流状态：排队数、进行中请求数、令牌余量，以及最近延迟
+    """
+    key_ids = [k for (k,) in db.query(ApiKey.id).filter(ApiKey.user_id == current_user.id)]
+    return {
+        "keys": rate_governor.stats(key_ids),
+        "latency": [row for row in key_pool.latency.stats() if row["key_id"] in key_ids],
+    }
+
+
+@router.get("/{id}/limits", response_model=List[ApiKeyLimitOut])
+def read_apikey_limits(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: int,
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    key = _get_owned_key(db, id, current_user)
+    return _limits_out(db, key.id)
+
+
+@router.put("/{id}/limits", response_model=List[ApiKeyLimitOut])
+def update_apikey_limits(
+    *,
+    db: Session = Depends(deps.get_db),
+    id: int,
+    limits_in: List[ApiKeyLimitIn],
+    current_user: User = Depends(deps.get_current_user),
+) -> Any:
+    """
+    按模态 (text/image/video) 设置 Key 的限流；字段全部为空则恢复默认值
+    """
+    key = _get_owned_key(db, id, current_user)
+    for item in limits_in:
+        for value in (item.requests_per_minute, item.burst, item.max_in_flight):
+            if value is not None and value < 0:
+                raise HTTPException(status_code=400, detail="Limits must not be negative")
+        row = (
+            db.query(ApiKeyLimit)
+            .filter(ApiKeyLimit.api_key_id == key.id, ApiKeyLimit.modality == item.modality)
+            .first()
+        )
+        if item.requests_per_minute is None and item.burst is None and item.max_in_flight is None:
+            if row:
+                db.delete(row)
+            continue
+        if not row:
+            row = ApiKeyLimit(api_key_id=key.id, modality=item.modality)
+            db.add(row)
+        row.requests_per_minute = item.requests_per_minute
+        row.burst = item.burst
+        row.max_in_flight = item.max_in_flight
+    db.commit()
+    rate_governor.invalidate_limits(key.id)
+    return _limits_out(db, key.id)
@@ -0,0 +1,30 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, Body, HTTPException
+
+from app.services import provider_callbacks
+from app.utils.sora_api.main import SoraApiFormatter
+
+router = APIRouter()
+
+
+@router.post("/{provider}/{callback_id}")
+def receive_callback(provider: str, callback_id: str, token: str = "", payload: Dict[str, Any] = Body(...)):
+    """
+    Completion callback from a video provider. Not user-authenticated: the
+    URL carries an HMAC token issued when the task was created.
+    """
+    if not provider_callbacks.enabled():
+        raise HTTPException(status_code=404, detail="Callbacks are disabled")
+    formatter = SoraApiFormatter.by_name(provider)
+    if formatter is None or not formatter.supports_callback:
+        raise HTTPException(status_code=404, detail="Unknown provider")
+    if not provider_callbacks.verify(provider, callback_id, token):
+        raise HTTPException(status_code=403, detail="Invalid callback token")
+
+    try:
+        result = formatter.parse_callback(payload)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid callback payload: {e}")
+    provider_callbacks.receive(formatter.name, callback_id, result)
+    return {"status": "ok"}
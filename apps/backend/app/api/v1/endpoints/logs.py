@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException
 import os
+from datetime import datetime
 from app.core.logger import logger, get_log_dir
-from app.core.director_trace import list_director_runs, get_director_run
+from app.core.director_trace import director_run_stats, list_director_runs, get_director_run
+from app.services.log_retention import log_retention
 
 router = APIRouter()
 
@@ -26,12 +28,62 @@ async def get_latest_logs(limit: int = 100):
         return {"logs": [f"Error reading logs: {str(e)}"]}
 
 
+def _ts(value: datetime | None) -> float | None:
+    return value.timestamp() if value is not None else None
+
+
+@router.get("/retention")
+async def get_retention_stats():
+    return log_retention.stats()
+
+
 @router.get("/director-runs")
-async def get_director_runs(
-    limit: int = 20, project_id: int | None = None, episode_id: int | None = None
+def get_director_runs(
+    limit: int = 20,
+    project_id: int | None = None,
+    episode_id: int | None = None,
+    skill: str | None = None,
+    status: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+):
+    """
+    Newest runs first, from the run index. Pass the returned `next_cursor`
+    as `cursor` for the next page.
+    """
+    try:
+        return list_director_runs(
+            limit=limit,
+            project_id=project_id,
+            episode_id=episode_id,
+            skill=skill,
+            status=status,
+            since=_ts(since),
+            until=_ts(until),
+            cursor=cursor,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/director-runs/stats")
+def get_director_run_stats(
+    project_id: int | None = None,
+    episode_id: int | None = None,
+    skill: str | None = None,
+    status: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
 ):
-    runs = list_director_runs(limit=limit, project_id=project_id, episode_id=episode_id)
-    return {"runs": runs}
+    return director_run_stats(
+        project_id=project_id,
+        episode_id=episode_id,
+        skill=skill,
+        status=status,
+        since=_ts(since),
+        until=_ts(until),
+    )
 
 
 @router.get("/director-runs/{run_id}")
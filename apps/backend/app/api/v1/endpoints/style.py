@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlalchemy.orm import Session
 from typing import List
-import shutil
 import os
 from pydantic import BaseModel
 from datetime import datetime
@@ -9,6 +8,7 @@ from datetime import datetime
 from app.api import deps
 from app.models.style import Style
 from app.core.config import settings
+from app.utils import asset_store, image_variants
 
 import logging
 
@@ -54,15 +54,11 @@ async def create_style(
     if not file.filename:
         raise HTTPException(status_code=400, detail="File must have a name")
     
-    import re
-    safe_name = re.sub(r'[^\w\s-]', '', name).strip().replace(' ', '_')
-    file_name = f"temp_{safe_name}.png"
-    file_path = os.path.join(ASSETS_DIR, file_name)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    image_url = f"/assets/styles/{file_name}"
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in {".png", ".jpg", ".jpeg", ".webp"}:
+        ext = ".png"
+    image_url = asset_store.put_stream(file.file, ext)
+    image_variants.prewarm(asset_store.path_for_url(image_url))
     
     db_obj = Style(
         name=name,
@@ -84,17 +80,22 @@ def delete_style(
     if not item:
         raise HTTPException(status_code=404, detail="Style template not found")
     
+    image_url = item.image_url
+    db.delete(item)
+    db.commit()
+
     try:
-        if item.image_url.startswith("/assets/styles/"):
-            filename = item.image_url.replace("/assets/styles/", "")
+        if asset_store.is_cas_url(image_url):
+            # 其他风格或分镜可能仍引用同一份文件
+            asset_store.remove_if_unreferenced(db, image_url)
+        elif image_url.startswith("/assets/styles/"):
+            filename = image_url.replace("/assets/styles/", "")
             file_path = os.path.join(ASSETS_DIR, filename)
             if os.path.exists(file_path):
                 os.remove(file_path)
     except Exception as e:
         logger.info(f"Error deleting file: {e}")
 
-    db.delete(item)
-    db.commit()
     return {"status": "success"}
 
 @router.put("/{id}", response_model=StyleOut)
@@ -9,6 +9,104 @@ class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./database.db"
     ASSETS_DIR: str = "./assets"
 
+    # Externally reachable backend root (e.g. https://drama.example.com).
+    # Enables provider completion callbacks and lets providers fetch local
+    # reference images from /assets; empty -> poll only, inline images.
+    PUBLIC_BASE_URL: str = ""
+    PROVIDER_CALLBACK_FALLBACK_POLL: float = 120.0  # seconds between polls of callback tasks
+    PROVIDER_CALLBACK_RETENTION: float = 24 * 3600.0
+    # Provider-hosted reference images are re-uploaded this long before they expire
+    UPLOAD_REUSE_EXPIRY_MARGIN: float = 3600.0
+
+    # Video task polling (seconds)
+    VIDEO_POLL_WORKERS: int = 4
+    VIDEO_POLL_INTERVAL: float = 5.0
+    VIDEO_POLL_MIN_INTERVAL: float = 2.0
+    VIDEO_POLL_MAX_INTERVAL: float = 30.0
+
+    # Media downloads
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+    DOWNLOAD_CONNECTIONS: int = 4
+    DOWNLOAD_PARALLEL_THRESHOLD: int = 32 * 1024 * 1024
+
+    # Remote reference image cache (empty dir -> <work dir>/cache/remote)
+    REMOTE_CACHE_DIR: str = ""
+    REMOTE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    REMOTE_CACHE_TTL: float = 3600.0
+    REMOTE_CACHE_MAX_IDLE: float = 7 * 24 * 3600.0
+
+    # Encoded (base64) template / style images kept in memory
+    BASE64_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+    BASE64_CACHE_PREWARM: bool = True
+
+    # Storyboard context composites (seconds unused before pruning)
+    COMPOSITE_CACHE_MAX_IDLE: float = 3 * 24 * 3600.0
+
+    # Batch generation (/v1/ai/generate/batch)
+    BATCH_GENERATE_CONCURRENCY: int = 4
+    BATCH_GENERATE_MAX_CONCURRENCY: int = 8
+
+    # Per-API-key rate governor (empty db -> <work dir>/cache/rate_governor.db).
+    # Defaults per modality; override per key via /v1/apikeys/{id}/limits. 0 = unlimited.
+    RATE_GOVERNOR_ENABLED: bool = True
+    RATE_GOVERNOR_DB: str = ""
+    RATE_GOVERNOR_WAIT_TIMEOUT: float = 900.0
+    RATE_GOVERNOR_LEASE_TTL: float = 3600.0
+    RATE_GOVERNOR_429_COOLDOWN: float = 10.0
+    RATE_GOVERNOR_MAX_ATTEMPTS: int = 3
+    RATE_LIMIT_TEXT_RPM: float = 60.0
+    RATE_LIMIT_TEXT_CONCURRENCY: int = 4
+    RATE_LIMIT_IMAGE_RPM: float = 20.0
+    RATE_LIMIT_IMAGE_CONCURRENCY: int = 4
+    RATE_LIMIT_VIDEO_RPM: float = 10.0
+    RATE_LIMIT_VIDEO_CONCURRENCY: int = 2
+
+    # API key pools (ai_config[modality].key_pool / key_policy), seconds
+    KEY_POOL_HEDGE_DELAY: float = 8.0       # until a key has enough latency samples
+    KEY_POOL_HEDGE_MIN_DELAY: float = 1.0
+    KEY_POOL_HEDGE_MAX_DELAY: float = 30.0
+    KEY_POOL_FAILURE_PENALTY: float = 60.0  # latency sample recorded for a failed call
+
+    # Outbound HTTP retries (utils/http_client.py) and per-host circuit breakers
+    HTTP_RETRY_MAX: int = 2             # extra attempts per request
+    HTTP_RETRY_BACKOFF: float = 0.6     # seconds, doubled per attempt
+    HTTP_RETRY_BUDGET: float = 30.0     # no retry starts later than this after the first attempt
+    HTTP_BREAKER_THRESHOLD: int = 5     # consecutive failures that open a host's breaker
+    HTTP_BREAKER_COOLDOWN: float = 30.0
+
+    # Warm OpenAI / Ollama clients kept by the client registry
+    CLIENT_REGISTRY_MAX_CLIENTS: int = 32
+
+    # Director console: streamed LLM tokens are merged into one `thought` event
+    # per window (ms) or once this much text (bytes) is pending; 0 disables a rule
+    SSE_COALESCE_MS: float = 50.0
+    SSE_COALESCE_BYTES: int = 1024
+
+    # Director run traces: the event log is appended in the background every
+    # interval (seconds) or once this many bytes are pending
+    DIRECTOR_TRACE_FLUSH_INTERVAL: float = 1.0
+    DIRECTOR_TRACE_FLUSH_BYTES: int = 65536
+
+    # Log directory retention (director traces + rotated app.log files)
+    LOG_RETENTION_ENABLED: bool = True
+    LOG_RETENTION_INTERVAL: float = 3600.0      # seconds between passes
+    TRACE_COMPRESS_AFTER_HOURS: float = 24.0    # gzip finished traces older than this
+    LOG_RETENTION_MAX_DAYS: float = 30.0        # 0 = no age limit
+    LOG_RETENTION_MAX_MB: float = 1024.0        # oldest-first eviction above this; 0 = no size limit
+
+    # Provider model lists (seconds): fresh for TTL, then served stale while refreshing
+    MODEL_CATALOG_TTL: float = 600.0
+    MODEL_CATALOG_STALE: float = 86400.0
+    MODEL_CATALOG_MAX_ENTRIES: int = 256        # least recently used catalogs evicted above this
+
+    # Background provider health probes (seconds / milliseconds)
+    PROVIDER_HEALTH_ENABLED: bool = True
+    PROVIDER_HEALTH_INTERVAL: float = 60.0
+    PROVIDER_HEALTH_TIMEOUT: float = 10.0
+    PROVIDER_HEALTH_WINDOW: int = 20
+    PROVIDER_HEALTH_SLOW_MS: float = 5000.0
+    PROVIDER_HEALTH_DOWN_AFTER: int = 3
+
     model_config = SettingsConfigDict(
         env_file=".env",
         case_sensitive=True,
@@ -1,16 +1,38 @@
+"""
+Per-run traces of director (LLM / media generation) streams.
+
+Each run writes two files under logs/director_runs:
+
+- `<run_id>.json`: a compact header (context, status, metrics, result)
+- `<run_id>.events.jsonl`: the sampled event log, append-only
+
+`capture()` only updates counters and queues an encoded line; a background
+writer appends pending lines every DIRECTOR_TRACE_FLUSH_INTERVAL seconds, or
+sooner once DIRECTOR_TRACE_FLUSH_BYTES are pending, and rewrites the header
+when it changed. `start()` and `finish()` flush synchronously and upsert
+the run's row in the `director_run` table, which backs listing, filtering
+and stats without opening any trace file. `get_director_run()` joins header
+and event log into the full record.
+"""
+import atexit
+import gzip
 import json
 import logging
 import os
 import threading
 import time
+from collections import deque
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set
 
+from app.core.config import settings
 from app.core.logger import get_log_dir
 
 logger = logging.getLogger(__name__)
 
-_TRACE_LOCK = threading.Lock()
+_MAX_EVENTS = 2000
+EVENTS_SUFFIX = ".events.jsonl"
+ARCHIVE_SUFFIX = ".json.gz"  # full record of a finished run, written by log retention
 
 
 def _utc_now_iso() -> str:
@@ -30,14 +52,67 @@ def _coerce_int(val: Any) -> Optional[int]:
         return None
 
 
+def _write_json(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class _TraceWriter:
+    """Background flusher shared by all runs; each run only takes its own lock."""
+
+    def __init__(self):
+        self._dirty: Set["DirectorTrace"] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark(self, trace: "DirectorTrace", urgent: bool = False):
+        with self._lock:
+            self._dirty.add(trace)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, daemon=True, name="director-trace-writer")
+                self._thread.start()
+        if urgent:
+            self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(settings.DIRECTOR_TRACE_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush_all()
+
+    def flush_all(self):
+        with self._lock:
+            traces = list(self._dirty)
+            self._dirty.clear()
+        for trace in traces:
+            try:
+                trace.flush()
+            except Exception as e:
+                logger.warning(f"[Trace] Flush failed for run {trace.run_id}: {e}")
+
+
+_writer = _TraceWriter()
+atexit.register(_writer.flush_all)
+
+
 class DirectorTrace:
     def __init__(self, run_id: Optional[str] = None):
         self.run_id = (run_id or "").strip() or f"run_{int(time.time())}_{os.getpid()}"
-        self.path = os.path.join(_trace_dir(), f"{self.run_id}.json")
+        base = _trace_dir()
+        self.path = os.path.join(base, f"{self.run_id}.json")
+        self.events_path = os.path.join(base, f"{self.run_id}{EVENTS_SUFFIX}")
         self._last_progress = -1
-        self._max_events = 2000
         self._finished = False
         self._started_ts = time.time()
+        # _lock guards the in-memory record / pending lines, _io_lock the files.
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._header_dirty = True
         self.record: Dict[str, Any] = {
             "run_id": self.run_id,
             "status": "initialized",
@@ -56,15 +131,16 @@ class DirectorTrace:
                 "thought_chars": 0,
             },
             "result": {},
-            "events": [],
         }
 
     def start(self, context: Dict[str, Any]):
-        with _TRACE_LOCK:
+        with self._lock:
             self.record["status"] = "running"
             self.record["context"] = self._sanitize(context, max_str=600, depth=0)
             self.record["updated_at"] = _utc_now_iso()
-            self._flush_locked()
+            self._header_dirty = True
+        self.flush()
+        _index_run(self.record, self._started_ts)
 
     def has_errors(self) -> bool:
         return int(self.record.get("metrics", {}).get("errors", 0)) > 0
@@ -73,44 +149,42 @@ class DirectorTrace:
         if self._finished:
             return
 
-        metrics = self.record["metrics"]
-        metrics["events"] += 1
-
-        if event_type == "status":
-            metrics["statuses"] += 1
-        elif event_type == "progress":
-            metrics["progress_updates"] += 1
-        elif event_type == "backend_log":
-            metrics["backend_logs"] += 1
-        elif event_type == "error":
-            metrics["errors"] += 1
-        elif event_type == "thought":
-            text = payload if isinstance(payload, str) else str(payload)
-            metrics["thought_chunks"] += 1
-            metrics["thought_chars"] += len(text)
-
-        event_payload = self._normalize_event_payload(event_type, payload)
-        if event_payload is None:
-            return
-
-        with _TRACE_LOCK:
-            self.record["events"].append(
-                {"ts": _utc_now_iso(), "type": event_type, "payload": event_payload}
-            )
-            if len(self.record["events"]) > self._max_events:
-                self.record["events"] = self.record["events"][-self._max_events :]
-
-            if event_type in {"finish", "text_finish"}:
-                self.record["result"] = self._summarize_result(payload)
-
-            self.record["updated_at"] = _utc_now_iso()
-            self._flush_locked()
+        with self._lock:
+            metrics = self.record["metrics"]
+            metrics["events"] += 1
+
+            if event_type == "status":
+                metrics["statuses"] += 1
+            elif event_type == "progress":
+                metrics["progress_updates"] += 1
+            elif event_type == "backend_log":
+                metrics["backend_logs"] += 1
+            elif event_type == "error":
+                metrics["errors"] += 1
+            elif event_type == "thought":
+                text = payload if isinstance(payload, str) else str(payload)
+                metrics["thought_chunks"] += 1
+                metrics["thought_chars"] += len(text)
+            self._header_dirty = True
+
+            event_payload = self._normalize_event_payload(event_type, payload)
+            if event_payload is not None:
+                now = _utc_now_iso()
+                line = json.dumps({"ts": now, "type": event_type, "payload": event_payload}, ensure_ascii=False) + "\n"
+                self._pending.append(line)
+                self._pending_bytes += len(line)
+                if event_type in {"finish", "text_finish"}:
+                    self.record["result"] = self._summarize_result(payload)
+                self.record["updated_at"] = now
+            urgent = self._pending_bytes >= settings.DIRECTOR_TRACE_FLUSH_BYTES
+
+        _writer.mark(self, urgent=urgent)
 
     def finish(self, status: str = "completed", error: Optional[str] = None):
         if self._finished:
             return
 
-        with _TRACE_LOCK:
+        with self._lock:
             if error:
                 self.record["metrics"]["errors"] += 1
 
@@ -124,10 +198,25 @@ class DirectorTrace:
             self.record["duration_ms"] = int((time.time() - self._started_ts) * 1000)
             if error:
                 self.record["result"]["error"] = str(error)[:2000]
-
-            self._flush_locked()
+            self._header_dirty = True
             self._finished = True
 
+        self.flush()
+        _index_run(self.record, self._started_ts)
+
+    def flush(self):
+        """Append pending events and rewrite the header if it changed."""
+        with self._io_lock:
+            with self._lock:
+                lines, self._pending, self._pending_bytes = self._pending, [], 0
+                header = json.dumps(self.record, ensure_ascii=False) if self._header_dirty else None
+                self._header_dirty = False
+            if lines:
+                with open(self.events_path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+            if header is not None:
+                _write_json(self.path, header)
+
     def _normalize_event_payload(self, event_type: str, payload: Any) -> Optional[Any]:
         if event_type == "thought":
             text = payload if isinstance(payload, str) else str(payload)
@@ -229,56 +318,208 @@ class DirectorTrace:
 
         return self._sanitize(str(value), max_str=max_str, max_list=max_list, depth=depth, max_depth=max_depth)
 
-    def _flush_locked(self):
-        tmp_path = f"{self.path}.tmp"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(self.record, f, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, self.path)
 
+# ---------- run index (director_run table) ----------
 
-def list_director_runs(
-    limit: int = 20, project_id: Optional[int] = None, episode_id: Optional[int] = None
-) -> List[Dict[str, Any]]:
-    root = _trace_dir()
-    records: List[Dict[str, Any]] = []
+def _index_run(record: Dict[str, Any], started_ts: float):
+    """Upsert the run's row in the index; tracing must not fail a generation."""
+    from app.db.session import SessionLocal
+    from app.models.director_run import DirectorRun
+
+    ctx = record.get("context") or {}
+    db = SessionLocal()
+    try:
+        row = db.query(DirectorRun).filter(DirectorRun.run_id == record["run_id"]).first()
+        if row is None:
+            row = DirectorRun(run_id=record["run_id"], started_ts=started_ts)
+            db.add(row)
+        row.user_id = _coerce_int(ctx.get("user_id"))
+        row.project_id = _coerce_int(ctx.get("project_id"))
+        row.episode_id = _coerce_int(ctx.get("episode_id"))
+        row.type = ctx.get("type")
+        row.skill = ctx.get("skill")
+        row.prompt_preview = ctx.get("prompt_preview")
+        row.status = record.get("status")
+        row.started_at = record.get("started_at")
+        row.updated_at = record.get("updated_at")
+        row.ended_at = record.get("ended_at")
+        row.duration_ms = record.get("duration_ms")
+        row.metrics = dict(record.get("metrics") or {})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"[Trace] Could not index run {record.get('run_id')}: {e}")
+    finally:
+        db.close()
+
+
+def _iso_to_ts(value: Any) -> float:
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
 
-    files = [name for name in os.listdir(root) if name.endswith(".json")]
-    for name in files:
+
+def reindex_director_runs() -> int:
+    """Index trace headers that have no row yet (traces written before the index existed)."""
+    from app.db.session import SessionLocal
+    from app.models.director_run import DirectorRun
+
+    root = _trace_dir()
+    db = SessionLocal()
+    try:
+        known = {run_id for (run_id,) in db.query(DirectorRun.run_id)}
+    finally:
+        db.close()
+
+    added = 0
+    for name in os.listdir(root):
+        suffix = next((s for s in (".json", ARCHIVE_SUFFIX) if name.endswith(s)), None)
+        if suffix is None or name[: -len(suffix)] in known:
+            continue
         path = os.path.join(root, name)
         try:
-            with open(path, "r", encoding="utf-8") as f:
+            opener = gzip.open if suffix == ARCHIVE_SUFFIX else open
+            with opener(path, "rt", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception:
             continue
-
-        ctx = data.get("context", {})
-        if project_id is not None and _coerce_int(ctx.get("project_id")) != int(project_id):
-            continue
-        if episode_id is not None and _coerce_int(ctx.get("episode_id")) != int(episode_id):
+        if not data.get("run_id"):
             continue
+        _index_run(data, _iso_to_ts(data.get("started_at")))
+        added += 1
+    if added:
+        logger.info(f"[Trace] Indexed {added} existing director runs.")
+    return added
+
+
+def _filter_runs(
+    query,
+    project_id: Optional[int] = None,
+    episode_id: Optional[int] = None,
+    skill: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
+    from app.models.director_run import DirectorRun
+
+    if project_id is not None:
+        query = query.filter(DirectorRun.project_id == project_id)
+    if episode_id is not None:
+        query = query.filter(DirectorRun.episode_id == episode_id)
+    if skill:
+        query = query.filter(DirectorRun.skill == skill)
+    if status:
+        query = query.filter(DirectorRun.status == status)
+    if since is not None:
+        query = query.filter(DirectorRun.started_ts >= since)
+    if until is not None:
+        query = query.filter(DirectorRun.started_ts < until)
+    return query
+
+
+def _run_summary(row: Any) -> Dict[str, Any]:
+    return {
+        "run_id": row.run_id,
+        "status": row.status,
+        "started_at": row.started_at,
+        "updated_at": row.updated_at,
+        "ended_at": row.ended_at,
+        "duration_ms": row.duration_ms,
+        "context": {
+            "project_id": row.project_id,
+            "episode_id": row.episode_id,
+            "user_id": row.user_id,
+            "type": row.type,
+            "skill": row.skill,
+            "prompt_preview": row.prompt_preview,
+        },
+        "metrics": row.metrics or {},
+    }
 
-        records.append(
-            {
-                "run_id": data.get("run_id"),
-                "status": data.get("status"),
-                "started_at": data.get("started_at"),
-                "updated_at": data.get("updated_at"),
-                "ended_at": data.get("ended_at"),
-                "duration_ms": data.get("duration_ms"),
-                "context": {
-                    "project_id": ctx.get("project_id"),
-                    "episode_id": ctx.get("episode_id"),
-                    "user_id": ctx.get("user_id"),
-                    "type": ctx.get("type"),
-                    "skill": ctx.get("skill"),
-                    "prompt_preview": ctx.get("prompt_preview"),
-                },
-                "metrics": data.get("metrics", {}),
-            }
-        )
-
-    records.sort(key=lambda item: item.get("started_at") or "", reverse=True)
-    return records[: max(1, min(int(limit), 200))]
+
+def list_director_runs(
+    limit: int = 20,
+    project_id: Optional[int] = None,
+    episode_id: Optional[int] = None,
+    skill: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Newest first. `cursor` is the `next_cursor` of the previous page
+    ("<started_ts>:<id>"); raises ValueError when it is malformed.
+    """
+    from sqlalchemy import and_, or_
+
+    from app.db.session import SessionLocal
+    from app.models.director_run import DirectorRun
+
+    limit = max(1, min(int(limit), 200))
+    db = SessionLocal()
+    try:
+        query = _filter_runs(db.query(DirectorRun), project_id, episode_id, skill, status, since, until)
+        if cursor:
+            ts_text, _, id_text = cursor.partition(":")
+            cursor_ts, cursor_id = float(ts_text), int(id_text)
+            query = query.filter(
+                or_(
+                    DirectorRun.started_ts < cursor_ts,
+                    and_(DirectorRun.started_ts == cursor_ts, DirectorRun.id < cursor_id),
+                )
+            )
+        rows = query.order_by(DirectorRun.started_ts.desc(), DirectorRun.id.desc()).limit(limit + 1).all()
+    finally:
+        db.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].started_ts!r}:{rows[-1].id}"
+    return {"runs": [_run_summary(row) for row in rows], "next_cursor": next_cursor}
+
+
+def director_run_stats(
+    project_id: Optional[int] = None,
+    episode_id: Optional[int] = None,
+    skill: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> Dict[str, Any]:
+    from sqlalchemy import func
+
+    from app.db.session import SessionLocal
+    from app.models.director_run import DirectorRun
+
+    db = SessionLocal()
+    try:
+        base = _filter_runs(db.query(DirectorRun), project_id, episode_id, skill, status, since, until)
+        total = base.count()
+        by_status = base.with_entities(DirectorRun.status, func.count(DirectorRun.id)).group_by(DirectorRun.status).all()
+        by_skill = base.with_entities(DirectorRun.skill, func.count(DirectorRun.id)).group_by(DirectorRun.skill).all()
+        avg_ms, max_ms = base.with_entities(
+            func.avg(DirectorRun.duration_ms), func.max(DirectorRun.duration_ms)
+        ).filter(DirectorRun.duration_ms.isnot(None)).one()
+        thought_chars, errors = base.with_entities(
+            func.sum(func.json_extract(DirectorRun.metrics, "$.thought_chars")),
+            func.sum(func.json_extract(DirectorRun.metrics, "$.errors")),
+        ).one()
+    finally:
+        db.close()
+
+    return {
+        "runs": total,
+        "by_status": {name or "unknown": count for name, count in by_status},
+        "by_skill": {name or "": count for name, count in by_skill},
+        "duration_avg_ms": int(avg_ms) if avg_ms is not None else None,
+        "duration_max_ms": max_ms,
+        "thought_chars": int(thought_chars or 0),
+        "errors": int(errors or 0),
+    }
 
 
 def get_director_run(run_id: str) -> Optional[Dict[str, Any]]:
@@ -286,13 +527,65 @@ def get_director_run(run_id: str) -> Optional[Dict[str, Any]]:
     if not run_id:
         return None
 
-    path = os.path.join(_trace_dir(), f"{run_id}.json")
+    base = _trace_dir()
+    path = os.path.join(base, f"{run_id}.json")
+    archive = os.path.join(base, f"{run_id}{ARCHIVE_SUFFIX}")
+    if not os.path.exists(path):
+        path = archive
     if not os.path.exists(path):
         return None
 
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        opener = gzip.open if path == archive else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            record = json.load(f)
     except Exception as e:
         logger.error(f"Failed to read director trace '{run_id}': {e}")
         return None
+
+    # Archives and traces written before the event log split carry their events inline.
+    if "events" not in record:
+        record["events"] = _read_events(os.path.join(base, f"{run_id}{EVENTS_SUFFIX}"))
+    return record
+
+
+def write_archive(run_id: str, record: Dict[str, Any]) -> str:
+    """Store a finished run's full record as `<run_id>.json.gz`; returns its path."""
+    path = os.path.join(_trace_dir(), f"{run_id}{ARCHIVE_SUFFIX}")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def forget_runs(run_ids: List[str]):
+    """Drop index rows of runs whose trace files were deleted."""
+    from app.db.session import SessionLocal
+    from app.models.director_run import DirectorRun
+
+    db = SessionLocal()
+    try:
+        db.query(DirectorRun).filter(DirectorRun.run_id.in_(run_ids)).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"[Trace] Could not drop {len(run_ids)} runs from the index: {e}")
+    finally:
+        db.close()
+
+
+def _read_events(path: str) -> List[Dict[str, Any]]:
+    events: deque = deque(maxlen=_MAX_EVENTS)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue  # torn last line of a run that is still writing
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Failed to read director trace events '{path}': {e}")
+    return list(events)
@@ -4,6 +4,7 @@ from app.core.providers.registry import (
     PLATFORM_OPENAI,
     PLATFORM_VOLCENGINE,
     get_provider,
+    idempotency_header,
     normalize_platform,
     platform_defaults,
     requires_api_key,
@@ -18,6 +19,7 @@ __all__ = [
     "PLATFORM_OLLAMA",
     "PLATFORM_VOLCENGINE",
     "get_provider",
+    "idempotency_header",
     "normalize_platform",
     "platform_defaults",
     "resolve_base_url",
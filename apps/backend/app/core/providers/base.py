@@ -24,6 +24,8 @@ class BaseProvider:
         audio_endpoint="",
     )
     requires_api_key: bool = True
+    # Header the provider de-duplicates create requests on, if it has one.
+    idempotency_header: Optional[str] = None
 
     def normalize_base_url(self, base_url: Optional[str]) -> str:
         candidate = (base_url or "").strip()
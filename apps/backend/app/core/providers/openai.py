@@ -12,3 +12,4 @@ class OpenAIProvider(BaseProvider):
         video_fetch_endpoint="/videos/{task_id}",
         audio_endpoint="",
     )
+    idempotency_header = "Idempotency-Key"
@@ -51,5 +51,9 @@ def requires_api_key(platform: Optional[str]) -> bool:
     return get_provider(platform).requires_api_key
 
 
+def idempotency_header(platform: Optional[str]) -> Optional[str]:
+    return get_provider(platform).idempotency_header
+
+
 def supported_platforms() -> List[str]:
     return list(_PROVIDERS.keys())
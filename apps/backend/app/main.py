@@ -35,7 +35,7 @@ from app.db.session import engine
 from app.db.base import Base
 from app.core.ws_logger import manager
 from app.core.logger import setup_logging, get_log_dir
-from app.api.v1.endpoints import auth, projects, ai, apikeys, prompts, tags, users, style, logs
+from app.api.v1.endpoints import auth, projects, ai, apikeys, prompts, tags, users, style, logs, callbacks
 
 # 初始化日志 (Loguru)
 logger = setup_logging()
@@ -50,12 +50,57 @@ async def lifespan(app: FastAPI):
         logger.error(f"[Life] [ERR] Database schema creation failed: {e}")
     
     try:
-        from app.utils.asset_cleaner import clean_orphan_assets
+        from app.utils.asset_cleaner import clean_orphan_assets, clean_unreferenced_blobs
         clean_orphan_assets()
+        clean_unreferenced_blobs()
     except Exception as e:
         logger.warning(f"[Life] Asset cleaner failed: {e}")
 
+    try:
+        from app.core.director_trace import reindex_director_runs
+        threading.Thread(target=reindex_director_runs, daemon=True, name="director-run-index").start()
+    except Exception as e:
+        logger.warning(f"[Life] Director run index backfill failed: {e}")
+
+    if settings.BASE64_CACHE_PREWARM:
+        from app.utils.base64_cache import prewarm_default_images
+        threading.Thread(target=prewarm_default_images, daemon=True, name="base64-prewarm").start()
+
+    if settings.RATE_GOVERNOR_ENABLED:
+        try:
+            # Take over our pid in the governor before anyone checks leases against it.
+            from app.utils.rate_governor import rate_governor
+            rate_governor.register_process()
+        except Exception as e:
+            logger.warning(f"[Life] Rate governor registration failed: {e}")
+
+    try:
+        from app.services.generation_jobs import resume_pending_jobs
+        resume_pending_jobs()
+    except Exception as e:
+        logger.warning(f"[Life] Generation job resume failed: {e}")
+
+    if settings.PROVIDER_HEALTH_ENABLED:
+        from app.services.provider_health import monitor as provider_health
+        provider_health.start()
+
+    if settings.LOG_RETENTION_ENABLED:
+        from app.services.log_retention import log_retention
+        log_retention.start()
+
     yield
+
+    try:
+        from app.services.task_poller import poller
+        poller.shutdown()
+    except Exception as e:
+        logger.warning(f"[Life] Task poller shutdown failed: {e}")
+    if settings.PROVIDER_HEALTH_ENABLED:
+        from app.services.provider_health import monitor as provider_health
+        provider_health.shutdown()
+    if settings.LOG_RETENTION_ENABLED:
+        from app.services.log_retention import log_retention
+        log_retention.shutdown()
     logger.info("[Life] Application shutdown.")
 
 
@@ -119,6 +164,7 @@ app.include_router(tags.router, prefix="/v1/tags", tags=["tags_legacy"])
 app.include_router(style.router, prefix="/v1/styles", tags=["styles"])
 app.include_router(users.router, prefix="/v1/users", tags=["users"])
 app.include_router(logs.router, prefix="/v1/logs", tags=["logs"])
+app.include_router(callbacks.router, prefix="/v1/callbacks", tags=["callbacks"])
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -1,7 +1,12 @@
 from .user import User
 from .apikey import ApiKey
+from .apikey_limit import ApiKeyLimit
 from .prompt import Prompt
 from .asset import Asset
 from .history import History
 from .project import Project, Episode
 from .style import Style
+from .generation_job import GenerationJob
+from .provider_callback import ProviderCallback
+from .provider_upload import ProviderUpload
+from .director_run import DirectorRun
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint
+from app.db.base import Base
+
+class ApiKeyLimit(Base):
+    __tablename__ = "apikey_limit"
+    __table_args__ = (UniqueConstraint("api_key_id", "modality"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    api_key_id = Column(Integer, ForeignKey("apikey.id"), nullable=False, index=True)
+    modality = Column(String, nullable=False)          # 'text' / 'image' / 'video'
+
+    # 为空时使用 settings 中的默认值；0 表示不限制
+    requests_per_minute = Column(Float, nullable=True)
+    burst = Column(Integer, nullable=True)             # 令牌桶容量
+    max_in_flight = Column(Integer, nullable=True)     # 同时进行中的请求数
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Float, JSON
+from app.db.base import Base
+
+class DirectorRun(Base):
+    """logs/director_runs 下每条运行记录的索引 (列表 / 筛选无需打开 trace 文件)"""
+    __tablename__ = "director_run"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, unique=True, nullable=False, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    project_id = Column(Integer, nullable=True, index=True)
+    episode_id = Column(Integer, nullable=True, index=True)
+    type = Column(String, nullable=True)            # text / image / video ...
+    skill = Column(String, nullable=True, index=True)
+    prompt_preview = Column(String, nullable=True)
+
+    # initialized -> running -> completed | error | aborted ...
+    status = Column(String, nullable=True, index=True)
+    started_at = Column(String, nullable=True)      # 与 trace 头部一致的 ISO 时间
+    started_ts = Column(Float, nullable=False, index=True)  # Unix 时间戳，用于排序 / 游标 / 时间筛选
+    updated_at = Column(String, nullable=True)
+    ended_at = Column(String, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    metrics = Column(JSON, nullable=True)
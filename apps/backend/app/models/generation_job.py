@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Text
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+class GenerationJob(Base):
+    __tablename__ = "generation_job"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    episode_id = Column(Integer, ForeignKey("episode.id"), nullable=True, index=True)
+    item_id = Column(String, nullable=True)     # 目标剧本条目 (generated_script 中的 id)
+
+    media_type = Column(String, default="video")
+    provider = Column(String)                   # 平台: 'openai', 'volcengine' ...
+    formatter = Column(String, nullable=True)   # sora_api 格式化器名称 (Kie / ApiYi)
+    key_id = Column(Integer, nullable=True)     # ApiKey.id
+    base_url = Column(String, nullable=True)
+    task_id = Column(String, index=True)        # 供应商返回的任务 ID
+    poll_url = Column(String, nullable=True)    # 状态查询地址 (非 formatter 任务)
+
+    # running -> downloading -> attached | failed
+    status = Column(String, default="running", index=True)
+    progress = Column(Integer, default=0)
+    result_url = Column(String, nullable=True)  # 供应商返回的成品地址
+    asset_id = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    params = Column(JSON, nullable=True)        # Prompt / 风格图等，用于补建 Asset
+    owner = Column(String, nullable=True)       # 负责该任务的进程 "host:pid"，重启时只接管已退出进程的任务
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+class ProviderCallback(Base):
+    __tablename__ = "provider_callback"
+
+    id = Column(Integer, primary_key=True, index=True)
+    callback_id = Column(String, unique=True, index=True, nullable=False)  # 回调地址中的关联 ID
+    provider = Column(String, nullable=False)   # sora_api 格式化器名称 (Kie ...)
+    result = Column(JSON, nullable=True)        # 归一化后的 `_query_status` 结构
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+class ProviderUpload(Base):
+    __tablename__ = "provider_upload"
+    __table_args__ = (UniqueConstraint("provider", "scope", "sha256"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)   # sora_api 格式化器名称 (Kie ...)
+    scope = Column(String, nullable=False)      # base_url + key 的哈希，上传文件按账号隔离
+    sha256 = Column(String, nullable=False)     # 图片内容哈希
+    remote_url = Column(String, nullable=False) # 供应商侧的文件地址
+    expires_at = Column(Float, nullable=True)   # Unix 时间戳；为空表示不过期
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel
 
 class ApiKeyBase(BaseModel):
@@ -24,3 +24,16 @@ class ApiKeyOut(ApiKeyBase):
 
     class Config:
         from_attributes = True
+
+class ApiKeyLimitIn(BaseModel):
+    modality: Literal["text", "image", "video"]
+    requests_per_minute: Optional[float] = None  # None -> 默认值, 0 -> 不限制
+    burst: Optional[int] = None
+    max_in_flight: Optional[int] = None
+
+class ApiKeyLimitOut(BaseModel):
+    modality: str
+    requests_per_minute: float
+    burst: int
+    max_in_flight: int
+    custom: bool = False
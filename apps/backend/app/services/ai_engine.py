@@ -3,36 +3,61 @@ import os
 import time
 import uuid
 import re
-import mimetypes
 from urllib.parse import urlparse
 from app.utils.http_client import request as http_request, download_headers
+from app.utils.rate_governor import rate_governor
+from app.utils import asset_store, downloader, image_variants, sse
+from app.utils.remote_cache import remote_cache
 import logging
-import tempfile
-import shutil
-from typing import Any, Dict, List, Optional, Union
-from openai import OpenAI
+from typing import Any, Dict, List, Optional, Tuple, Union
 from fastapi import HTTPException
 import threading
 
 logger = logging.getLogger(__name__)
 
-from app.models.apikey import ApiKey
 from app.models.asset import Asset
 from app.skills.loader import execute_skill
-from app.utils.image_utils import combine_image, split_grid_image, to_base64
+from app.utils.image_utils import EncodedImage, combine_image, split_grid_frames, to_base64
 from app.schemas.style import StyleBase
 from app.utils.sora_api.main import SoraApiFormatter
 from app.core.config import settings
+from app.utils.script_stream_parser import ScriptSectionParser
+from app.utils.sse import TokenCoalescer, encode_text_event
 from app.utils.think_filter import sanitize_think_payload, strip_think_segments
 from app.core.provider_platform import (
     PLATFORM_OLLAMA,
     PLATFORM_VOLCENGINE,
+    idempotency_header,
     normalize_platform,
     resolve_base_url,
     resolve_endpoint,
     requires_api_key,
 )
-from app.utils.ollama_client import OllamaClient, list_ollama_models
+from app.services.task_poller import poller as task_poller, TERMINAL_STATUSES
+from app.services import generation_jobs, key_pool, provider_callbacks, upload_reuse
+from app.services.client_registry import KeySnapshot, registry as client_registry
+from app.services.model_catalog import model_catalog
+from app.services.provider_health import STATUS_DEGRADED as HEALTH_DEGRADED, STATUS_DOWN as HEALTH_DOWN
+from app.services.provider_health import monitor as provider_health
+
+_VIDEO_COMPLETED_STATUS = {"completed", "succeeded", "success", "done"}
+_VIDEO_FAILED_STATUS = {"failed", "error"}
+# How long a live stream waits for a job the background poller is finalizing.
+_BACKGROUND_ATTACH_WAIT = 60.0
+
+# Tagged sections of the script skills: tag -> key in the combined JSON.
+_SCRIPT_SECTIONS = {
+    "short-video-storyboard-maker": {
+        "STORYBOARD": "storyboard",
+    },
+    "short-video-screenwriter": {
+        "META": "meta",
+        "OUTLINE": "outline",
+        "CHARACTERS": "characters",
+        "SCENES": "scenes",
+        "STORYBOARD": "storyboard",
+    },
+}
 
 
 class AIEngine:
@@ -40,9 +65,9 @@ class AIEngine:
         self.db = db
         self.user = user
         self.config = ai_config or {}
-        client, model, _, _, _ = self._init_client_and_model()
-        self.client = client
-        self.model_name = model
+        # 文本客户端在 generate_stream 中按需获取 (client_registry 复用连接)
+        self.client = None
+        self.model_name = None
         self.episode = None
         self.trace = None
 
@@ -60,6 +85,15 @@ class AIEngine:
                 logger.debug(f"Trace capture failed for event '{event_type}': {e}")
         payload = json.dumps({"type": event_type, "payload": data}, ensure_ascii=False)
         return f"data: {payload}\n\n"
+
+    def _format_text_sse(self, event_type: str, text: str) -> bytes:
+        """`_format_sse` for plain-text payloads, pre-encoded (see utils/sse.py)."""
+        if self.trace:
+            try:
+                self.trace.capture(event_type, text)
+            except Exception as e:
+                logger.debug(f"Trace capture failed for event '{event_type}': {e}")
+        return encode_text_event(event_type, text)
         
     def _resolve_local_path(self, path_or_url: str) -> Optional[str]:
         """
@@ -79,25 +113,8 @@ class AIEngine:
                     if os.path.exists(local_path):
                         return local_path
 
-                # logger.info(f"Downloading remote resource: {path_or_url}")
-                res = http_request("GET", path_or_url, stream=True, timeout=(10, 60))
-                try:
-                    if res.status_code == 200:
-                        ext = path_or_url.split('.')[-1].split('?')[0]
-                        if len(ext) > 4 or "/" in ext: ext = "png"
-                        
-                        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}")
-                        with open(tmp.name, 'wb') as f:
-                            shutil.copyfileobj(res.raw, f)
-                        return tmp.name
-                    else:
-                        logger.error(f"Failed to download image {path_or_url}: Status {res.status_code}")
-                        return None
-                finally:
-                    try:
-                        res.close()
-                    except Exception:
-                        pass
+                # 远程参考图走共享缓存，同一 URL 不重复下载
+                return remote_cache.fetch(path_or_url, timeout=(10, 60))
             except Exception as e:
                 logger.error(f"Error downloading image {path_or_url}: {e}")
                 return None
@@ -122,6 +139,33 @@ class AIEngine:
             
         return path_or_url
 
+    @staticmethod
+    def _storyboard_grid_count(data: Optional[dict]) -> Optional[int]:
+        """Explicit 6/9 grid count from the request, if any."""
+        if not isinstance(data, dict):
+            return None
+        for key in ("storyboard_grid", "grid", "frame_count"):
+            if data.get(key) is not None:
+                try:
+                    return int(data.get(key))
+                except Exception:
+                    return None
+        return None
+
+    def _storyboard_grid_count_for_asset(self, url: Optional[str]) -> Optional[int]:
+        """Grid count recorded when the storyboard image was generated."""
+        if not url:
+            return None
+        try:
+            path = urlparse(str(url)).path if str(url).startswith("http") else str(url)
+            asset = self.db.query(Asset).filter(Asset.url == path).order_by(Asset.id.desc()).first()
+        except Exception as e:
+            logger.debug(f"Grid count lookup failed for {url}: {e}")
+            return None
+        meta = asset.meta_data if asset and isinstance(asset.meta_data, dict) else {}
+        count = meta.get("grid_count")
+        return int(count) if count in (6, 9) else None
+
     def _normalize_remote_url(self, url: Optional[str], base_url: Optional[str] = None, response_data: Optional[dict] = None) -> Optional[str]:
         if not url:
             return url
@@ -230,6 +274,68 @@ class AIEngine:
             prompt_text,
         )
 
+    @staticmethod
+    def prepare_generation_request(
+        script_data: dict, prompt: str, req_type: str, data: Optional[dict]
+    ) -> Tuple[str, Optional[dict]]:
+        """
+        Resolve {{char_x}} / {{scene_x}} tags in a generation prompt and, for
+        media requests, attach the referenced images to `data`.
+        """
+        characters = script_data.get("characters", [])
+        scenes = script_data.get("scenes", [])
+        referenced_images = []
+
+        if req_type != "text":
+            matches = re.finditer(
+                r"\{\{(char|character|scene)_([a-zA-Z0-9_]+)\}\}", prompt
+            )
+            for match in matches:
+                tag_type = match.group(1)
+                tag_suffix = match.group(2)
+
+                if tag_type == "character":
+                    tag_type = "char"
+
+                possible_ids = [tag_suffix]
+                possible_ids.append(f"{tag_type}_{tag_suffix}")
+
+                item = None
+                if tag_type == "char":
+                    item = next(
+                        (c for c in characters if str(c.get("id")) in possible_ids),
+                        None,
+                    )
+                elif tag_type == "scene":
+                    item = next(
+                        (s for s in scenes if str(s.get("id")) in possible_ids), None
+                    )
+
+                if item:
+                    if not item.get("image_url"):
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"Referenced {tag_type} '{item.get('name') or item.get('location_name')}' does not have a generated image yet. Please generate it first.",
+                        )
+                    referenced_images.append(item.get("image_url"))
+
+        prompt = AIEngine.resolve_prompt_tags(
+            prompt,
+            script_data,
+            text_mode=req_type == "text",
+        )
+
+        if req_type != "text" and referenced_images:
+            if data is None:
+                data = {}
+            data["reference_images"] = referenced_images
+            if "image" not in data and len(referenced_images) > 0:
+                data["image"] = referenced_images[0]
+            if "input_reference" not in data and len(referenced_images) > 0:
+                data["input_reference"] = referenced_images[0]
+
+        return prompt, data
+
     @staticmethod
     def build_video_request_prompt(prompt: str, video_config: Optional[dict] = None) -> str:
         prompt_text = str(sanitize_think_payload(prompt) if prompt else "").strip()
@@ -254,7 +360,7 @@ class AIEngine:
         return prompt_text
 
 
-    def _init_client_and_model(self, type="text"):
+    def _modality_config(self, type="text") -> Dict[str, Any]:
         config: Dict[str, Any] = {}
         if isinstance(self.config, dict):
             if type == "text":
@@ -271,21 +377,57 @@ class AIEngine:
                 if candidate.get("key_id"):
                     config = candidate
                     break
+        return config
 
+    def _key_candidates(self, type="text") -> Tuple[List[KeySnapshot], Optional[str]]:
+        """
+        Configured key plus its optional `key_pool`, ordered by `key_policy`.
+        Pool keys must belong to the user and share the primary key's platform.
+        """
+        config = self._modality_config(type)
         key_id = config.get("key_id")
+        if not key_id:
+            return [], None
+        pool_ids = [key_id] + [k for k in (config.get("key_pool") or []) if k and k != key_id]
+        records = {
+            str(key_id): snapshot
+            for key_id, snapshot in client_registry.get_keys(self.db, self.user.id, pool_ids).items()
+        }
+        primary = records.get(str(key_id))
+        if not primary:
+            return [], None
+        platform = normalize_platform(primary.platform)
+        candidates = [primary]
+        for pool_id in pool_ids[1:]:
+            record = records.get(str(pool_id))
+            if record is None or record in candidates:
+                continue
+            if normalize_platform(record.platform) != platform:
+                logger.warning(f"[KeyPool] Skipping key {record.id}: platform differs from key {primary.id}.")
+                continue
+            candidates.append(record)
+        policy = config.get("key_policy")
+        if len(candidates) > 1:
+            candidates = key_pool.order_keys(candidates, type, policy)
+        return candidates, policy
+
+    def _init_client_and_model(self, type="text", api_key_record: Optional[KeySnapshot] = None):
+        """
+        Returns (client, model, real_key, base_url, key snapshot). Only text
+        requests get a client; it comes warm from the client registry.
+        """
+        config = self._modality_config(type)
         model_name = config.get("model")
 
-        if not key_id:
-            return None, None, None, None, None
+        if api_key_record is None:
+            key_id = config.get("key_id")
+            if not key_id:
+                return None, None, None, None, None
 
-        api_key_record = (
-            self.db.query(ApiKey)
-            .filter(ApiKey.id == key_id, ApiKey.user_id == self.user.id)
-            .first()
-        )
+            api_key_record = client_registry.get_key(self.db, self.user.id, key_id)
 
-        if not api_key_record:
-            raise HTTPException(status_code=404, detail="API Key 不存在")
+            if not api_key_record:
+                raise HTTPException(status_code=404, detail="API Key 不存在")
         
         platform = normalize_platform(api_key_record.platform)
         # 直接使用明文 Key
@@ -303,34 +445,70 @@ class AIEngine:
             )
             if not model_name:
                 try:
-                    discovered = list_ollama_models(base_url, real_key)
+                    discovered = model_catalog.get(platform, base_url, real_key).models
                     if discovered:
                         model_name = discovered[0]
                 except Exception:
                     pass
             if type == "text":
-                client = OllamaClient(
-                    base_url=base_url,
-                    api_key=real_key,
-                    chat_endpoint=text_endpoint,
-                )
+                client = client_registry.ollama_client(api_key_record, base_url, real_key, text_endpoint)
                 return client, model_name, real_key, base_url, api_key_record
             return None, model_name, real_key, base_url, api_key_record
 
         if requires_api_key(platform) and not real_key:
             raise HTTPException(status_code=400, detail="API Key 未配置")
 
-        client = OpenAI(api_key=real_key, base_url=base_url)
+        if type != "text":
+            return None, model_name, real_key, base_url, api_key_record
+        client = client_registry.openai_client(api_key_record, base_url, real_key)
         return client, model_name, real_key, base_url, api_key_record
 
     def generate_media_stream(self, media_type: str, prompt: str, style: StyleBase = None, data: dict = None):
+        candidates, _ = self._key_candidates(media_type)
+        if len(candidates) <= 1:
+            yield from self._generate_media_with_key(media_type, prompt, style, data)
+            return
+
+        for index, api_key_record in enumerate(candidates):
+            is_last = index == len(candidates) - 1
+            try:
+                yield from self._generate_media_with_key(
+                    media_type, prompt, style, data, api_key_record=api_key_record, failover=not is_last
+                )
+                return
+            except key_pool.ProviderUnavailable as e:
+                next_record = candidates[index + 1]
+                yield self._format_sse(
+                    "status", f"Key '{api_key_record.name}' unavailable, failing over to '{next_record.name}'..."
+                )
+                yield self._format_sse("backend_log", f"[KeyPool] {api_key_record.name}: {e}")
+
+    def _generate_media_with_key(
+        self,
+        media_type: str,
+        prompt: str,
+        style: StyleBase = None,
+        data: dict = None,
+        api_key_record: Optional[KeySnapshot] = None,
+        failover: bool = False,
+    ):
+        """
+        One generation attempt. With `failover`, timeouts / 5xx that happen
+        before the provider accepted the request raise ProviderUnavailable so
+        the caller can retry on the next pooled key.
+        """
+        # Provider task currently being watched; adopted by the background
+        # poller if the client disconnects before it finishes.
+        job_id = None
+        job_task_key = None
+        submitted = False
         try:
             yield self._format_sse("status", f"Starting {media_type} generation...")
             yield self._format_sse("backend_log", f"--- [Backend] Starting {media_type} generation ---")
             yield self._format_sse("backend_log", f"Prompt: {prompt}")
 
             _, model_name, real_key, base_url, api_key_record = self._init_client_and_model(
-                type=media_type
+                type=media_type, api_key_record=api_key_record
             )
             platform = normalize_platform(api_key_record.platform) if api_key_record else ""
             if platform == PLATFORM_OLLAMA:
@@ -344,18 +522,37 @@ class AIEngine:
                 )
                 return
 
+            governor_key = api_key_record.id if api_key_record else None
+            health = provider_health.status_for(governor_key)
+            if health and health["status"] in (HEALTH_DEGRADED, HEALTH_DOWN):
+                yield self._format_sse(
+                    "backend_log",
+                    f"[Health] Upstream {health['base_url']} is {health['status']} "
+                    f"(error rate {health['error_rate']:.0%}, last error: {health['last_error']})",
+                )
+            queued = rate_governor.queue_depth(governor_key, media_type)
+            if queued:
+                yield self._format_sse("status", f"Waiting for API key capacity ({queued} request(s) queued)...")
             yield self._format_sse("status", "Requesting generation API...")
 
             headers = {
                 "Authorization": f"Bearer {real_key}",
                 "Content-Type": "application/json",
             }
+            # One key per submission: if a timed-out create is retried, the
+            # provider returns the first task instead of starting a second one.
+            idem_header = idempotency_header(platform)
+            if idem_header:
+                headers[idem_header] = uuid.uuid4().hex
 
             progress_value = [1]
+            extra_asset_meta: Dict[str, Any] = {}
             yield self._format_sse("progress", progress_value[0])
 
-            def _bump_progress():
-                if progress_value[0] < 99:
+            def _bump_progress(target=None):
+                if target is not None and int(target) > progress_value[0]:
+                    progress_value[0] = min(int(target), 99)
+                elif progress_value[0] < 99:
                     progress_value[0] += 1
                 yield self._format_sse("progress", progress_value[0])
 
@@ -406,8 +603,7 @@ class AIEngine:
                 elif raw_ref:
                     ref_list = [raw_ref]
 
-                temp_files: List[str] = []
-                image_refs: List[str] = []
+                image_refs: List[Union[str, EncodedImage]] = []
 
                 if mode == "keyframes":
                     if not ref_list:
@@ -419,12 +615,15 @@ class AIEngine:
                     else:
                         grid_ref = ref_list[0]
                         grid_local = self._resolve_local_path(grid_ref) or grid_ref
+                        grid_count = (
+                            self._storyboard_grid_count(data)
+                            or self._storyboard_grid_count_for_asset(grid_ref)
+                            or 9
+                        )
                         try:
-                            frame_paths = split_grid_image(grid_local, rows=3, cols=3)
+                            image_refs = split_grid_frames(grid_local, grid_count)
                         except Exception as e:
                             raise RuntimeError(f"Failed to split storyboard image: {str(e)}")
-                        image_refs = frame_paths
-                        temp_files.extend(frame_paths)
                 else:
                     final_ref = None
                     if ref_list:
@@ -439,11 +638,13 @@ class AIEngine:
                 task_id = None
                 task_data: Dict[str, Any] = {}
                 should_poll_task = False
-                try:
-                    if formatter:
-                        yield self._format_sse("status", f"Delegating to {formatter.name} formatter...")
+                if formatter:
+                    yield self._format_sse("status", f"Delegating to {formatter.name} formatter...")
                         
-                        try:
+                    try:
+                        callback_id, callback_url = provider_callbacks.prepare(formatter)
+                        call_started = time.monotonic()
+                        with rate_governor.slot(governor_key, "video"):
                             task_id = formatter.create(
                                 base_url=base_url_str,
                                 apikey=real_key,
@@ -452,194 +653,200 @@ class AIEngine:
                                 seconds=15,
                                 size="1280x720",
                                 watermark=False,
-                                images=image_refs
+                                images=image_refs,
+                                callback_url=callback_url,
                             )
-                            
-                            yield self._format_sse("status", f"Task created: {task_id}, queuing...")
+                        submitted = True
+                        key_pool.latency.record(governor_key, "video", time.monotonic() - call_started)
 
-                            def status_listener(status, data):
-                                progress = data.get("progress", 0)
-                                if progress < 10: progress = 10
-                                if progress > 99: progress = 99
-                                logger.info(f"[Formatter: {status}] Progress: {progress}%")
-                            
-                            video_url = yield from _run_with_progress(
-                                lambda: formatter.queue(task_id, status_listener)
+                        yield self._format_sse("status", f"Task created: {task_id}, queuing...")
+
+                        task_key = formatter.track(task_id, callback_id=callback_id)
+                        if formatter.resumable:
+                            job_id = self._record_job(
+                                media_type, platform, api_key_record, base_url_str, task_id,
+                                prompt=prompt, style=style, data=data, formatter=formatter.name,
+                                callback_id=callback_id,
                             )
-                            
-                            image_url = video_url
-                            ext = "mp4"
+                            job_task_key = task_key
+                        final_update = yield from self._watch_video_task(task_key, _bump_progress)
+                        job_task_key = None
+                        if not generation_jobs.claim_for_attach(job_id):
+                            yield from self._finish_from_background(job_id, media_type, prompt)
+                            return
+                        video_url = final_update.get("video_url")
+                        if not video_url:
+                            raise RuntimeError("Video completed but URL not found")
 
-                        except Exception as e:
-                            raise RuntimeError(f"Formatter Error: {str(e)}")
+                        image_url = video_url
+                        ext = "mp4"
 
-                    else:
-                        should_poll_task = True
-                        if platform == PLATFORM_VOLCENGINE:
-                            # Official Volcengine video generation API expects JSON body:
-                            # { "model": "...", "content": [{ "type":"text","text":"..." }, ...] }
-                            content_payload: List[Dict[str, Any]] = [
-                                {"type": "text", "text": f"{prompt}"}
-                            ]
+                    except Exception as e:
+                        raise RuntimeError(f"Formatter Error: {str(e)}")
 
-                            remote_refs: List[str] = []
-                            for raw_ref in image_refs:
-                                normalized_ref = self._normalize_remote_url(
-                                    raw_ref, base_url=None
-                                )
-                                if normalized_ref and str(normalized_ref).startswith(
-                                    ("http://", "https://")
-                                ):
-                                    remote_refs.append(str(normalized_ref))
-                                elif normalized_ref:
-                                    yield self._format_sse(
-                                        "backend_log",
-                                        f"Skip non-public image reference for Volcengine: {normalized_ref}",
-                                    )
-
-                            model_lower = (target_model or "").lower()
-                            if remote_refs:
-                                # i2v models may accept keyframe roles; for other models keep a single image_url.
-                                if "i2v" in model_lower and len(remote_refs) >= 2:
-                                    content_payload.append(
-                                        {
-                                            "type": "image_url",
-                                            "role": "first_frame",
-                                            "image_url": {"url": remote_refs[0]},
-                                        }
-                                    )
-                                    content_payload.append(
-                                        {
-                                            "type": "image_url",
-                                            "role": "last_frame",
-                                            "image_url": {"url": remote_refs[-1]},
-                                        }
-                                    )
-                                else:
-                                    content_payload.append(
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {"url": remote_refs[0]},
-                                        }
-                                    )
-                            elif "i2v" in model_lower:
-                                raise RuntimeError(
-                                    "Volcengine i2v 模型需要可公网访问的 image_url 参数。"
+                else:
+                    should_poll_task = True
+                    call_started = time.monotonic()
+                    if platform == PLATFORM_VOLCENGINE:
+                        # Official Volcengine video generation API expects JSON body:
+                        # { "model": "...", "content": [{ "type":"text","text":"..." }, ...] }
+                        content_payload: List[Dict[str, Any]] = [
+                            {"type": "text", "text": f"{prompt}"}
+                        ]
+
+                        remote_refs: List[str] = []
+                        for raw_ref in image_refs:
+                            normalized_ref = self._normalize_remote_url(
+                                raw_ref, base_url=None
+                            )
+                            if normalized_ref and not str(normalized_ref).startswith(("http://", "https://")):
+                                # Local asset: usable if this backend is publicly reachable.
+                                normalized_ref = upload_reuse.public_url(str(normalized_ref)) or normalized_ref
+                            if normalized_ref and str(normalized_ref).startswith(
+                                ("http://", "https://")
+                            ):
+                                remote_refs.append(str(normalized_ref))
+                            elif normalized_ref:
+                                yield self._format_sse(
+                                    "backend_log",
+                                    f"Skip non-public image reference for Volcengine: {normalized_ref}",
                                 )
 
-                            request_payload = {
-                                "model": target_model,
-                                "content": content_payload,
-                            }
-                            yield self._format_sse(
-                                "backend_log",
-                                f"Volcengine request: model={target_model}, content_items={len(content_payload)}",
+                        model_lower = (target_model or "").lower()
+                        if remote_refs:
+                            # i2v models may accept keyframe roles; for other models keep a single image_url.
+                            if "i2v" in model_lower and len(remote_refs) >= 2:
+                                content_payload.append(
+                                    {
+                                        "type": "image_url",
+                                        "role": "first_frame",
+                                        "image_url": {"url": remote_refs[0]},
+                                    }
+                                )
+                                content_payload.append(
+                                    {
+                                        "type": "image_url",
+                                        "role": "last_frame",
+                                        "image_url": {"url": remote_refs[-1]},
+                                    }
+                                )
+                            else:
+                                content_payload.append(
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {"url": remote_refs[0]},
+                                    }
+                                )
+                        elif "i2v" in model_lower:
+                            raise RuntimeError(
+                                "Volcengine i2v 模型需要可公网访问的 image_url 参数。"
                             )
+
+                        request_payload = {
+                            "model": target_model,
+                            "content": content_payload,
+                        }
+                        yield self._format_sse(
+                            "backend_log",
+                            f"Volcengine request: model={target_model}, content_items={len(content_payload)}",
+                        )
+                        yield self._format_sse(
+                            "status", f"Submitting video task to {target_model}..."
+                        )
+
+                        volc_headers = dict(headers)
+                        volc_headers["Content-Type"] = "application/json"
+                        response = rate_governor.call(governor_key, "video", lambda: http_request(
+                            "POST",
+                            api_url,
+                            json=request_payload,
+                            headers=volc_headers,
+                            timeout=60000,
+                            idempotent=bool(idem_header),
+                        ))
+                    else:
+                        if not image_refs:
                             yield self._format_sse(
-                                "status", f"Submitting video task to {target_model}..."
+                                "error", "未找到分镜参考图，请先生成分镜图后再试。"
                             )
+                            return
 
-                            volc_headers = dict(headers)
-                            volc_headers["Content-Type"] = "application/json"
-                            response = http_request(
+                        form_data = {
+                            "model": target_model,
+                            "prompt": f'{prompt}',
+                            "seconds": "15",
+                            "size": "1280x720",
+                            "watermark": False,
+                        }
+
+                        if mode == "keyframes":
+                            # 关键帧已在内存中编码，直接作为 multipart 内容上传
+                            # (每次请求重新构建，429 重新排队后重发仍是完整内容)
+                            def files_payload():
+                                return [
+                                    ("input_reference", (frame.filename, frame.as_file(), frame.mime_type))
+                                    for frame in image_refs
+                                ]
+
+                            yield self._format_sse("status", f"Submitting video task to {target_model}...")
+                            response = rate_governor.call(governor_key, "video", lambda: http_request(
                                 "POST",
                                 api_url,
-                                json=request_payload,
-                                headers=volc_headers,
+                                data=form_data,
+                                files=files_payload(),
+                                headers=headers,
                                 timeout=60000,
-                            )
+                                idempotent=bool(idem_header),
+                            ))
                         else:
-                            if not image_refs:
-                                yield self._format_sse(
-                                    "error", "未找到分镜参考图，请先生成分镜图后再试。"
-                                )
-                                return
-
-                            form_data = {
-                                "model": target_model,
-                                "prompt": f'{prompt}',
-                                "seconds": "15",
-                                "size": "1280x720",
-                                "watermark": False,
-                            }
-
-                            if mode == "keyframes":
-                                files_payload = []
-                                file_handles = []
-                                try:
-                                    for idx, img_path in enumerate(image_refs):
-                                        local_path = self._resolve_local_path(img_path) or img_path
-                                        if not local_path or not os.path.exists(local_path):
-                                            raise RuntimeError("无法读取关键帧参考图，请检查分镜图是否有效。")
-
-                                        mime_type = mimetypes.guess_type(local_path)[0] or "image/png"
-                                        ext = os.path.splitext(local_path)[1].lstrip(".") or "png"
-                                        filename = f"keyframe_{idx + 1}.{ext}"
-                                        file_handle = open(local_path, "rb")
-                                        file_handles.append(file_handle)
-                                        files_payload.append(
-                                            ("input_reference", (filename, file_handle, mime_type))
-                                        )
-
-                                    yield self._format_sse("status", f"Submitting video task to {target_model}...")
-                                    response = http_request(
-                                        "POST",
-                                        api_url,
-                                        data=form_data,
-                                        files=files_payload,
-                                        headers=headers,
-                                        timeout=60000
-                                    )
-                                finally:
-                                    for file_handle in file_handles:
-                                        try:
-                                            file_handle.close()
-                                        except Exception:
-                                            pass
-                            else:
-                                images_for_combine = [{ "data": image_refs, "direction": "horizontal"}]
-                                img_stream, mime_type = combine_image(images_for_combine, direction='vertical')
-                                ext = "png" if mime_type == "image/png" else "jpg"
-                                filename = f"template.{ext}"
-
-                                files_payload = {
-                                    "input_reference": (filename, img_stream, mime_type)
-                                }
-
-                                yield self._format_sse("status", f"Submitting video task to {target_model}...")
-                                response = http_request(
-                                    "POST",
-                                    api_url,
-                                    data=form_data,
-                                    files=files_payload,
-                                    headers=headers,
-                                    timeout=60000
-                                )
+                            refs = [
+                                image_variants.for_provider(ref, platform) if os.path.isfile(ref) else ref
+                                for ref in image_refs
+                            ]
+                            images_for_combine = [{ "data": refs, "direction": "horizontal"}]
+                            img_stream, mime_type = combine_image(images_for_combine, direction='vertical')
+                            ext = "png" if mime_type == "image/png" else "jpg"
+                            filename = f"template.{ext}"
 
-                        if response.status_code < 200 or response.status_code >= 300:
-                            raise RuntimeError(
-                                f"Video Provider Error ({response.status_code}): {response.text}"
-                            )
+                            def files_payload():
+                                img_stream.seek(0)
+                                return {"input_reference": (filename, img_stream, mime_type)}
 
-                        task_data = response.json() if response.content else {}
-                        if not isinstance(task_data, dict):
-                            raise RuntimeError(
-                                f"Unexpected task create response: {str(task_data)}"
-                            )
-                        task_id = (
-                            task_data.get("id")
-                            or task_data.get("task_id")
-                            or task_data.get("detail", {}).get("id")
-                            or task_data.get("data", {}).get("id")
-                            or task_data.get("data", {}).get("task_id")
-                            or task_data.get("data", {}).get("task", {}).get("id")
+                            yield self._format_sse("status", f"Submitting video task to {target_model}...")
+                            response = rate_governor.call(governor_key, "video", lambda: http_request(
+                                "POST",
+                                api_url,
+                                data=form_data,
+                                files=files_payload(),
+                                headers=headers,
+                                timeout=60000,
+                                idempotent=bool(idem_header),
+                            ))
+
+                    if key_pool.is_failover_status(response.status_code):
+                        raise key_pool.ProviderUnavailable(
+                            f"Video Provider Error ({response.status_code}): {response.text}"
                         )
-                finally:
-                    for temp_path in temp_files:
-                        try:
-                            os.unlink(temp_path)
-                        except Exception:
-                            pass
+                    if response.status_code < 200 or response.status_code >= 300:
+                        raise RuntimeError(
+                            f"Video Provider Error ({response.status_code}): {response.text}"
+                        )
+                    submitted = True
+                    key_pool.latency.record(governor_key, "video", time.monotonic() - call_started)
+
+                    task_data = response.json() if response.content else {}
+                    if not isinstance(task_data, dict):
+                        raise RuntimeError(
+                            f"Unexpected task create response: {str(task_data)}"
+                        )
+                    task_id = (
+                        task_data.get("id")
+                        or task_data.get("task_id")
+                        or task_data.get("detail", {}).get("id")
+                        or task_data.get("data", {}).get("id")
+                        or task_data.get("data", {}).get("task_id")
+                        or task_data.get("data", {}).get("task", {}).get("id")
+                    )
 
                 if should_poll_task:
                     if not task_id:
@@ -655,57 +862,31 @@ class AIEngine:
                     yield self._format_sse("backend_log", f"Video Poll URL: {poll_url}")
                     poll_headers = dict(headers)
                     poll_headers.pop("Content-Type", None)
+                    if idem_header:
+                        poll_headers.pop(idem_header, None)
                     poll_headers.update(download_headers())
                     poll_headers["Referer"] = ""
-                    
-                    max_retries = 10000
-                    for i in range(max_retries):
-                        time.sleep(5)
-                        yield from _bump_progress()
-                        try:
-                            poll_res = http_request("GET", poll_url, headers=poll_headers, timeout=30)
-                            if poll_res.status_code != 200:
-                                continue
-                                
-                            poll_data = poll_res.json()
-                            log_msg = f"[{poll_data.get('model')} - {poll_data.get('id')}]｜状态 - {poll_data.get('status')} ｜进度 - {poll_data.get('progress', 0)}%"
-                            logger.info(f"\n------------------------------------\n{log_msg}\n------------------------------------\n")
-                            yield self._format_sse("backend_log", log_msg)
-                            
-                            status = str(poll_data.get("status") or "").lower()
-                            completed_status = {"completed", "succeeded", "success", "done"}
-                            failed_status = {"failed", "error"}
-
-                            if status in completed_status:
-                                video_url = poll_data.get("video_url")
-                                if not video_url:
-                                    video_url = poll_data.get("detail", {}).get("draft_info", {}).get("downloadable_url")
-                                if not video_url:
-                                    video_url = poll_data.get("url")
-                                if not video_url and isinstance(poll_data.get("data"), dict):
-                                    video_url = (
-                                        poll_data["data"].get("video_url")
-                                        or poll_data["data"].get("url")
-                                    )
-                                
-                                if not video_url:
-                                    raise RuntimeError("Video completed but URL not found")
-                                
-                                yield self._format_sse("status", "Downloading video...")
-                                data = poll_data
-                                image_url = video_url 
-                                ext = "mp4"
-                                break
-                            elif status in failed_status:
-                                raise RuntimeError(f"Video generation failed: {poll_data.get('fail_reason', 'Unknown')}")
-                            else:
-                                yield self._format_sse("status", f"Generating video... ({status})")
-                        except Exception as e:
-                            logger.error(f"Polling error: {e}")
-                            yield self._format_sse("backend_log", f"Polling error: {str(e)}")
-                            continue
-                    else:
-                        raise RuntimeError("Video generation timed out")
+
+                    task_key = task_poller.submit(
+                        f"http:{poll_url}",
+                        lambda: self.check_video_task(poll_url, poll_headers),
+                        provider=urlparse(poll_url).netloc or "default",
+                        timeout=50000,
+                    )
+                    job_id = self._record_job(
+                        media_type, platform, api_key_record, base_url_str, str(task_id),
+                        prompt=prompt, style=style, data=data, poll_url=poll_url,
+                    )
+                    job_task_key = task_key
+                    final_update = yield from self._watch_video_task(task_key, _bump_progress)
+                    job_task_key = None
+                    if not generation_jobs.claim_for_attach(job_id):
+                        yield from self._finish_from_background(job_id, media_type, prompt)
+                        return
+                    yield self._format_sse("status", "Downloading video...")
+                    data = final_update.get("raw") or {}
+                    image_url = final_update.get("video_url")
+                    ext = "mp4"
 
             else:
                 target_model = model_name if model_name else "nano-banana"
@@ -738,44 +919,40 @@ class AIEngine:
                         template_base64 = to_base64(os.path.join(assets_dir, "static", "scene_template.png"))
                     
                     style_local_path = self._resolve_local_path(style.image_url) if style and style.image_url else None
-                    style_image_base64 = to_base64(style_local_path) if style_local_path else None
+                    style_image_base64 = (
+                        to_base64(image_variants.for_provider(style_local_path, platform)) if style_local_path else None
+                    )
 
                     reference_image_base64 = None
                     if data and data.get("reference_image"):
                         ref_local_path = self._resolve_local_path(data.get("reference_image"))
                         if ref_local_path:
-                            reference_image_base64 = to_base64(ref_local_path)
+                            reference_image_base64 = to_base64(image_variants.for_provider(ref_local_path, platform))
 
                     if category == "storyboard":
-                        grid_count = None
-                        if data:
-                            for key in ("storyboard_grid", "grid", "frame_count"):
-                                if data.get(key) is not None:
-                                    try:
-                                        grid_count = int(data.get(key))
-                                    except Exception:
-                                        grid_count = None
-                                    break
-                            if grid_count is None:
-                                mode = data.get("generation_mode")
-                                if mode == "single":
-                                    grid_count = 9
-                                elif mode == "keyframes":
-                                    grid_count = 9
+                        grid_count = self._storyboard_grid_count(data)
+                        if data and grid_count is None:
+                            mode = data.get("generation_mode")
+                            if mode == "single":
+                                grid_count = 9
+                            elif mode == "keyframes":
+                                grid_count = 9
                         if grid_count not in {6, 9}:
                             grid_count = 9
+                        # 记录宫格数，视频关键帧拆分时按实际布局切图
+                        extra_asset_meta["grid_count"] = grid_count
 
                         images = []
                         if data and data.get("context_characters"):
                             raw_char_imgs = [char.get("image_url") for char in data.get("context_characters")]
                             char_imgs = [self._resolve_local_path(url) for url in raw_char_imgs]
-                            char_imgs = [p for p in char_imgs if p]
+                            char_imgs = [image_variants.for_provider(p, platform) for p in char_imgs if p]
                             images.append({ "data": char_imgs, "direction": "horizontal" })
                             
                         if data and data.get("context_scenes"):
                             raw_scene_imgs = [scene.get("image_url") for scene in data.get("context_scenes")]
                             scene_imgs = [self._resolve_local_path(url) for url in raw_scene_imgs]
-                            scene_imgs = [p for p in scene_imgs if p]
+                            scene_imgs = [image_variants.for_provider(p, platform) for p in scene_imgs if p]
                             images.append({ "data": scene_imgs, "direction": "horizontal" })
 
                         if len(images) == 0:
@@ -807,13 +984,24 @@ class AIEngine:
     
                 yield self._format_sse("backend_log", "Submitting image generation request...")
 
+                call_started = time.monotonic()
                 response = yield from _run_with_progress(
-                    lambda: http_request("POST", api_url, json=payload, headers=headers, timeout=3000)
+                    lambda: rate_governor.call(
+                        governor_key, "image",
+                        lambda: http_request(
+                            "POST", api_url, json=payload, headers=headers, timeout=3000,
+                            idempotent=bool(idem_header),
+                        ),
+                    )
                 )
                 yield self._format_sse("backend_log", f"Response Status: {response.status_code}")
 
+                if key_pool.is_failover_status(response.status_code):
+                    raise key_pool.ProviderUnavailable(f"Provider Error ({response.status_code}): {response.text}")
                 if response.status_code != 200:
                     raise RuntimeError(f"Provider Error: {response.text}")
+                submitted = True
+                key_pool.latency.record(governor_key, "image", time.monotonic() - call_started)
 
                 data = response.json()
 
@@ -832,32 +1020,45 @@ class AIEngine:
 
             yield self._format_sse("status", "Downloading asset...")
             image_url = self._normalize_remote_url(image_url, base_url=base_url, response_data=data)
-            img_res = yield from _run_with_progress(
-                lambda: http_request("GET", image_url, timeout=600, headers=download_headers())
-            )
-            if img_res.status_code != 200:
-                raise RuntimeError("Failed to download asset")
             filename = f"{uuid.uuid4()}.{ext}"
             
             assets_dir = settings.ASSETS_DIR
             if not os.path.exists(assets_dir): os.makedirs(assets_dir)
                 
             filepath = os.path.join(assets_dir, filename)
-            logger.info(f"💾 Saving generated asset to: {filepath}")
+            logger.info(f"💾 Downloading generated asset to: {filepath}")
 
-            with open(filepath, "wb") as f:
-                f.write(img_res.content)
+            # 流式写盘，按实际字节数上报进度
+            download_base = progress_value[0]
+            download_iter = downloader.iter_download(
+                image_url, filepath, headers=download_headers(), keep_partial=False
+            )
+            while True:
+                try:
+                    dl_progress = next(download_iter)
+                except StopIteration as stop:
+                    download_result = stop.value
+                    break
+                if dl_progress.fraction is None:
+                    continue
+                download_pct = int(download_base + (99 - download_base) * dl_progress.fraction)
+                if download_pct > progress_value[0]:
+                    yield from _bump_progress(download_pct)
 
-            asset_url = f"/assets/{filename}"
+            asset_url = asset_store.put_file(filepath, ext, sha256=download_result.sha256)
+            logger.info(f"💾 Saved generated asset as: {asset_url}")
             asset_meta = {
                 "prompt": prompt,
                 "provider_prompt": provider_prompt if media_type == "image" else prompt,
                 "source_url": image_url,
+                "sha256": download_result.sha256,
+                "size": download_result.size,
             }
             if media_type == "video":
                 asset_meta["video_request_prompt"] = prompt
             if style and getattr(style, "image_url", None):
                 asset_meta["style_image_url"] = str(style.image_url)
+            asset_meta.update(extra_asset_meta)
             new_asset = Asset(
                 episode_id=self.episode.id if self.episode else 0,
                 type=media_type,
@@ -867,6 +1068,10 @@ class AIEngine:
             self.db.add(new_asset)
             self.db.commit()
             self.db.refresh(new_asset)
+            generation_jobs.update_job(
+                job_id, status=generation_jobs.JOB_ATTACHED, asset_id=new_asset.id,
+                result_url=str(image_url), progress=100,
+            )
             
             # 返回相对路径给前端，由前端根据运行环境解析
             full_display_url = asset_url
@@ -889,21 +1094,200 @@ class AIEngine:
 
         except GeneratorExit:
             logger.info(f"[AIEngine] Media stream '{media_type}' closed by caller.")
+            if job_id and job_task_key:
+                generation_jobs.adopt_job(job_id, job_task_key)
             return
         except Exception as e:
+            if not submitted and key_pool.is_failover_error(e):
+                key_pool.latency.record_failure(api_key_record.id if api_key_record else None, media_type)
+                if failover:
+                    raise key_pool.ProviderUnavailable(str(e)) from e
             logger.error(f"Generation Loop Error: {e}")
+            generation_jobs.update_job(job_id, status=generation_jobs.JOB_FAILED, error=str(e)[:2000])
             yield self._format_sse("error", f"Generation failed: {str(e)}")
 
+    def _finish_from_background(self, job_id: Optional[int], media_type: str, prompt: str):
+        """
+        The background poller claimed the job first (e.g. a provider callback
+        landed while we were watching): don't download it twice, report the
+        Asset it attaches instead.
+        """
+        yield self._format_sse("status", "Task finalized in background, waiting for asset...")
+        deadline = time.monotonic() + _BACKGROUND_ATTACH_WAIT
+        status, asset = generation_jobs.job_outcome(job_id)
+        while status == generation_jobs.JOB_DOWNLOADING and time.monotonic() < deadline:
+            time.sleep(1)
+            status, asset = generation_jobs.job_outcome(job_id)
+
+        if status == generation_jobs.JOB_FAILED:
+            raise RuntimeError("Background finalization failed")
+        yield self._format_sse("progress", 100)
+        yield self._format_sse("status", "Completed")
+        if asset is None:
+            # Still downloading: the job writes the result into the script item itself.
+            yield self._format_sse("backend_log", f"Job {job_id} is being finalized in background.")
+            yield self._format_sse("finish", {"job_id": job_id, "type": media_type, "background": True})
+            return
+        yield self._format_sse(
+            "finish",
+            {
+                "id": asset.id,
+                "url": asset.url,
+                "type": media_type,
+                "prompt": prompt,
+                "input_prompt": prompt,
+                "final_prompt": prompt,
+                "provider_prompt": prompt,
+                "video_request_prompt": prompt if media_type == "video" else "",
+                "job_id": job_id,
+                "background": True,
+            },
+        )
+
+    def _record_job(
+        self,
+        media_type: str,
+        platform: str,
+        api_key_record,
+        base_url: str,
+        task_id: str,
+        *,
+        prompt: str,
+        style=None,
+        data: Optional[dict] = None,
+        formatter: Optional[str] = None,
+        poll_url: Optional[str] = None,
+        callback_id: Optional[str] = None,
+    ) -> Optional[int]:
+        params = {"prompt": prompt}
+        if callback_id:
+            params["callback_id"] = callback_id
+        if style and getattr(style, "image_url", None):
+            params["style_image_url"] = str(style.image_url)
+        item_id = data.get("item_id") if isinstance(data, dict) else None
+        return generation_jobs.create_job(
+            user_id=self.user.id,
+            episode_id=self.episode.id if self.episode else None,
+            item_id=str(item_id) if item_id else None,
+            media_type=media_type,
+            provider=platform,
+            formatter=formatter,
+            key_id=api_key_record.id if api_key_record else None,
+            base_url=base_url,
+            task_id=str(task_id),
+            poll_url=poll_url,
+            params=params,
+        )
+
+    @staticmethod
+    def check_video_task(poll_url: str, poll_headers: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Single status check of an OpenAI-compatible / Volcengine video task,
+        normalized to the formatter `_query_status` shape for the task poller.
+        """
+        poll_res = http_request("GET", poll_url, headers=poll_headers, timeout=30)
+        if poll_res.status_code != 200:
+            raise RuntimeError(f"Poll request returned {poll_res.status_code}")
+
+        poll_data = poll_res.json()
+        if not isinstance(poll_data, dict):
+            raise RuntimeError(f"Unexpected poll response: {str(poll_data)[:200]}")
+        log_msg = f"[{poll_data.get('model')} - {poll_data.get('id')}]｜状态 - {poll_data.get('status')} ｜进度 - {poll_data.get('progress', 0)}%"
+        logger.info(f"\n------------------------------------\n{log_msg}\n------------------------------------\n")
+
+        status = str(poll_data.get("status") or "").lower()
+        if status in _VIDEO_COMPLETED_STATUS:
+            video_url = poll_data.get("video_url")
+            if not video_url:
+                video_url = poll_data.get("detail", {}).get("draft_info", {}).get("downloadable_url")
+            if not video_url:
+                video_url = poll_data.get("url")
+            if not video_url and isinstance(poll_data.get("data"), dict):
+                video_url = (
+                    poll_data["data"].get("video_url")
+                    or poll_data["data"].get("url")
+                )
+            if not video_url:
+                return {
+                    "status": "failed",
+                    "fail_reason": "Video completed but URL not found",
+                    "raw": poll_data,
+                    "log": log_msg,
+                }
+            return {
+                "status": "completed",
+                "progress": 100,
+                "video_url": video_url,
+                "raw": poll_data,
+                "log": log_msg,
+            }
+        if status in _VIDEO_FAILED_STATUS:
+            return {
+                "status": "failed",
+                "fail_reason": poll_data.get("fail_reason", "Unknown"),
+                "raw": poll_data,
+                "log": log_msg,
+            }
+        return {
+            "status": status or "processing",
+            "progress": poll_data.get("progress", 0),
+            "raw": poll_data,
+            "log": log_msg,
+        }
+
+    def _watch_video_task(self, task_key: str, bump_progress):
+        """
+        Relay updates of a task owned by the shared poller as SSE frames.
+        Returns the completed update; raises on failure / timeout.
+        """
+        final_update = None
+        for update in task_poller.watch(task_key):
+            if update is None:
+                yield from bump_progress()
+                continue
+
+            status = update.get("status")
+            if status == "polling_error":
+                yield self._format_sse("backend_log", f"Polling error: {update.get('error')}")
+                continue
+            if update.get("log"):
+                yield self._format_sse("backend_log", update["log"])
+            if status in TERMINAL_STATUSES:
+                final_update = update
+                break
+
+            yield from bump_progress(update.get("progress"))
+            yield self._format_sse("status", f"Generating video... ({status})")
+
+        if not final_update or final_update.get("status") == "timeout":
+            raise RuntimeError("Video generation timed out")
+        if final_update.get("status") != "completed":
+            raise RuntimeError(f"Video generation failed: {final_update.get('fail_reason') or 'Unknown'}")
+        return final_update
+
     def generate_stream(self, prompt: str, tool_name: str, **kwargs):
         try:
-            client, model, _, _, _ = self._init_client_and_model(type="text")
+            candidates, policy = self._key_candidates("text")
+            client, model, _, _, api_key_record = self._init_client_and_model(
+                type="text", api_key_record=candidates[0] if candidates else None
+            )
             if not client:
                 yield self._format_sse("error", "No API Key configured for text generation")
                 return
             if not model:
                 yield self._format_sse("error", "No model selected for text generation")
                 return
-            self.client = client
+            pooled = [(api_key_record.id if api_key_record else None, client)]
+            for record in candidates[1:]:
+                try:
+                    pool_client = self._init_client_and_model(type="text", api_key_record=record)[0]
+                except HTTPException as e:
+                    logger.warning(f"[KeyPool] Skipping key {record.id}: {e.detail}")
+                    continue
+                if pool_client:
+                    pooled.append((record.id, pool_client))
+            # Each LLM call takes a rate-governor slot for the key it runs on.
+            self.client = key_pool.PooledChatClient(pooled, policy)
             self.model_name = model
 
             yield self._format_sse("status", "Initializing AI Director...")
@@ -946,7 +1330,10 @@ class AIEngine:
                 tool_name, skill_args, client=self.client, model_name=self.model_name
             )
 
-            final_output_accumulator = yield from self._priint_at_director_console(tool_name, director_gen)
+            section_parser = ScriptSectionParser(_SCRIPT_SECTIONS[tool_name]) if tool_name in _SCRIPT_SECTIONS else None
+            final_output_accumulator = yield from self._priint_at_director_console(
+                tool_name, director_gen, section_parser=section_parser
+            )
 
             if not final_output_accumulator:
                 yield self._format_sse("error", "No output from AI Director")
@@ -955,6 +1342,7 @@ class AIEngine:
             yield from self._submit(
                 tool_name=tool_name,
                 final_output_accumulator=final_output_accumulator,
+                section_parser=section_parser,
             )
 
         except GeneratorExit:
@@ -963,16 +1351,34 @@ class AIEngine:
         except Exception as e:
             yield self._format_sse("error", f"Execution error: {str(e)}")
 
-    def _priint_at_director_console(self, tool_name, director_gen):
-        final_output_accumulator = ""
+    def _priint_at_director_console(self, tool_name, director_gen, section_parser: Optional[ScriptSectionParser] = None):
+        output_parts: List[str] = []
+        coalescer = TokenCoalescer(settings.SSE_COALESCE_MS, settings.SSE_COALESCE_BYTES)
         
         logger.info(f"[AI Director] Listening to stream from {tool_name}...")
         
         start_time = time.time()
         last_progress = 0
 
+        def emit_thought(text):
+            if not text:
+                return
+            yield self._format_text_sse("thought", text)
+            if section_parser:
+                # Hand each script section to the client as soon as it closes.
+                for section, data in section_parser.feed(text):
+                    logger.info(f"[AI Director] Section '{section}' ready after {time.time() - start_time:.1f}s")
+                    yield self._format_sse("partial", {"tool": tool_name, "section": section, "data": data})
+
+        # With a coalescing window, read the model on a pump thread so held text
+        # is flushed when the window expires, not only when the next token comes.
+        source = sse.pump(director_gen, coalescer.due_in) if coalescer.window else director_gen
         try:
-            for chunk in director_gen:
+            for chunk in source:
+                if chunk is sse.TICK:
+                    yield from emit_thought(coalescer.flush())
+                    continue
+
                 # Time-based progress simulation: 1% per second
                 elapsed = time.time() - start_time
                 current_progress = min(int(elapsed), 98) # Cap at 98%
@@ -988,20 +1394,29 @@ class AIEngine:
                 msg_type = chunk.get("type")
                 content = chunk.get("content", "")
 
+                if msg_type == "token":
+                    output_parts.append(content)
+                    yield from emit_thought(coalescer.add(content))
+                    continue
+
+                # Other events must not overtake text still held by the coalescer.
+                yield from emit_thought(coalescer.flush())
                 if msg_type == "status":
                     yield self._format_sse("status", content)
                     yield self._format_sse("backend_log", f"[{tool_name}] Status: {content}")
-                elif msg_type == "token":
-                    final_output_accumulator += content
-                    yield self._format_sse("thought", content)
                 elif msg_type == "error":
                     logger.error(f"[{tool_name}] Error: {content}")
                     yield self._format_sse("error", f"[{tool_name}] {content}")
                     yield self._format_sse("backend_log", f"[{tool_name}] ERROR: {content}")
+            yield from emit_thought(coalescer.flush())
         except GeneratorExit:
             logger.info(f"[AI Director] Stream for {tool_name} closed by caller.")
-            return final_output_accumulator
+            return "".join(output_parts)
+        finally:
+            if source is not director_gen:
+                source.close()
 
+        final_output_accumulator = "".join(output_parts)
         logger.info(f"[AI Director] Stream finished. Total length: {len(final_output_accumulator)}")
         return final_output_accumulator
 
@@ -1221,7 +1636,25 @@ class AIEngine:
 
         return merged
 
-    def _submit(self, tool_name: str, final_output_accumulator: str):
+    def _parse_script_output(self, tool_name: str, text: str, section_parser: Optional[ScriptSectionParser] = None):
+        """
+        The whole-text parse is the base, so a section the stream could not
+        close (missing `_END` tag) is still kept; sections already parsed
+        while streaming are applied over it.
+        """
+        streamed = section_parser.merged() if section_parser else {}
+        json_match = self._get_json_block(text=text)
+        if not streamed:
+            tag_match = self._get_tag_block(text=text, tag_map=_SCRIPT_SECTIONS[tool_name])
+            if not tag_match:
+                raise ValueError(f"[{tool_name}] 模型未返回任何内容或格式错误！")
+            if not json_match:
+                raise ValueError(f"[{tool_name}] 模型返回内容格式错误！")
+        parsed_data = json.loads(json_match) if json_match else {}
+        parsed_data.update(streamed)
+        return parsed_data
+
+    def _submit(self, tool_name: str, final_output_accumulator: str, section_parser: Optional[ScriptSectionParser] = None):
         try:
             if not final_output_accumulator:
                 raise ValueError(f"[{tool_name}] 模型未返回任何内容！")
@@ -1231,45 +1664,22 @@ class AIEngine:
 
             # short_video_storyboard_maker"
             if tool_name == "short-video-storyboard-maker":
-                json_match = self._get_json_block(text=final_output_accumulator)
-                tag_match = self._get_tag_block(text=final_output_accumulator, tag_map={
-                    "STORYBOARD": "storyboard",
-                })
-                if not tag_match:
-                    raise ValueError(f"[{tool_name}] 模型未返回任何内容或格式错误！")
-                if not json_match:
-                    raise ValueError(f"[{tool_name}] 模型返回内容格式错误！")
-                
+                parsed_data = self._parse_script_output(tool_name, final_output_accumulator, section_parser)
                 try:
-                    parsed_data = json.loads(json_match)
                     if "storyboard" in parsed_data:
                         parsed_data["storyboard"] = self._inject_ids(parsed_data["storyboard"], "shot")
                     parsed_data = sanitize_think_payload(parsed_data)
-                    json_match = json.dumps(parsed_data)
                 except:
                     pass
 
-                yield self._format_sse("finish", {"json": json_match})
+                yield self._format_sse("finish", {"json": json.dumps(parsed_data)})
                 yield self._format_sse("status", "Completed")
-                yield from self.save_episode(key="generated_script.storyboard", value=json.loads(json_match)["storyboard"], type='add')
+                yield from self.save_episode(key="generated_script.storyboard", value=parsed_data["storyboard"], type='add')
                 
             # short_video_screenwriter
             elif tool_name == "short-video-screenwriter":
-                json_match = self._get_json_block(text=final_output_accumulator)
-                tag_match = self._get_tag_block(text=final_output_accumulator, tag_map={
-                    "META": "meta",
-                    "OUTLINE": "outline",
-                    "CHARACTERS": "characters",
-                    "SCENES": "scenes",
-                    "STORYBOARD": "storyboard",
-                })
-                if not tag_match:
-                    raise ValueError(f"[{tool_name}] 模型未返回任何内容或格式错误！")
-                if not json_match:
-                    raise ValueError(f"[{tool_name}] 模型返回内容格式错误！")
-                
+                parsed_data = self._parse_script_output(tool_name, final_output_accumulator, section_parser)
                 try:
-                    parsed_data = json.loads(json_match)
                     # Merge characters/scenes with existing project assets
                     existing_assets = self._collect_project_assets()
                     existing_script = {}
@@ -1303,13 +1713,12 @@ class AIEngine:
                     if "storyboard" in parsed_data:
                         parsed_data["storyboard"] = self._inject_ids(parsed_data["storyboard"], "shot")
                     parsed_data = sanitize_think_payload(parsed_data)
-                    json_match = json.dumps(parsed_data)
                 except:
                     pass
 
-                yield self._format_sse("finish", {"json": json_match})
+                yield self._format_sse("finish", {"json": json.dumps(parsed_data)})
                 yield self._format_sse("status", "Completed")
-                self.save_episode(key="generated_script", value=json.loads(json_match))
+                self.save_episode(key="generated_script", value=parsed_data)
             
             # other tools
             else:
@@ -0,0 +1,295 @@
+"""
+Batch media generation for script items.
+
+One request generates images (or videos) for many `generated_script` items
+concurrently, each on its own worker thread / DB session / AIEngine, and
+multiplexes every item's SSE events onto a single stream tagged with
+`item_id`. Results are written back into the episode in one transaction once
+all items are done (or the client goes away).
+"""
+import json
+import logging
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.director_trace import DirectorTrace
+from app.db.session import SessionLocal
+from app.models.project import Episode
+from app.models.style import Style
+from app.models.user import User
+from app.services.ai_engine import AIEngine
+from app.services.generation_jobs import attach_to_script_items
+
+logger = logging.getLogger(__name__)
+
+_LIST_CATEGORIES = (
+    ("characters", "character"),
+    ("scenes", "scene"),
+    ("storyboard", "storyboard"),
+)
+_DONE = object()
+
+
+def _sse(event_type: str, payload: Any, item_id: Optional[str] = None) -> str:
+    body: Dict[str, Any] = {"type": event_type, "payload": payload}
+    if item_id is not None:
+        body["item_id"] = item_id
+    return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+
+def _parse_sse(chunk: str) -> Optional[Dict[str, Any]]:
+    if not chunk.startswith("data: "):
+        return None
+    try:
+        return json.loads(chunk[6:].strip())
+    except ValueError:
+        return None
+
+
+def build_item_request(
+    script_data: dict, item_id: str, media_type: str, generation_mode: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Prompt + data for one script item, mirroring what the workbench sends
+    for a single-item generation.
+    """
+    item = None
+    category = None
+    for list_key, list_category in _LIST_CATEGORIES:
+        for candidate in script_data.get(list_key) or []:
+            if isinstance(candidate, dict) and str(candidate.get("id")) == item_id:
+                item, category = candidate, list_category
+                break
+        if item:
+            break
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"Script item '{item_id}' not found")
+
+    prompt = str(item.get("visual_prompt") or item.get("description") or item.get("action") or "")
+    if not prompt.strip():
+        raise HTTPException(status_code=400, detail=f"Script item '{item_id}' has no prompt")
+
+    characters = script_data.get("characters") or []
+    scenes = script_data.get("scenes") or []
+    data: Dict[str, Any] = {
+        "category": category,
+        "context_characters": [c for c in characters if c.get("id") and c["id"] in prompt],
+        "context_scenes": [s for s in scenes if s.get("id") and s["id"] in prompt],
+        "item_id": item_id,
+    }
+    if generation_mode:
+        data["generation_mode"] = generation_mode
+    if category != "storyboard" and item.get("reference_image"):
+        data["reference_image"] = item["reference_image"]
+    if media_type == "video":
+        if not item.get("image_url"):
+            raise HTTPException(status_code=400, detail=f"Script item '{item_id}' has no image yet")
+        data["input_reference"] = item["image_url"]
+
+    return {"item_id": item_id, "prompt": prompt, "data": data}
+
+
+class BatchGeneration:
+    def __init__(
+        self,
+        user_id: int,
+        episode_id: int,
+        media_type: str,
+        items: List[Dict[str, Any]],
+        concurrency: Optional[int] = None,
+        skipped: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.batch_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.episode_id = episode_id
+        self.media_type = media_type
+        self.items = items
+        self.skipped = skipped or []
+        limit = concurrency or settings.BATCH_GENERATE_CONCURRENCY
+        self.concurrency = max(1, min(limit, settings.BATCH_GENERATE_MAX_CONCURRENCY, len(items) or 1))
+        self._events: "queue.Queue" = queue.Queue()
+        self._cancel = threading.Event()
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._results_lock = threading.Lock()
+
+    # ---------- workers ----------
+
+    def _run_item(self, request: Dict[str, Any]):
+        item_id = request["item_id"]
+        if self._cancel.is_set():
+            self._set_result(item_id, {"status": "cancelled"})
+            return
+
+        db = SessionLocal()
+        stream = None
+        status: Dict[str, Any] = {"status": "failed", "error": "No result"}
+        trace = DirectorTrace(run_id=f"batch_{self.batch_id}_{item_id}")
+        try:
+            user = db.query(User).filter(User.id == self.user_id).first()
+            episode = db.query(Episode).filter(Episode.id == self.episode_id).first()
+            if not user or not episode:
+                raise RuntimeError("Episode not found")
+
+            trace.start({
+                "user_id": self.user_id,
+                "episode_id": self.episode_id,
+                "type": self.media_type,
+                "batch_id": self.batch_id,
+                "item_id": item_id,
+                "prompt_length": len(request["prompt"]),
+                "prompt_preview": request["prompt"][:240],
+            })
+            engine = AIEngine(db, user, episode.ai_config)
+            engine.set_context(episode)
+            engine.set_trace(trace)
+
+            style = None
+            style_cfg = (episode.ai_config or {}).get("style") or {}
+            if style_cfg.get("id"):
+                style = db.query(Style).filter(Style.id == style_cfg["id"]).first()
+
+            self._events.put(_sse("item_start", {"prompt": request["prompt"]}, item_id))
+            stream = engine.generate_media_stream(
+                media_type=self.media_type,
+                prompt=request["prompt"],
+                data=request["data"],
+                style=style,
+            )
+            for chunk in stream:
+                if self._cancel.is_set():
+                    status = {"status": "cancelled"}
+                    break
+                event = _parse_sse(chunk)
+                if event is None:
+                    continue
+                self._events.put(_sse(event.get("type"), event.get("payload"), item_id))
+                if event.get("type") == "finish" and isinstance(event.get("payload"), dict):
+                    status = {"status": "completed", "result": event["payload"]}
+                elif event.get("type") == "error":
+                    status = {"status": "failed", "error": event.get("payload")}
+        except Exception as e:
+            logger.error(f"[Batch] Item {item_id} failed: {e}")
+            status = {"status": "failed", "error": str(e)}
+        finally:
+            if stream is not None:
+                # Lets the engine hand running video tasks to the background poller.
+                stream.close()
+            trace.finish(
+                status=status["status"],
+                error=str(status.get("error")) if status.get("error") else None,
+            )
+            db.close()
+            self._set_result(item_id, status)
+            self._events.put(_sse("item_done", self._public_status(item_id, status), item_id))
+
+    def _set_result(self, item_id: str, status: Dict[str, Any]):
+        with self._results_lock:
+            self._results[item_id] = status
+
+    def _public_status(self, item_id: str, status: Dict[str, Any]) -> Dict[str, Any]:
+        result = status.get("result") or {}
+        return {
+            "item_id": item_id,
+            "status": status["status"],
+            "url": result.get("url"),
+            "error": status.get("error"),
+        }
+
+    # ---------- write-back ----------
+
+    def _write_back(self) -> int:
+        with self._results_lock:
+            completed = [
+                (item_id, status["result"])
+                for item_id, status in self._results.items()
+                if status["status"] == "completed"
+            ]
+        if not completed:
+            return 0
+
+        updates = []
+        for item_id, result in completed:
+            if not result.get("url"):
+                # Finalized by the background job, which attaches it itself.
+                continue
+            if self.media_type == "video":
+                prompt = result.get("video_request_prompt") or result.get("prompt") or ""
+            else:
+                prompt = result.get("provider_prompt") or result.get("final_prompt") or ""
+            updates.append({"item_id": item_id, "media_type": self.media_type, "url": result["url"], "prompt": prompt})
+
+        db = SessionLocal()
+        try:
+            episode = db.query(Episode).filter(Episode.id == self.episode_id).first()
+            if not episode:
+                return 0
+            attached = attach_to_script_items(db, episode, updates)
+            db.commit()
+            return attached
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[Batch] Write-back for batch {self.batch_id} failed: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def _safe_write_back(self) -> int:
+        try:
+            return self._write_back()
+        except Exception as e:
+            logger.error(f"[Batch] Write-back for batch {self.batch_id} failed: {e}")
+            return 0
+
+    # ---------- stream ----------
+
+    def stream(self) -> Iterator[str]:
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-gen")
+        futures = [pool.submit(self._run_item, request) for request in self.items]
+
+        def _watch():
+            for future in futures:
+                future.result()
+            self._events.put(_DONE)
+
+        threading.Thread(target=_watch, daemon=True, name="batch-gen-watch").start()
+        finished = False
+        try:
+            yield _sse("batch_start", {
+                "batch_id": self.batch_id,
+                "items": [r["item_id"] for r in self.items],
+                "skipped": self.skipped,
+                "concurrency": self.concurrency,
+            })
+            while True:
+                event = self._events.get()
+                if event is _DONE:
+                    break
+                yield event
+
+            attached = self._safe_write_back()
+            finished = True
+            with self._results_lock:
+                statuses = [self._public_status(k, v) for k, v in self._results.items()]
+            yield _sse("batch_finish", {
+                "batch_id": self.batch_id,
+                "total": len(self.items),
+                "succeeded": sum(1 for s in statuses if s["status"] == "completed"),
+                "failed": sum(1 for s in statuses if s["status"] == "failed"),
+                "attached": attached,
+                "results": statuses,
+            })
+        finally:
+            if not finished:
+                # Client went away: stop starting new items, keep what is done.
+                logger.info(f"[Batch] Batch {self.batch_id} closed by caller.")
+                self._cancel.set()
+                pool.shutdown(wait=True, cancel_futures=True)
+                self._safe_write_back()
+            else:
+                pool.shutdown(wait=False)
@@ -0,0 +1,203 @@
+"""
+Registry of warm provider clients and ApiKey snapshots.
+
+Building an `OpenAI(...)` client per request means a fresh httpx pool, a new
+TLS handshake and an ApiKey query before the first token. The registry keeps
+one client per (key id, base URL, credential hash) and a detached snapshot
+of each ApiKey row, so repeat requests reuse keep-alive connections.
+
+`invalidate()` is called when a key is updated or deleted. Besides clearing
+this process' caches it bumps a version file that every worker checks on
+lookup, so the other uvicorn workers drop their copies too.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from openai import OpenAI
+
+from app.core.config import settings
+from app.utils.ollama_client import OllamaClient
+from app.utils.path_utils import get_writable_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class KeySnapshot:
+    """Detached copy of an ApiKey row (same attribute names)."""
+
+    id: int
+    user_id: int
+    platform: Optional[str]
+    name: Optional[str]
+    encrypted_key: Optional[str]
+    base_url: Optional[str]
+    text_endpoint: Optional[str]
+    image_endpoint: Optional[str]
+    video_endpoint: Optional[str]
+    video_fetch_endpoint: Optional[str]
+    audio_endpoint: Optional[str]
+
+    @classmethod
+    def from_record(cls, record: Any) -> "KeySnapshot":
+        return cls(
+            id=record.id,
+            user_id=record.user_id,
+            platform=record.platform,
+            name=record.name,
+            encrypted_key=record.encrypted_key,
+            base_url=record.base_url,
+            text_endpoint=record.text_endpoint,
+            image_endpoint=record.image_endpoint,
+            video_endpoint=record.video_endpoint,
+            video_fetch_endpoint=record.video_fetch_endpoint,
+            audio_endpoint=record.audio_endpoint,
+        )
+
+
+def _credential_hash(secret: Optional[str]) -> str:
+    return hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ClientRegistry:
+    def __init__(self, max_clients: int, version_path: str):
+        self.max_clients = max(1, max_clients)
+        self.version_path = version_path
+        self._clients: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._keys: Dict[Tuple[int, int], KeySnapshot] = {}
+        self._lock = threading.Lock()
+        self._seen_version: Optional[int] = None
+        self._hits = 0
+        self._misses = 0
+
+    # ---------- cross-worker invalidation ----------
+
+    def _current_version(self) -> int:
+        try:
+            return os.stat(self.version_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _sync(self):
+        """Drop everything if another worker invalidated since we last looked."""
+        version = self._current_version()
+        with self._lock:
+            if self._seen_version is None:
+                self._seen_version = version
+            elif version != self._seen_version:
+                self._seen_version = version
+                self._keys.clear()
+                self._clients.clear()
+
+    def invalidate(self, key_id: Optional[int] = None):
+        """
+        Forget a key's snapshot and clients (all keys when `key_id` is None).
+        Clients are only dropped, not closed: an in-flight stream may still
+        hold one, and it closes itself once released.
+        """
+        with self._lock:
+            if key_id is None:
+                self._keys.clear()
+                self._clients.clear()
+            else:
+                for cache_key in [k for k in self._keys if k[1] == key_id]:
+                    self._keys.pop(cache_key, None)
+                for cache_key in [k for k in self._clients if k[1] == key_id]:
+                    self._clients.pop(cache_key, None)
+        try:
+            os.makedirs(os.path.dirname(self.version_path), exist_ok=True)
+            with open(self.version_path, "a"):
+                pass
+            os.utime(self.version_path, None)
+        except OSError as e:
+            logger.warning(f"[Clients] Could not signal other workers: {e}")
+        with self._lock:
+            self._seen_version = self._current_version()
+
+    # ---------- ApiKey snapshots ----------
+
+    def get_keys(self, db, user_id: int, key_ids: Iterable[Any]) -> Dict[int, KeySnapshot]:
+        from app.models.apikey import ApiKey
+
+        self._sync()
+        wanted = []
+        for key_id in key_ids:
+            try:
+                wanted.append(int(key_id))
+            except (TypeError, ValueError):
+                continue
+        found: Dict[int, KeySnapshot] = {}
+        missing = []
+        with self._lock:
+            for key_id in wanted:
+                snapshot = self._keys.get((user_id, key_id))
+                if snapshot is not None:
+                    found[key_id] = snapshot
+                else:
+                    missing.append(key_id)
+        if missing:
+            rows = db.query(ApiKey).filter(ApiKey.id.in_(missing), ApiKey.user_id == user_id).all()
+            with self._lock:
+                for row in rows:
+                    snapshot = KeySnapshot.from_record(row)
+                    self._keys[(user_id, row.id)] = snapshot
+                    found[row.id] = snapshot
+        return found
+
+    def get_key(self, db, user_id: int, key_id: Any) -> Optional[KeySnapshot]:
+        try:
+            return self.get_keys(db, user_id, [key_id]).get(int(key_id))
+        except (TypeError, ValueError):
+            return None
+
+    # ---------- clients ----------
+
+    def _get_client(self, cache_key: Tuple, factory):
+        self._sync()
+        with self._lock:
+            client = self._clients.get(cache_key)
+            if client is not None:
+                self._clients.move_to_end(cache_key)
+                self._hits += 1
+                return client
+            self._misses += 1
+        client = factory()
+        with self._lock:
+            existing = self._clients.get(cache_key)
+            if existing is not None:
+                return existing
+            self._clients[cache_key] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        return client
+
+    def openai_client(self, key: KeySnapshot, base_url: str, api_key: str) -> OpenAI:
+        cache_key = ("openai", key.id, base_url, _credential_hash(api_key))
+        return self._get_client(cache_key, lambda: OpenAI(api_key=api_key, base_url=base_url))
+
+    def ollama_client(self, key: KeySnapshot, base_url: str, api_key: str, chat_endpoint: str) -> OllamaClient:
+        cache_key = ("ollama", key.id, base_url, _credential_hash(api_key), chat_endpoint)
+        return self._get_client(
+            cache_key,
+            lambda: OllamaClient(base_url=base_url, api_key=api_key, chat_endpoint=chat_endpoint),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "keys": len(self._keys),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+registry = ClientRegistry(
+    max_clients=settings.CLIENT_REGISTRY_MAX_CLIENTS,
+    version_path=get_writable_path(os.path.join("cache", "apikeys.version")),
+)
@@ -0,0 +1,392 @@
+"""
+Durable bookkeeping for provider-side generation jobs.
+
+Every remote video task gets a `GenerationJob` row as soon as the provider
+returns a task id. If the SSE client goes away, or the process restarts, the
+job is handed to the shared task poller and the finished video is downloaded
+and attached to the episode without spending generation time again.
+
+Each job records the process that owns it ("host:pid"). With several
+workers sharing one database, a worker starting up only resumes jobs whose
+owner process is gone, never ones another live worker is still streaming.
+"""
+import copy
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm.attributes import flag_modified
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.apikey import ApiKey
+from app.models.asset import Asset
+from app.models.generation_job import GenerationJob
+from app.models.project import Episode
+from app.services.task_poller import poller
+from app.utils import asset_store, downloader
+from app.utils.process_utils import pid_alive
+from app.utils.http_client import download_headers
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNNING = "running"
+JOB_DOWNLOADING = "downloading"
+JOB_ATTACHED = "attached"
+JOB_FAILED = "failed"
+
+# Jobs older than this are not worth resuming: providers purge results.
+_RESUME_MAX_AGE = timedelta(hours=24)
+
+
+def current_owner() -> str:
+    # Not cached: forked workers must not inherit the parent's pid.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """Whether another process on this host still holds the job."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # Our pid, but we are only starting up: a previous process with the
+        # same pid (container restart) left it behind.
+        return False
+    return pid_alive(int(pid))
+
+
+def create_job(**fields: Any) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        job = GenerationJob(status=JOB_RUNNING, owner=current_owner(), **fields)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job.id
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[Jobs] Failed to record generation job: {e}")
+        return None
+    finally:
+        db.close()
+
+
+def update_job(job_id: Optional[int], **fields: Any):
+    if not job_id:
+        return
+    db = SessionLocal()
+    try:
+        db.query(GenerationJob).filter(GenerationJob.id == job_id).update(
+            fields, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[Jobs] Failed to update job {job_id}: {e}")
+    finally:
+        db.close()
+
+
+def _claim(db, job_id: int, from_status: str, to_status: str) -> bool:
+    """Atomic status transition so only one worker finalizes a job."""
+    claimed = (
+        db.query(GenerationJob)
+        .filter(GenerationJob.id == job_id, GenerationJob.status == from_status)
+        .update({"status": to_status}, synchronize_session=False)
+    )
+    db.commit()
+    return claimed == 1
+
+
+def claim_for_attach(job_id: Optional[int]) -> bool:
+    """Called by the live SSE path before it downloads the finished video."""
+    if not job_id:
+        return True
+    db = SessionLocal()
+    try:
+        return _claim(db, job_id, JOB_RUNNING, JOB_DOWNLOADING)
+    except Exception as e:
+        logger.error(f"[Jobs] Failed to claim job {job_id}: {e}")
+        return True
+    finally:
+        db.close()
+
+
+def job_outcome(job_id: Optional[int]) -> Tuple[Optional[str], Optional[Asset]]:
+    """Current status of a job and its Asset once attached."""
+    if not job_id:
+        return None, None
+    db = SessionLocal()
+    try:
+        job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+        if not job:
+            return None, None
+        asset = None
+        if job.status == JOB_ATTACHED and job.asset_id:
+            asset = db.query(Asset).filter(Asset.id == job.asset_id).first()
+            if asset is not None:
+                db.expunge(asset)
+        return job.status, asset
+    except Exception as e:
+        logger.error(f"[Jobs] Failed to read job {job_id}: {e}")
+        return None, None
+    finally:
+        db.close()
+
+
+def adopt_job(job_id: Optional[int], task_key: str):
+    """
+    The SSE client disconnected while the provider task is still running:
+    let the poller finish it in the background.
+    """
+    if not job_id:
+        return
+    db = SessionLocal()
+    try:
+        # Disconnected mid-download: hand the download back as well.
+        _claim(db, job_id, JOB_DOWNLOADING, JOB_RUNNING)
+    except Exception as e:
+        logger.error(f"[Jobs] Failed to release job {job_id}: {e}")
+    finally:
+        db.close()
+    if not poller.attach(task_key, lambda update: finalize_job(job_id, update)):
+        logger.warning(f"[Jobs] Task {task_key} for job {job_id} is no longer tracked; will resume on restart.")
+        return
+    logger.info(f"[Jobs] Job {job_id} adopted by background poller.")
+
+
+def _download_to_assets(job: GenerationJob, url: str, ext: str):
+    # Stable per-job filename so a restart resumes the same partial file.
+    filename = f"{uuid.uuid5(uuid.NAMESPACE_URL, f'generation_job:{job.id}')}.{ext}"
+    filepath = os.path.join(settings.ASSETS_DIR, filename)
+    result = downloader.download(url, filepath, headers=download_headers())
+    return asset_store.put_file(filepath, ext, sha256=result.sha256), result
+
+
+def attach_to_script_items(db, episode: Episode, results: List[Dict[str, Any]]) -> int:
+    """
+    Write generated media back into `generated_script` items. Each result is
+    {"item_id", "media_type", "url", "prompt"}. The caller commits.
+    """
+    if not results or not episode.ai_config or "generated_script" not in episode.ai_config:
+        return 0
+    current_config = copy.deepcopy(dict(episode.ai_config))
+    script_data = current_config.get("generated_script") or {}
+    by_id = {
+        item.get("id"): item
+        for list_key in ("storyboard", "characters", "scenes")
+        for item in script_data.get(list_key) or []
+        if isinstance(item, dict) and item.get("id")
+    }
+
+    attached = 0
+    for result in results:
+        item = by_id.get(result.get("item_id"))
+        if item is None:
+            continue
+        is_video = result.get("media_type") == "video"
+        item["video_url" if is_video else "image_url"] = result["url"]
+        if result.get("prompt"):
+            item["video_generation_prompt" if is_video else "generation_prompt"] = result["prompt"]
+        attached += 1
+
+    if attached:
+        episode.ai_config = current_config
+        flag_modified(episode, "ai_config")
+        db.add(episode)
+    return attached
+
+
+def finalize_job(job_id: int, update: Dict[str, Any]):
+    """
+    Poller completion callback for jobs nobody is watching: download the
+    result, create the Asset and write it back into the target script item.
+    """
+    db = SessionLocal()
+    try:
+        if not _claim(db, job_id, JOB_RUNNING, JOB_DOWNLOADING):
+            return
+        job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+        if not job:
+            return
+
+        status = update.get("status")
+        result_url = update.get("video_url")
+        if status != "completed" or not result_url:
+            job.status = JOB_FAILED
+            job.error = str(update.get("fail_reason") or status or "Unknown")[:2000]
+            db.commit()
+            logger.info(f"[Jobs] Job {job_id} ended without result: {job.error}")
+            return
+
+        job.result_url = str(result_url)
+        job.progress = 100
+        db.commit()
+
+        asset_url, download_result = _download_to_assets(
+            job, job.result_url, "mp4" if job.media_type == "video" else "png"
+        )
+        params = job.params if isinstance(job.params, dict) else {}
+        prompt = str(params.get("prompt") or "")
+        asset_meta = {
+            "prompt": prompt,
+            "provider_prompt": prompt,
+            "source_url": job.result_url,
+            "sha256": download_result.sha256,
+            "size": download_result.size,
+            "job_id": job.id,
+        }
+        if job.media_type == "video":
+            asset_meta["video_request_prompt"] = prompt
+        if params.get("style_image_url"):
+            asset_meta["style_image_url"] = params["style_image_url"]
+
+        asset = Asset(
+            episode_id=job.episode_id or 0,
+            type=job.media_type,
+            url=asset_url,
+            meta_data=asset_meta,
+        )
+        db.add(asset)
+        db.flush()
+
+        if job.episode_id and job.item_id:
+            episode = db.query(Episode).filter(Episode.id == job.episode_id).first()
+            if episode:
+                attach_to_script_items(db, episode, [{
+                    "item_id": job.item_id,
+                    "media_type": job.media_type,
+                    "url": asset_url,
+                    "prompt": prompt,
+                }])
+
+        job.status = JOB_ATTACHED
+        job.asset_id = asset.id
+        db.commit()
+        logger.info(f"[Jobs] Job {job_id} attached as asset {asset.id} ({asset_url})")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[Jobs] Failed to finalize job {job_id}: {e}")
+        # Leave it resumable: the next startup retries the download.
+        update_job(job_id, status=JOB_RUNNING, error=str(e)[:2000])
+    finally:
+        db.close()
+
+
+def _resume_job(job: GenerationJob, api_key: ApiKey) -> bool:
+    # Imported lazily: ai_engine imports this module.
+    from app.services.ai_engine import AIEngine
+    from app.utils.sora_api.main import SoraApiFormatter
+
+    real_key = api_key.encrypted_key or ""
+    job_id = job.id
+
+    if job.formatter:
+        formatter = SoraApiFormatter.search(job.base_url or "")
+        if not formatter or formatter.name != job.formatter or not formatter.resumable:
+            return False
+        formatter.set_auth(job.base_url or "", real_key)
+        formatter.track(
+            job.task_id,
+            on_done=lambda update: finalize_job(job_id, update),
+            callback_id=(job.params or {}).get("callback_id"),
+        )
+        return True
+
+    if not job.poll_url:
+        return False
+    poll_headers = {"Authorization": f"Bearer {real_key}"}
+    poll_headers.update(download_headers())
+    poll_headers["Referer"] = ""
+    poll_url = job.poll_url
+    poller.submit(
+        f"http:{poll_url}",
+        lambda: AIEngine.check_video_task(poll_url, poll_headers),
+        provider=job.provider or "default",
+        timeout=50000,
+        initial_delay=0,
+        on_done=lambda update: finalize_job(job_id, update),
+    )
+    return True
+
+
+def _take_over(db, job: GenerationJob, owner: str) -> bool:
+    """
+    Atomically move an orphaned job to this process. Jobs interrupted
+    mid-download restart from the poll step.
+    """
+    claimed = (
+        db.query(GenerationJob)
+        .filter(
+            GenerationJob.id == job.id,
+            GenerationJob.status == job.status,
+            GenerationJob.owner == job.owner if job.owner is not None else GenerationJob.owner.is_(None),
+        )
+        .update({"status": JOB_RUNNING, "owner": owner}, synchronize_session=False)
+    )
+    db.commit()
+    if claimed != 1:
+        return False
+    db.refresh(job)
+    return True
+
+
+def resume_pending_jobs() -> int:
+    """
+    Pick up jobs left behind by processes that are gone. Called at startup;
+    jobs owned by another live worker are left alone.
+    """
+    db = SessionLocal()
+    resumed = 0
+    owner = current_owner()
+    try:
+        cutoff = datetime.now(timezone.utc) - _RESUME_MAX_AGE
+        jobs = (
+            db.query(GenerationJob)
+            .filter(GenerationJob.status.in_((JOB_RUNNING, JOB_DOWNLOADING)))
+            .all()
+        )
+        for job in jobs:
+            if _owner_alive(job.owner) or not _take_over(db, job, owner):
+                continue
+            created_at = job.created_at
+            if created_at is not None and created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if created_at is not None and created_at < cutoff:
+                job.status = JOB_FAILED
+                job.error = "Expired before it could be resumed"
+                continue
+
+            api_key = (
+                db.query(ApiKey)
+                .filter(ApiKey.id == job.key_id, ApiKey.user_id == job.user_id)
+                .first()
+                if job.key_id
+                else None
+            )
+            if not api_key:
+                job.status = JOB_FAILED
+                job.error = "API Key no longer exists"
+                continue
+            try:
+                if _resume_job(job, api_key):
+                    resumed += 1
+                else:
+                    job.status = JOB_FAILED
+                    job.error = "Job cannot be resumed"
+            except Exception as e:
+                logger.error(f"[Jobs] Failed to resume job {job.id}: {e}")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[Jobs] Resume scan failed: {e}")
+    finally:
+        db.close()
+
+    if resumed:
+        logger.info(f"[Jobs] Resumed {resumed} unfinished generation job(s).")
+    return resumed
@@ -0,0 +1,347 @@
+"""
+Key pools: several ApiKey rows of one platform serving one modality.
+
+`ai_config[<modality>]` may list extra keys next to its `key_id`:
+
+    {"key_id": 3, "model": "...", "key_pool": [5, 8], "key_policy": "latency"}
+
+Policies decide the order keys are tried in:
+
+- least_loaded: fewest queued + in-flight requests in the rate governor
+- latency:      lowest recent latency (EWMA of time-to-first-byte/response)
+- hedged:       latency order; for text, a duplicate request goes to the next
+                key once the first one has been silent for the key's p95
+                latency, and whichever answers first wins
+
+Media requests fail over to the next key on timeouts, connection errors and
+5xx before a provider task exists; text streams fail over until the first
+token has been delivered.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+import openai
+import requests
+
+from app.core.config import settings
+from app.services.provider_health import monitor as health
+from app.utils.rate_governor import RateLimitTimeout, rate_governor
+
+logger = logging.getLogger(__name__)
+
+POLICY_LEAST_LOADED = "least_loaded"
+POLICY_LATENCY = "latency"
+POLICY_HEDGED = "hedged"
+POLICIES = (POLICY_LEAST_LOADED, POLICY_LATENCY, POLICY_HEDGED)
+
+_WINDOW = 50
+_EWMA_ALPHA = 0.3
+_MIN_P95_SAMPLES = 5
+
+
+class ProviderUnavailable(RuntimeError):
+    """The upstream behind one key timed out or answered 5xx; try another key."""
+
+
+_FAILOVER_EXCEPTIONS = (
+    ProviderUnavailable,
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+
+
+def is_failover_status(status_code: Optional[int]) -> bool:
+    return status_code is not None and (status_code >= 500 or status_code == 408)
+
+
+def is_failover_error(exc: Optional[BaseException]) -> bool:
+    """True when `exc` (or anything it was raised from) means the key's upstream is unhealthy."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, _FAILOVER_EXCEPTIONS):
+            return True
+        seen.add(id(exc))
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class LatencyTracker:
+    """Per (key, modality) EWMA and a sliding window for p95."""
+
+    def __init__(self, window: int = _WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[int, str], Deque[float]] = {}
+        self._ewma: Dict[Tuple[int, str], float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key_id: Optional[int], modality: str, seconds: float):
+        if key_id is None:
+            return
+        k = (key_id, modality)
+        with self._lock:
+            self._samples.setdefault(k, deque(maxlen=self.window)).append(seconds)
+            previous = self._ewma.get(k)
+            self._ewma[k] = seconds if previous is None else previous + _EWMA_ALPHA * (seconds - previous)
+
+    def record_failure(self, key_id: Optional[int], modality: str):
+        self.record(key_id, modality, settings.KEY_POOL_FAILURE_PENALTY)
+
+    def ewma(self, key_id: int, modality: str) -> Optional[float]:
+        with self._lock:
+            return self._ewma.get((key_id, modality))
+
+    def p95(self, key_id: int, modality: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get((key_id, modality)) or ())
+        if len(samples) < _MIN_P95_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            keys = list(self._samples)
+        return [
+            {
+                "key_id": key_id,
+                "modality": modality,
+                "samples": len(self._samples.get((key_id, modality)) or ()),
+                "ewma": round(self.ewma(key_id, modality) or 0.0, 3),
+                "p95": round(self.p95(key_id, modality) or 0.0, 3),
+            }
+            for key_id, modality in keys
+        ]
+
+
+latency = LatencyTracker()
+
+
+def hedge_delay(key_id: int, modality: str) -> float:
+    observed = latency.p95(key_id, modality)
+    delay = observed if observed is not None else settings.KEY_POOL_HEDGE_DELAY
+    return min(max(delay, settings.KEY_POOL_HEDGE_MIN_DELAY), settings.KEY_POOL_HEDGE_MAX_DELAY)
+
+
+def order_keys(records: Sequence[Any], modality: str, policy: Optional[str]) -> List[Any]:
+    """
+    Order candidate ApiKey rows for `policy`. Keys the health monitor sees
+    as degraded / down go last; the configured primary key (first in
+    `records`) wins ties; keys without latency samples sort first under the
+    latency policies so they get measured.
+    """
+    indexed = list(enumerate(records))
+    if policy == POLICY_LEAST_LOADED:
+        indexed.sort(key=lambda item: (health.rank(item[1].id), rate_governor.load(item[1].id, modality), item[0]))
+    elif policy in (POLICY_LATENCY, POLICY_HEDGED):
+        indexed.sort(key=lambda item: (health.rank(item[1].id), latency.ewma(item[1].id, modality) or 0.0, item[0]))
+    else:
+        indexed.sort(key=lambda item: (health.rank(item[1].id), item[0]))
+    return [record for _, record in indexed]
+
+
+# ---------- text: pooled / hedged chat client ----------
+
+class _Attempt:
+    """
+    One request on one key, on its own thread. `abort()` closes the response
+    and gives the governor slot back immediately. Attempts that may race a
+    hedge get a private connection so a loser still waiting for headers can
+    be cut off too; the shared client's pool would keep it open.
+    """
+
+    def __init__(
+        self,
+        key_id: Optional[int],
+        client: Any,
+        kwargs: Dict[str, Any],
+        events: "queue.Queue",
+        hedge: bool,
+        own_connection: bool = False,
+    ):
+        self.key_id = key_id
+        self.client = client
+        self.kwargs = kwargs
+        self.events = events
+        self.hedge = hedge
+        self.cancel = threading.Event()
+        self.finished = False
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._slot = None
+        self._stream = None
+        self._http = httpx.Client(follow_redirects=True) if own_connection else None
+        threading.Thread(target=self._run, daemon=True, name="key-pool-attempt").start()
+
+    def abort(self):
+        self.cancel.set()
+        with self._lock:
+            closables = [self._stream, self._http]
+        for closable in closables:
+            if closable is not None:
+                try:
+                    closable.close()
+                except Exception:
+                    pass
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            slot, self._slot = self._slot, None
+        if slot is not None:
+            rate_governor.release(slot)
+
+    def _run(self):
+        slot = None
+        try:
+            # A hedge only goes out if its key has capacity right now.
+            slot = rate_governor.acquire(self.key_id, "text", timeout=0 if self.hedge else None)
+            with self._lock:
+                self._slot = slot
+            if self.cancel.is_set():
+                return
+            self.started = time.monotonic()
+            client = self.client.with_options(http_client=self._http) if self._http is not None else self.client
+            stream = client.chat.completions.create(**self.kwargs)
+            with self._lock:
+                self._stream = stream
+            with stream:
+                if self.cancel.is_set():
+                    return
+                for chunk in stream:
+                    if self.cancel.is_set():
+                        return
+                    self.events.put((self, "chunk", chunk))
+            self.events.put((self, "done", None))
+        except Exception as e:
+            if self.cancel.is_set():
+                return  # aborted: the connection was closed under us
+            if isinstance(e, openai.RateLimitError) and slot is not None and slot.scope:
+                slot.throttled = True
+                rate_governor.penalize(slot.scope)
+            self.events.put((self, "error", e))
+        finally:
+            self._release()
+            if self._http is not None:
+                self._http.close()
+
+
+class _PooledStream:
+    def __init__(self, pool: "PooledChatClient", kwargs: Dict[str, Any]):
+        self._pool = pool
+        self._kwargs = kwargs
+        self._attempts: List[_Attempt] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        for attempt in self._attempts:
+            attempt.abort()
+
+    def __iter__(self) -> Iterator[Any]:
+        candidates = self._pool.candidates
+        events: "queue.Queue" = queue.Queue()
+        next_index = 0
+
+        def launch(hedge: bool = False) -> _Attempt:
+            nonlocal next_index
+            key_id, client = candidates[next_index]
+            next_index += 1
+            attempt = _Attempt(
+                key_id, client, self._kwargs, events, hedge,
+                own_connection=self._pool.policy == POLICY_HEDGED,
+            )
+            self._attempts.append(attempt)
+            return attempt
+
+        def hedge_deadline(attempt: _Attempt) -> Optional[float]:
+            if self._pool.policy != POLICY_HEDGED or next_index >= len(candidates):
+                return None
+            return time.monotonic() + hedge_delay(attempt.key_id, "text")
+
+        first = launch()
+        hedge_at = hedge_deadline(first)
+        winner: Optional[_Attempt] = None
+        try:
+            while True:
+                timeout = None if winner is not None or hedge_at is None else max(0.0, hedge_at - time.monotonic())
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None
+                    logger.info(f"[KeyPool] No first token yet, hedging text request to key {candidates[next_index][0]}.")
+                    launch(hedge=True)
+                    continue
+
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        latency.record(attempt.key_id, "text", time.monotonic() - attempt.started)
+                        for other in self._attempts:
+                            if other is not attempt:
+                                other.abort()
+                    yield value
+                    continue
+
+                attempt.finished = True
+                if kind == "done":
+                    if winner is None:
+                        latency.record(attempt.key_id, "text", time.monotonic() - attempt.started)
+                    return
+
+                # kind == "error"
+                if attempt is winner:
+                    raise value  # Tokens already went out; cannot switch keys mid-answer.
+                if is_failover_error(value):
+                    latency.record_failure(attempt.key_id, "text")
+                if not (attempt.hedge and isinstance(value, RateLimitTimeout)):
+                    logger.warning(f"[KeyPool] Text request on key {attempt.key_id} failed: {value}")
+                if any(not a.finished for a in self._attempts):
+                    continue
+                if next_index < len(candidates) and is_failover_error(value):
+                    hedge_at = hedge_deadline(launch())
+                    continue
+                raise value
+        finally:
+            self.close()
+
+
+class _PooledCompletions:
+    def __init__(self, pool: "PooledChatClient"):
+        self._pool = pool
+
+    def create(self, **kwargs):
+        return _PooledStream(self._pool, kwargs)
+
+
+class _PooledChat:
+    def __init__(self, pool: "PooledChatClient"):
+        self.completions = _PooledCompletions(pool)
+
+
+class PooledChatClient:
+    """
+    Drop-in for the `client.chat.completions.create(stream=True)` surface the
+    skills use, spreading requests over `candidates` [(key_id, client), ...].
+    Every attempt holds a rate-governor slot for its own key.
+    """
+
+    def __init__(self, candidates: List[Tuple[Optional[int], Any]], policy: Optional[str] = None):
+        if not candidates:
+            raise ValueError("PooledChatClient needs at least one client")
+        self.candidates = candidates
+        self.policy = policy
+        self.chat = _PooledChat(self)
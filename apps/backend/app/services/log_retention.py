@@ -0,0 +1,272 @@
+"""
+Retention for everything under the log directory.
+
+A background pass every LOG_RETENTION_INTERVAL seconds:
+
+1. compresses director traces that finished more than
+   TRACE_COMPRESS_AFTER_HOURS ago into one `<run_id>.json.gz` holding the
+   full record (header + events), which `get_director_run` reads directly;
+2. gzips rotated `app.log.<date>` files;
+3. deletes traces and rotated logs older than LOG_RETENTION_MAX_DAYS, then
+   evicts oldest-first until the directory is under LOG_RETENTION_MAX_MB.
+   Evicted runs are dropped from the director_run index as well.
+
+Files touched within the last hour are never evicted, so running traces and
+the live `app.log` are safe.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core import director_trace
+from app.core.config import settings
+from app.core.logger import get_log_dir
+
+logger = logging.getLogger(__name__)
+
+_ACTIVE_STATUSES = {"initialized", "running"}
+_MIN_EVICT_AGE = 3600.0
+# Longest suffix first: "x.events.jsonl" must not be read as run "x.events".
+_TRACE_SUFFIXES = (
+    director_trace.EVENTS_SUFFIX, f"{director_trace.ARCHIVE_SUFFIX}.tmp", director_trace.ARCHIVE_SUFFIX, ".json.tmp", ".json",
+)
+_APP_LOG = "app.log"
+
+
+@dataclass
+class _Unit:
+    """One evictable thing: all files of a trace run, or one rotated app log."""
+
+    key: str
+    paths: List[str] = field(default_factory=list)
+    size: int = 0
+    mtime: float = 0.0
+    run_id: Optional[str] = None
+
+    def add(self, path: str, stat: os.stat_result):
+        self.paths.append(path)
+        self.size += stat.st_size
+        self.mtime = max(self.mtime, stat.st_mtime)
+
+
+def _gzip_file(src: str, dst: str):
+    tmp = f"{dst}.tmp"
+    with open(src, "rb") as f_in, gzip.open(tmp, "wb") as f_out:
+        while True:
+            block = f_in.read(1 << 20)
+            if not block:
+                break
+            f_out.write(block)
+    os.replace(tmp, dst)
+
+
+def _remove(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+class LogRetention:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "passes": 0,
+            "last_run_at": None,
+            "last_duration_ms": None,
+            "last_error": None,
+            "traces_compressed": 0,
+            "logs_compressed": 0,
+            "bytes_saved": 0,
+            "evicted_age": 0,
+            "evicted_size": 0,
+            "bytes_evicted": 0,
+            "total_bytes": None,
+            "trace_runs": None,
+        }
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="log-retention")
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poke(self):
+        """Run the next pass now."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"[Retention] Pass failed: {e}")
+                with self._lock:
+                    self._stats["last_error"] = str(e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # ---------- pass ----------
+
+    def run_once(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        log_dir = get_log_dir()
+        trace_dir = os.path.join(log_dir, "director_runs")
+
+        compressed_traces, saved = self._compress_traces(trace_dir, now)
+        compressed_logs, saved_logs = self._compress_app_logs(log_dir)
+        units, fixed_bytes = self._scan(log_dir, trace_dir)
+        evicted, evicted_age, evicted_bytes, total = self._enforce_quotas(units, fixed_bytes, now)
+        evicted_size = len(evicted) - evicted_age
+
+        with self._lock:
+            s = self._stats
+            s["passes"] += 1
+            s["last_run_at"] = now
+            s["last_duration_ms"] = int((time.perf_counter() - started) * 1000)
+            s["last_error"] = None
+            s["traces_compressed"] += compressed_traces
+            s["logs_compressed"] += compressed_logs
+            s["bytes_saved"] += saved + saved_logs
+            s["evicted_age"] += evicted_age
+            s["evicted_size"] += evicted_size
+            s["bytes_evicted"] += evicted_bytes
+            s["total_bytes"] = total
+            s["trace_runs"] = sum(1 for u in units if u.run_id) - sum(1 for u in evicted if u.run_id)
+        if compressed_traces or compressed_logs or evicted_age or evicted_size:
+            logger.info(
+                f"[Retention] Compressed {compressed_traces} traces / {compressed_logs} logs, "
+                f"evicted {evicted_age} by age / {evicted_size} by size, {total / 1048576:.1f} MB kept."
+            )
+        return self.stats()
+
+    def _compress_traces(self, trace_dir: str, now: float):
+        cutoff = now - settings.TRACE_COMPRESS_AFTER_HOURS * 3600
+        count = 0
+        saved = 0
+        try:
+            names = os.listdir(trace_dir)
+        except FileNotFoundError:
+            return 0, 0
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            run_id = name[: -len(".json")]
+            header_path = os.path.join(trace_dir, name)
+            try:
+                mtime = os.path.getmtime(header_path)
+                if mtime > cutoff:
+                    continue
+                with open(header_path, "r", encoding="utf-8") as f:
+                    if json.load(f).get("status") in _ACTIVE_STATUSES:
+                        continue
+                record = director_trace.get_director_run(run_id)
+                if record is None:
+                    continue
+                events_path = os.path.join(trace_dir, f"{run_id}{director_trace.EVENTS_SUFFIX}")
+                before = os.path.getsize(header_path) + (os.path.getsize(events_path) if os.path.exists(events_path) else 0)
+                archive = director_trace.write_archive(run_id, record)
+                os.utime(archive, (mtime, mtime))  # age quotas keep counting from the run
+                saved += before - os.path.getsize(archive)
+                _remove(header_path)
+                _remove(events_path)
+                count += 1
+            except Exception as e:
+                logger.warning(f"[Retention] Could not compress trace {run_id}: {e}")
+        return count, saved
+
+    def _compress_app_logs(self, log_dir: str):
+        count = 0
+        saved = 0
+        for name in os.listdir(log_dir):
+            if not name.startswith(f"{_APP_LOG}.") or name.endswith((".gz", ".tmp")):
+                continue
+            path = os.path.join(log_dir, name)
+            try:
+                stat = os.stat(path)
+                before = stat.st_size
+                _gzip_file(path, f"{path}.gz")
+                os.utime(f"{path}.gz", (stat.st_atime, stat.st_mtime))
+                saved += before - os.path.getsize(f"{path}.gz")
+                os.remove(path)
+                count += 1
+            except Exception as e:
+                logger.warning(f"[Retention] Could not compress {name}: {e}")
+        return count, saved
+
+    def _scan(self, log_dir: str, trace_dir: str):
+        units: Dict[str, _Unit] = {}
+        fixed_bytes = 0
+        for name in os.listdir(log_dir):
+            path = os.path.join(log_dir, name)
+            if not name.startswith(f"{_APP_LOG}."):
+                if os.path.isfile(path):
+                    fixed_bytes += os.path.getsize(path)
+                continue
+            try:
+                units.setdefault(f"log:{name}", _Unit(key=name)).add(path, os.stat(path))
+            except FileNotFoundError:
+                continue
+        if os.path.isdir(trace_dir):
+            for name in os.listdir(trace_dir):
+                run_id = next((name[: -len(s)] for s in _TRACE_SUFFIXES if name.endswith(s)), None)
+                if run_id is None:
+                    continue
+                path = os.path.join(trace_dir, name)
+                try:
+                    unit = units.setdefault(f"run:{run_id}", _Unit(key=run_id, run_id=run_id))
+                    unit.add(path, os.stat(path))
+                except FileNotFoundError:
+                    continue
+        return list(units.values()), fixed_bytes
+
+    def _enforce_quotas(self, units: List[_Unit], fixed_bytes: int, now: float):
+        total = fixed_bytes + sum(u.size for u in units)
+        max_age = settings.LOG_RETENTION_MAX_DAYS * 86400
+        max_bytes = settings.LOG_RETENTION_MAX_MB * 1048576
+        candidates = sorted((u for u in units if now - u.mtime >= _MIN_EVICT_AGE), key=lambda u: u.mtime)
+
+        evicted: List[_Unit] = []
+        evicted_age = 0
+        for unit in candidates:
+            if max_age and now - unit.mtime > max_age:
+                evicted_age += 1
+            elif not (max_bytes and total > max_bytes):
+                continue
+            evicted.append(unit)
+            total -= unit.size
+
+        evicted_bytes = 0
+        for unit in evicted:
+            for path in unit.paths:
+                evicted_bytes += _remove(path)
+        run_ids = [u.run_id for u in evicted if u.run_id]
+        if run_ids:
+            director_trace.forget_runs(run_ids)
+        return evicted, evicted_age, evicted_bytes, total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+log_retention = LogRetention(interval=settings.LOG_RETENTION_INTERVAL)
@@ -0,0 +1,324 @@
+"""
+Cached model catalogs per (platform, base URL, credential).
+
+Listing `/models` (or Ollama `/tags`) and inferring capabilities for hundreds
+of rows is too slow to repeat for every model-picker refresh or text request
+without a model. A catalog is fresh for MODEL_CATALOG_TTL seconds; after that
+it is still served for up to MODEL_CATALOG_STALE seconds while one
+background refresh runs (stale-while-revalidate). Concurrent misses for the
+same key share a single fetch. At most MODEL_CATALOG_MAX_ENTRIES catalogs are
+kept, least recently used first out; editing or deleting an API key drops
+the catalogs fetched with it.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.provider_platform import PLATFORM_OLLAMA
+from app.utils.http_client import request as http_request
+from app.utils.ollama_client import list_ollama_models
+
+logger = logging.getLogger(__name__)
+
+_MODEL_TYPES = ("text", "image", "video", "audio")
+
+
+def _new_model_groups() -> Dict[str, List[str]]:
+    return {k: [] for k in _MODEL_TYPES}
+
+
+def _append_group(groups: Dict[str, List[str]], model_type: str, model_id: str):
+    if model_type not in groups:
+        return
+    if model_id not in groups[model_type]:
+        groups[model_type].append(model_id)
+
+
+def _normalize_capability_token(value: str) -> str:
+    return str(value or "").strip().lower().replace("-", "_")
+
+
+def _collect_modalities(model_row: dict) -> Set[str]:
+    tokens: Set[str] = set()
+    for key in ("modality", "modalities", "input_modalities", "output_modalities"):
+        val = model_row.get(key)
+        if isinstance(val, str):
+            token = _normalize_capability_token(val)
+            if token:
+                tokens.add(token)
+        elif isinstance(val, list):
+            for item in val:
+                token = _normalize_capability_token(item)
+                if token:
+                    tokens.add(token)
+
+    capabilities = model_row.get("capabilities")
+    if isinstance(capabilities, dict):
+        for k, v in capabilities.items():
+            key_token = _normalize_capability_token(k)
+            if isinstance(v, bool):
+                if v:
+                    tokens.add(key_token)
+            elif isinstance(v, str):
+                val_token = _normalize_capability_token(v)
+                if val_token in {"true", "yes", "enabled", "supported"}:
+                    tokens.add(key_token)
+            elif isinstance(v, (int, float)):
+                if v:
+                    tokens.add(key_token)
+    return tokens
+
+
+def _infer_model_capabilities(platform: str, model_id: str, model_row: Optional[dict] = None) -> Set[str]:
+    text_words = (
+        "chat",
+        "gpt",
+        "claude",
+        "deepseek",
+        "qwen",
+        "llama",
+        "gemini",
+        "doubao",
+        "text",
+        "instruct",
+        "reasoner",
+    )
+    image_words = (
+        "image",
+        "vision",
+        "flux",
+        "sd",
+        "stable_diffusion",
+        "dall",
+        "dalle",
+        "seedream",
+        "nano_banana",
+        "recraft",
+        "pixart",
+        "cogview",
+    )
+    video_words = (
+        "video",
+        "sora",
+        "seedance",
+        "runway",
+        "pika",
+        "veo",
+        "kling",
+        "wanx",
+        "hunyuan_video",
+        "i2v",
+        "t2v",
+    )
+    audio_words = (
+        "audio",
+        "speech",
+        "tts",
+        "voice",
+        "whisper",
+        "asr",
+        "transcribe",
+    )
+
+    value = _normalize_capability_token(model_id)
+    capabilities: Set[str] = set()
+
+    if any(word in value for word in text_words):
+        capabilities.add("text")
+    if any(word in value for word in image_words):
+        capabilities.add("image")
+    if any(word in value for word in video_words):
+        capabilities.add("video")
+    if any(word in value for word in audio_words):
+        capabilities.add("audio")
+
+    if isinstance(model_row, dict):
+        tokens = _collect_modalities(model_row)
+        if any(tok in tokens for tok in {"text", "chat", "completion"}):
+            capabilities.add("text")
+        if any(tok in tokens for tok in {"image", "vision"}):
+            capabilities.add("image")
+        if "video" in tokens:
+            capabilities.add("video")
+        if any(tok in tokens for tok in {"audio", "speech", "tts", "asr", "transcription"}):
+            capabilities.add("audio")
+
+    if platform == "ollama":
+        # Ollama /api/tags does not provide reliable capability metadata.
+        capabilities.add("text")
+
+    if not capabilities:
+        capabilities.add("text")
+
+    return capabilities
+
+
+@dataclass
+class Catalog:
+    models: List[str]
+    models_by_type: Dict[str, List[str]]
+    model_capabilities: Dict[str, List[str]]
+    fetched_at: float = field(default_factory=time.time)
+
+
+def build_catalog(platform: str, rows: List[dict], available_models: List[str]) -> Catalog:
+    """Capability groups for raw model rows (`{"id": ...}` dicts)."""
+    model_groups = _new_model_groups()
+    model_capabilities: Dict[str, List[str]] = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        model_id = str(row.get("id") or "").strip()
+        if not model_id:
+            continue
+        caps = sorted(_infer_model_capabilities(platform, model_id, row if platform != PLATFORM_OLLAMA else None))
+        model_capabilities[model_id] = caps
+        for cap in caps:
+            _append_group(model_groups, cap, model_id)
+
+    # Keep deterministic order consistent with available_models
+    for model_type in _MODEL_TYPES:
+        members = set(model_groups[model_type])
+        model_groups[model_type] = [m for m in available_models if m in members]
+    return Catalog(available_models, model_groups, model_capabilities)
+
+
+def fetch_catalog(platform: str, base_url: str, real_key: str) -> Catalog:
+    if platform == PLATFORM_OLLAMA:
+        # Keep Ollama's own order: the first entry is the default model.
+        available_models = list_ollama_models(base_url, real_key)
+        return build_catalog(platform, [{"id": m} for m in available_models], available_models)
+
+    # Prefer raw HTTP for compatibility across OpenAI-compatible providers.
+    headers = {"Content-Type": "application/json"}
+    if real_key:
+        headers["Authorization"] = f"Bearer {real_key}"
+
+    models_res = http_request(
+        "GET",
+        f"{base_url.rstrip('/')}/models",
+        headers=headers,
+        timeout=(10.0, 30.0),
+    )
+    if models_res.status_code != 200:
+        raise RuntimeError(models_res.text)
+
+    payload = models_res.json() if models_res.content else {}
+    rows = payload.get("data", []) if isinstance(payload, dict) else []
+    available_models = sorted(
+        [str(model.get("id")) for model in rows if isinstance(model, dict) and model.get("id")]
+    )
+    return build_catalog(platform, rows, available_models)
+
+
+_CatalogKey = Tuple[str, str, str]
+
+
+class ModelCatalogCache:
+    def __init__(self, ttl: float, stale: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[_CatalogKey, Catalog]" = OrderedDict()
+        self._inflight: Dict[_CatalogKey, Future] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale_hits = 0
+        self._fetches = 0
+
+    @staticmethod
+    def _key(platform: str, base_url: str, real_key: str) -> _CatalogKey:
+        digest = hashlib.sha256((real_key or "").encode("utf-8")).hexdigest()[:16]
+        return (platform, base_url.rstrip("/"), digest)
+
+    def _fetch(self, key: _CatalogKey, platform: str, base_url: str, real_key: str) -> Tuple[Future, bool]:
+        """Future for the in-flight fetch of `key`, starting one if needed; True if this call ran it."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self._fetches += 1
+
+        try:
+            catalog = fetch_catalog(platform, base_url, real_key)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return future, True
+        with self._lock:
+            self._entries[key] = catalog
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(catalog)
+        return future, True
+
+    def _refresh_in_background(self, key: _CatalogKey, platform: str, base_url: str, real_key: str):
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def _run():
+            future, _ = self._fetch(key, platform, base_url, real_key)
+            if future.exception() is not None:
+                logger.warning(f"[Catalog] Background refresh of {base_url} failed: {future.exception()}")
+
+        threading.Thread(target=_run, daemon=True, name="model-catalog-refresh").start()
+
+    def get(self, platform: str, base_url: str, real_key: str, refresh: bool = False) -> Catalog:
+        key = self._key(platform, base_url, real_key)
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+        if cached is not None and not refresh:
+            age = now - cached.fetched_at
+            if age < self.ttl:
+                self._hits += 1
+                return cached
+            if age < self.ttl + self.stale:
+                self._stale_hits += 1
+                self._refresh_in_background(key, platform, base_url, real_key)
+                return cached
+
+        # Concurrent callers for the same key share one fetch.
+        future, _ = self._fetch(key, platform, base_url, real_key)
+        return future.result()
+
+    def invalidate(self, base_url: Optional[str] = None, real_key: Optional[str] = None):
+        """Drop catalogs for `base_url` (all of them if None), only those fetched with `real_key` if given."""
+        with self._lock:
+            if base_url is None:
+                self._entries.clear()
+                return
+            base = base_url.rstrip("/")
+            digest = self._key("", base, real_key)[2] if real_key is not None else None
+            for key in [k for k in self._entries if k[1] == base and (digest is None or k[2] == digest)]:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "stale_hits": self._stale_hits,
+                "fetches": self._fetches,
+            }
+
+
+model_catalog = ModelCatalogCache(
+    ttl=settings.MODEL_CATALOG_TTL,
+    stale=settings.MODEL_CATALOG_STALE,
+    max_entries=settings.MODEL_CATALOG_MAX_ENTRIES,
+)
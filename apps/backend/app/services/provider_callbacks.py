@@ -0,0 +1,137 @@
+"""
+Completion callbacks (webhooks) from video providers.
+
+Formatters that support it (`Base.supports_callback`) get a callback URL when
+a task is created:
+
+    {PUBLIC_BASE_URL}/v1/callbacks/{formatter}/{callback_id}?token=...
+
+The token is an HMAC of the formatter name and callback id, so only the
+provider the URL was handed to can complete the task. The receiver parses the
+body with the formatter's `parse_callback`, stores the normalized result in
+the `provider_callback` table and publishes it to the task poller right away.
+
+Tasks created with a callback are still tracked by the poller, but the
+provider is only polled every PROVIDER_CALLBACK_FALLBACK_POLL seconds; the
+checks in between just look the result up in the table, which also picks up
+callbacks that reached another uvicorn worker.
+
+Callbacks stay off while PUBLIC_BASE_URL is empty (e.g. the desktop app):
+the provider would have no way to reach the backend. They also stay off
+while SECRET_KEY is the shipped default, which would make tokens forgeable.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import Settings, settings
+from app.db.session import SessionLocal
+from app.models.provider_callback import ProviderCallback
+from app.services.task_poller import poller
+
+logger = logging.getLogger(__name__)
+
+# callback_id -> poller task key, for tasks tracked by this process
+_bound: Dict[str, str] = {}
+_lock = threading.Lock()
+_warned_default_secret = False
+
+
+def enabled() -> bool:
+    global _warned_default_secret
+    if not settings.PUBLIC_BASE_URL.strip():
+        return False
+    if settings.SECRET_KEY == Settings.model_fields["SECRET_KEY"].default:
+        if not _warned_default_secret:
+            _warned_default_secret = True
+            logger.warning("[Callbacks] PUBLIC_BASE_URL is set but SECRET_KEY is the default; provider callbacks disabled.")
+        return False
+    return True
+
+
+def token_for(provider: str, callback_id: str) -> str:
+    message = f"{provider.lower()}:{callback_id}".encode("utf-8")
+    return hmac.new(settings.SECRET_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()[:32]
+
+
+def verify(provider: str, callback_id: str, token: str) -> bool:
+    if not enabled():
+        return False
+    return hmac.compare_digest(token_for(provider, callback_id), token or "")
+
+
+def prepare(formatter: Any) -> Tuple[Optional[str], Optional[str]]:
+    """(callback_id, callback_url) for a new task, or (None, None) if not applicable."""
+    if not enabled() or not getattr(formatter, "supports_callback", False):
+        return None, None
+    callback_id = uuid.uuid4().hex
+    base = settings.PUBLIC_BASE_URL.strip().rstrip("/")
+    provider = formatter.name.lower()
+    url = f"{base}/v1/callbacks/{provider}/{callback_id}?token={token_for(provider, callback_id)}"
+    return callback_id, url
+
+
+def bind(callback_id: str, task_key: str):
+    with _lock:
+        _bound[callback_id] = task_key
+
+
+def lookup(callback_id: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        row = db.query(ProviderCallback).filter(ProviderCallback.callback_id == callback_id).first()
+        return dict(row.result) if row and isinstance(row.result, dict) else None
+    finally:
+        db.close()
+
+
+def receive(provider: str, callback_id: str, result: Dict[str, Any]):
+    """Store a parsed callback result and hand it to the poller if this process tracks the task."""
+    db = SessionLocal()
+    try:
+        row = db.query(ProviderCallback).filter(ProviderCallback.callback_id == callback_id).first()
+        if row is None:
+            row = ProviderCallback(callback_id=callback_id, provider=provider)
+            db.add(row)
+        row.result = result
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.PROVIDER_CALLBACK_RETENTION)
+        db.query(ProviderCallback).filter(ProviderCallback.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    with _lock:
+        task_key = _bound.get(callback_id)
+        if task_key and result.get("status") in ("completed", "failed"):
+            _bound.pop(callback_id, None)
+    logger.info(f"[Callback] {provider} callback {callback_id}: {result.get('status')}")
+    if task_key:
+        poller.publish(task_key, result)
+
+
+def wrap_check(callback_id: str, check: Callable[[], Dict[str, Any]]) -> Callable[[], Dict[str, Any]]:
+    """
+    Poller check for a callback-enabled task: the stored callback result if
+    there is one, the provider's own status every fallback interval, and a
+    plain "processing" otherwise.
+    """
+    last_remote = [time.monotonic()]
+
+    def _check() -> Dict[str, Any]:
+        stored = lookup(callback_id)
+        if stored is not None:
+            return stored
+        if time.monotonic() - last_remote[0] < settings.PROVIDER_CALLBACK_FALLBACK_POLL:
+            return {"status": "processing"}
+        last_remote[0] = time.monotonic()
+        return check()
+
+    return _check
@@ -0,0 +1,284 @@
+"""
+Background health monitor for configured provider endpoints.
+
+Every PROVIDER_HEALTH_INTERVAL seconds each ApiKey's base URL is probed
+with a TCP connect + TLS handshake (timed separately) and a cheap listing
+call (`/models`, or `/tags` for Ollama). The last PROVIDER_HEALTH_WINDOW
+probes per key give rolling latency percentiles and an error rate, from
+which a status is derived:
+
+- healthy:  recent probes succeed within PROVIDER_HEALTH_SLOW_MS
+- degraded: some probes fail, or p95 latency is above the slow threshold
+- down:     the last PROVIDER_HEALTH_DOWN_AFTER probes all failed
+
+Key pools order `down` / `degraded` keys after healthy ones, and single-key
+generations log a warning when their upstream is not healthy.
+"""
+import logging
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from app.core.config import settings
+from app.core.provider_platform import PLATFORM_OLLAMA, normalize_platform, resolve_base_url
+
+logger = logging.getLogger(__name__)
+
+STATUS_UNKNOWN = "unknown"
+STATUS_HEALTHY = "healthy"
+STATUS_DEGRADED = "degraded"
+STATUS_DOWN = "down"
+_RANK = {STATUS_HEALTHY: 0, STATUS_UNKNOWN: 0, STATUS_DEGRADED: 1, STATUS_DOWN: 2}
+
+_DEGRADED_ERROR_RATE = 0.2
+_PROBE_WORKERS = 4
+
+# Probes bypass the shared retrying session: a probe must measure one attempt.
+_probe_session = requests.Session()
+
+
+@dataclass
+class Probe:
+    at: float
+    ok: bool
+    latency_ms: Optional[float] = None
+    tcp_ms: Optional[float] = None
+    tls_ms: Optional[float] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _KeyHealth:
+    key_id: int
+    user_id: int
+    name: str
+    platform: str
+    base_url: str
+    probes: Deque[Probe] = field(default_factory=deque)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))]
+
+
+def _time_handshake(base_url: str, timeout: float) -> Dict[str, Optional[float]]:
+    """TCP connect and (for https) TLS handshake times in ms. Raises OSError."""
+    parsed = urlparse(base_url)
+    host = parsed.hostname
+    if not host:
+        raise OSError(f"Invalid base URL: {base_url}")
+    https = parsed.scheme == "https"
+    port = parsed.port or (443 if https else 80)
+
+    started = time.perf_counter()
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        tcp_ms = (time.perf_counter() - started) * 1000
+        tls_ms = None
+        if https:
+            tls_started = time.perf_counter()
+            context = ssl.create_default_context()
+            with context.wrap_socket(sock, server_hostname=host):
+                tls_ms = (time.perf_counter() - tls_started) * 1000
+        return {"tcp_ms": tcp_ms, "tls_ms": tls_ms}
+    finally:
+        sock.close()
+
+
+class ProviderHealthMonitor:
+    def __init__(self, interval: float, timeout: float, window: int):
+        self.interval = interval
+        self.timeout = timeout
+        self.window = max(1, window)
+        self._keys: Dict[int, _KeyHealth] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="provider-health")
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poke(self):
+        """Run the next probe round now."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.warning(f"[Health] Probe round failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # ---------- probing ----------
+
+    def _load_keys(self) -> List[Any]:
+        from app.db.session import SessionLocal
+        from app.models.apikey import ApiKey
+
+        db = SessionLocal()
+        try:
+            return db.query(ApiKey).all()
+        finally:
+            db.close()
+
+    def probe_all(self):
+        records = self._load_keys()
+        live_ids = set()
+        targets = []
+        with self._lock:
+            for record in records:
+                platform = normalize_platform(record.platform)
+                base_url = resolve_base_url(platform, record.base_url)
+                if not base_url:
+                    continue
+                live_ids.add(record.id)
+                entry = self._keys.get(record.id)
+                if entry is None or entry.base_url != base_url:
+                    entry = _KeyHealth(record.id, record.user_id, record.name or "", platform, base_url)
+                    self._keys[record.id] = entry
+                entry.name = record.name or ""
+                targets.append((entry, record.encrypted_key or ""))
+            for key_id in list(self._keys):
+                if key_id not in live_ids:
+                    self._keys.pop(key_id, None)
+
+        if not targets:
+            return
+        with ThreadPoolExecutor(max_workers=_PROBE_WORKERS, thread_name_prefix="health-probe") as pool:
+            for entry, real_key in targets:
+                pool.submit(self._probe_and_record, entry, real_key)
+
+    def _probe_and_record(self, entry: _KeyHealth, real_key: str):
+        probe = self.probe(entry.platform, entry.base_url, real_key)
+        with self._lock:
+            entry.probes.append(probe)
+            while len(entry.probes) > self.window:
+                entry.probes.popleft()
+        if not probe.ok:
+            logger.info(f"[Health] Key {entry.key_id} ({entry.base_url}) probe failed: {probe.error}")
+
+    def probe(self, platform: str, base_url: str, real_key: str) -> Probe:
+        probe = Probe(at=time.time(), ok=False)
+        # Behind a proxy a direct handshake says nothing about the real path.
+        if not requests.utils.get_environ_proxies(base_url):
+            try:
+                timings = _time_handshake(base_url, self.timeout)
+                probe.tcp_ms = timings["tcp_ms"]
+                probe.tls_ms = timings["tls_ms"]
+            except OSError as e:
+                probe.error = f"connect: {e}"
+                return probe
+
+        path = "/tags" if platform == PLATFORM_OLLAMA else "/models"
+        headers = {"Authorization": f"Bearer {real_key}"} if real_key else {}
+        started = time.perf_counter()
+        try:
+            res = _probe_session.get(f"{base_url.rstrip('/')}{path}", headers=headers, timeout=self.timeout)
+            probe.latency_ms = (time.perf_counter() - started) * 1000
+            probe.status_code = res.status_code
+            res.close()
+        except requests.exceptions.RequestException as e:
+            probe.latency_ms = (time.perf_counter() - started) * 1000
+            probe.error = f"request: {e}"
+            return probe
+
+        # 404: the upstream does not list models but is clearly up.
+        probe.ok = probe.status_code < 500 and probe.status_code not in (401, 403, 429)
+        if not probe.ok:
+            probe.error = f"HTTP {probe.status_code}"
+        return probe
+
+    # ---------- queries ----------
+
+    def _summary(self, entry: _KeyHealth) -> Dict[str, Any]:
+        probes = list(entry.probes)
+        if not probes:
+            return {
+                "key_id": entry.key_id,
+                "name": entry.name,
+                "platform": entry.platform,
+                "base_url": entry.base_url,
+                "status": STATUS_UNKNOWN,
+                "samples": 0,
+            }
+        failures = sum(1 for p in probes if not p.ok)
+        error_rate = failures / len(probes)
+        latencies = [p.latency_ms for p in probes if p.ok and p.latency_ms is not None]
+        p95 = _percentile(latencies, 0.95)
+        recent = probes[-settings.PROVIDER_HEALTH_DOWN_AFTER:]
+        if len(recent) >= settings.PROVIDER_HEALTH_DOWN_AFTER and all(not p.ok for p in recent):
+            status = STATUS_DOWN
+        elif error_rate >= _DEGRADED_ERROR_RATE or (p95 is not None and p95 > settings.PROVIDER_HEALTH_SLOW_MS):
+            status = STATUS_DEGRADED
+        else:
+            status = STATUS_HEALTHY
+        last = probes[-1]
+
+        def _round(value: Optional[float]) -> Optional[float]:
+            return round(value, 1) if value is not None else None
+
+        return {
+            "key_id": entry.key_id,
+            "name": entry.name,
+            "platform": entry.platform,
+            "base_url": entry.base_url,
+            "status": status,
+            "samples": len(probes),
+            "error_rate": round(error_rate, 3),
+            "latency_p50_ms": _round(_percentile(latencies, 0.5)),
+            "latency_p95_ms": _round(p95),
+            "tcp_ms": _round(_percentile([p.tcp_ms for p in probes if p.tcp_ms is not None], 0.5)),
+            "tls_ms": _round(_percentile([p.tls_ms for p in probes if p.tls_ms is not None], 0.5)),
+            "last_checked": last.at,
+            "last_status_code": last.status_code,
+            "last_error": last.error,
+        }
+
+    def status_for(self, key_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        if key_id is None:
+            return None
+        with self._lock:
+            entry = self._keys.get(key_id)
+            return self._summary(entry) if entry else None
+
+    def rank(self, key_id: Optional[int]) -> int:
+        """0 healthy / unknown, 1 degraded, 2 down: for ordering pooled keys."""
+        summary = self.status_for(key_id)
+        return _RANK.get(summary["status"], 0) if summary else 0
+
+    def stats(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [e for e in self._keys.values() if user_id is None or e.user_id == user_id]
+            return [self._summary(e) for e in sorted(entries, key=lambda e: e.key_id)]
+
+
+monitor = ProviderHealthMonitor(
+    interval=settings.PROVIDER_HEALTH_INTERVAL,
+    timeout=settings.PROVIDER_HEALTH_TIMEOUT,
+    window=settings.PROVIDER_HEALTH_WINDOW,
+)
@@ -0,0 +1,419 @@
+"""
+Central poller for long-running provider tasks (video generation).
+
+A single scheduler thread owns every outstanding provider task and dispatches
+status checks to a small fixed worker pool, so the number of threads stays
+flat no matter how many videos are in flight. Check intervals adapt per task
+(idle tasks back off) and per provider (errors / throttling slow the whole
+provider down). SSE generators attach with `watch()` and receive updates.
+"""
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+TERMINAL_STATUSES = {STATUS_COMPLETED, STATUS_FAILED, STATUS_TIMEOUT}
+
+# Check callables return the formatter `_query_status` shape:
+# {"status": "completed" | "processing" | "failed", "progress": int,
+#  "video_url": str | None, "fail_reason": str | None, "raw": Any}
+CheckFn = Callable[[], Dict[str, Any]]
+DoneCallback = Callable[[Dict[str, Any]], None]
+
+
+@dataclass
+class _ProviderState:
+    base_interval: float
+    interval: float
+    error_streak: int = 0
+    checks: int = 0
+    errors: int = 0
+
+
+@dataclass
+class _PolledTask:
+    key: str
+    provider: str
+    check: CheckFn
+    deadline: Optional[float]
+    interval: float
+    next_at: float
+    generation: int = 0
+    in_flight: bool = False
+    last_status: Optional[str] = None
+    last_progress: Optional[int] = None
+    last_update: Optional[Dict[str, Any]] = None
+    subscribers: List["queue.Queue"] = field(default_factory=list)
+    callbacks: List[DoneCallback] = field(default_factory=list)
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+
+class TaskPoller:
+    def __init__(
+        self,
+        workers: int = 4,
+        base_interval: float = 5.0,
+        min_interval: float = 2.0,
+        max_interval: float = 30.0,
+    ):
+        self._workers = max(1, int(workers))
+        self._base_interval = float(base_interval)
+        self._min_interval = float(min_interval)
+        self._max_interval = float(max_interval)
+
+        self._lock = threading.Condition()
+        self._tasks: Dict[str, _PolledTask] = {}
+        self._providers: Dict[str, _ProviderState] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._recent: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._recent_limit = 256
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    # ------------------------------------------------------------------ lifecycle
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix="task-poller"
+            )
+            self._thread = threading.Thread(
+                target=self._run, name="task-poller-scheduler", daemon=True
+            )
+            self._thread.start()
+            logger.info(f"[TaskPoller] Started with {self._workers} workers.")
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+            executor = self._executor
+            self._executor = None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------ public API
+
+    def submit(
+        self,
+        key: str,
+        check: CheckFn,
+        provider: str = "default",
+        timeout: Optional[float] = None,
+        initial_delay: Optional[float] = None,
+        on_done: Optional[DoneCallback] = None,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        Register a provider task. Submitting an existing key only attaches the
+        callback, so duplicate submissions never double the poll traffic.
+        """
+        self.start()
+        now = time.time()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                state = self._provider_state(provider)
+                delay = state.interval if initial_delay is None else max(0.0, float(initial_delay))
+                task = _PolledTask(
+                    key=key,
+                    provider=provider,
+                    check=check,
+                    deadline=(now + timeout) if timeout else None,
+                    interval=state.interval,
+                    next_at=now + delay,
+                    meta=dict(meta or {}),
+                )
+                self._tasks[key] = task
+                self._recent.pop(key, None)
+                self._schedule_locked(task)
+            if on_done:
+                task.callbacks.append(on_done)
+        return key
+
+    def attach(self, key: str, on_done: DoneCallback) -> bool:
+        """
+        Attach a completion callback to a tracked task. If the task already
+        finished recently the callback runs right away with its final update.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None:
+                task.callbacks.append(on_done)
+                return True
+            final = self._recent.get(key)
+        if final is None:
+            return False
+        threading.Thread(
+            target=self._run_callback, args=(key, on_done, final), daemon=True
+        ).start()
+        return True
+
+    def watch(self, key: str, heartbeat: float = 5.0) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Yield status updates for a task until it reaches a terminal state.
+        Yields None every `heartbeat` seconds without news so callers can keep
+        an SSE connection alive.
+        """
+        sub: "queue.Queue" = queue.Queue()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                final = self._recent.get(key)
+                if final is None:
+                    raise KeyError(f"Unknown task: {key}")
+                sub.put(final)
+            else:
+                if task.last_update:
+                    sub.put(task.last_update)
+                task.subscribers.append(sub)
+
+        try:
+            while True:
+                try:
+                    update = sub.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
+                    continue
+                yield update
+                if update.get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            with self._lock:
+                task = self._tasks.get(key)
+                if task and sub in task.subscribers:
+                    task.subscribers.remove(sub)
+
+    def publish(self, key: str, result: Dict[str, Any]):
+        """
+        Push an out-of-band status (e.g. streamed progress or a completion
+        callback) into the task as if a check had returned it.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                return
+            self._apply_result_locked(task, result)
+
+    def poke(self, key: str):
+        """Schedule an immediate status check for a task."""
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None or task.in_flight:
+                return
+            task.next_at = time.time()
+            self._schedule_locked(task)
+
+    def cancel(self, key: str):
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                return
+            self._finish_locked(
+                task,
+                {"status": STATUS_FAILED, "fail_reason": "Cancelled", "progress": task.last_progress or 0},
+            )
+
+    def is_tracking(self, key: str) -> bool:
+        with self._lock:
+            return key in self._tasks
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "workers": self._workers,
+                "tasks": len(self._tasks),
+                "subscribers": sum(len(t.subscribers) for t in self._tasks.values()),
+                "providers": {
+                    name: {
+                        "interval": round(state.interval, 2),
+                        "tasks": sum(1 for t in self._tasks.values() if t.provider == name),
+                        "checks": state.checks,
+                        "errors": state.errors,
+                        "error_streak": state.error_streak,
+                    }
+                    for name, state in self._providers.items()
+                },
+            }
+
+    # ------------------------------------------------------------------ internals
+
+    def _provider_state(self, provider: str) -> _ProviderState:
+        state = self._providers.get(provider)
+        if state is None:
+            state = _ProviderState(base_interval=self._base_interval, interval=self._base_interval)
+            self._providers[provider] = state
+        return state
+
+    def _schedule_locked(self, task: _PolledTask):
+        task.generation += 1
+        heapq.heappush(self._heap, (task.next_at, next(self._seq), task.key, task.generation))
+        self._lock.notify_all()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                due = self._collect_due_locked()
+                if not due:
+                    wait = self._heap[0][0] - time.time() if self._heap else 30.0
+                    self._lock.wait(timeout=max(0.05, min(wait, 30.0)))
+                    continue
+                executor = self._executor
+            for task in due:
+                if executor is None:
+                    break
+                try:
+                    executor.submit(self._check_task, task)
+                except RuntimeError:
+                    return
+
+    def _collect_due_locked(self) -> List[_PolledTask]:
+        now = time.time()
+        due: List[_PolledTask] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key, generation = heapq.heappop(self._heap)
+            task = self._tasks.get(key)
+            if task is None or task.generation != generation or task.in_flight:
+                continue
+            if task.deadline and now >= task.deadline:
+                self._finish_locked(
+                    task,
+                    {
+                        "status": STATUS_TIMEOUT,
+                        "fail_reason": "Video generation timed out",
+                        "progress": task.last_progress or 0,
+                    },
+                )
+                continue
+            task.in_flight = True
+            due.append(task)
+        return due
+
+    def _check_task(self, task: _PolledTask):
+        error: Optional[Exception] = None
+        result: Optional[Dict[str, Any]] = None
+        try:
+            result = task.check()
+        except Exception as e:
+            error = e
+
+        with self._lock:
+            task.in_flight = False
+            if self._tasks.get(task.key) is not task:
+                return
+            state = self._provider_state(task.provider)
+            state.checks += 1
+            if error is not None or not isinstance(result, dict):
+                state.errors += 1
+                state.error_streak += 1
+                # Back the whole provider off while it is erroring / throttling us.
+                state.interval = min(state.interval * 2, self._max_interval)
+                logger.info(f"[TaskPoller] Check failed for {task.key}: {error}")
+                self._publish_locked(
+                    task,
+                    {"status": "polling_error", "error": str(error), "progress": task.last_progress or 0},
+                )
+                task.interval = max(task.interval, state.interval)
+                task.next_at = time.time() + task.interval
+                self._schedule_locked(task)
+                return
+
+            state.error_streak = 0
+            state.interval = max(state.base_interval, state.interval * 0.8)
+            self._apply_result_locked(task, result)
+
+    def _apply_result_locked(self, task: _PolledTask, result: Dict[str, Any]):
+        update = dict(result)
+        status = str(update.get("status") or "").lower() or "processing"
+        update["status"] = status
+        progress = self._coerce_progress(update.get("progress"))
+        update["progress"] = progress if progress is not None else (task.last_progress or 0)
+
+        if status in TERMINAL_STATUSES:
+            self._finish_locked(task, update)
+            return
+
+        changed = status != task.last_status or (
+            progress is not None and progress != task.last_progress
+        )
+        task.last_status = status
+        if progress is not None:
+            task.last_progress = progress
+        self._publish_locked(task, update)
+
+        if task.in_flight:
+            # An out-of-band publish raced a running check; that check reschedules.
+            return
+        state = self._provider_state(task.provider)
+        if changed:
+            task.interval = max(self._min_interval, state.interval)
+        else:
+            task.interval = min(max(task.interval, state.interval) * 1.5, self._max_interval)
+        task.next_at = time.time() + task.interval
+        self._schedule_locked(task)
+
+    def _finish_locked(self, task: _PolledTask, update: Dict[str, Any]):
+        update = dict(update)
+        update["task_key"] = task.key
+        self._tasks.pop(task.key, None)
+        task.generation += 1
+        self._recent[task.key] = update
+        while len(self._recent) > self._recent_limit:
+            self._recent.popitem(last=False)
+        self._publish_locked(task, update)
+        for callback in task.callbacks:
+            threading.Thread(
+                target=self._run_callback, args=(task.key, callback, update), daemon=True
+            ).start()
+
+    def _publish_locked(self, task: _PolledTask, update: Dict[str, Any]):
+        update = dict(update)
+        update["task_key"] = task.key
+        if update.get("status") != "polling_error":
+            task.last_update = update
+        for sub in list(task.subscribers):
+            sub.put(update)
+
+    @staticmethod
+    def _run_callback(key: str, callback: DoneCallback, update: Dict[str, Any]):
+        try:
+            callback(update)
+        except Exception as e:
+            logger.error(f"[TaskPoller] Completion callback failed for {key}: {e}")
+
+    @staticmethod
+    def _coerce_progress(value: Any) -> Optional[int]:
+        try:
+            return max(0, min(100, int(float(value))))
+        except Exception:
+            return None
+
+
+poller = TaskPoller(
+    workers=settings.VIDEO_POLL_WORKERS,
+    base_interval=settings.VIDEO_POLL_INTERVAL,
+    min_interval=settings.VIDEO_POLL_MIN_INTERVAL,
+    max_interval=settings.VIDEO_POLL_MAX_INTERVAL,
+)
@@ -0,0 +1,204 @@
+"""
+Reuse of reference images already sent to a provider.
+
+Kie / ApiYi used to inline every reference image as a base64 data URI, so
+each shot re-sent the same style, character and keyframe images (+33% for
+the encoding). `reference_url()` resolves an image to something lighter,
+keyed by the image's sha256:
+
+1. a file the provider already hosts for this account (`provider_upload`
+   table), until shortly before it expires;
+2. a fresh upload, for formatters that implement `upload_image`;
+3. a `PUBLIC_BASE_URL/assets/...` URL served by this backend, when one is
+   configured (in-memory images are stored in the CAS first);
+4. None: the caller falls back to a data URI.
+
+Concurrent requests for the same image share one upload.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.provider_upload import ProviderUpload
+from app.utils import asset_store
+from app.utils.image_utils import EncodedImage, resolve_image_path
+
+logger = logging.getLogger(__name__)
+
+_CAS_NAME_RE = re.compile(r"^[0-9a-f]{64}$")
+_MIME_BY_EXT = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}
+
+_inflight: Dict[Tuple[str, str, str], Future] = {}
+_digests: Dict[Tuple[str, int, int], str] = {}
+_lock = threading.Lock()
+_stats = {"reused": 0, "uploaded": 0, "upload_failed": 0, "public_url": 0}
+
+
+def scope_for(base_url: str, api_key: str) -> str:
+    return hashlib.sha256(f"{base_url.rstrip('/')}|{api_key}".encode("utf-8")).hexdigest()[:16]
+
+
+def _file_digest(path: str) -> str:
+    stem, _ = os.path.splitext(os.path.basename(path))
+    if _CAS_NAME_RE.match(stem):
+        return stem  # CAS blobs are named after their sha256
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with _lock:
+            if len(_digests) > 1024:
+                _digests.clear()
+            _digests[key] = digest
+    return digest
+
+
+def _describe(image: Union[str, EncodedImage]) -> Optional[Dict[str, Any]]:
+    """sha256 + lazy byte loader for a local path or in-memory image."""
+    if isinstance(image, EncodedImage):
+        return {
+            "sha256": hashlib.sha256(image.data).hexdigest(),
+            "read": lambda: image.data,
+            "mime_type": image.mime_type,
+            "filename": image.filename,
+            "path": None,
+        }
+    path = resolve_image_path(image)
+    if not path:
+        return None
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+
+    def _read() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    return {
+        "sha256": _file_digest(path),
+        "read": _read,
+        "mime_type": _MIME_BY_EXT.get(ext, "image/png"),
+        "filename": os.path.basename(path),
+        "path": path,
+    }
+
+
+def _lookup(provider: str, scope: str, digest: str) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(ProviderUpload)
+            .filter(ProviderUpload.provider == provider, ProviderUpload.scope == scope, ProviderUpload.sha256 == digest)
+            .first()
+        )
+        if row is None:
+            return None
+        if row.expires_at is not None and row.expires_at - settings.UPLOAD_REUSE_EXPIRY_MARGIN <= time.time():
+            return None
+        return row.remote_url
+    finally:
+        db.close()
+
+
+def _remember(provider: str, scope: str, digest: str, remote_url: str, expires_at: Optional[float]):
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(ProviderUpload)
+            .filter(ProviderUpload.provider == provider, ProviderUpload.scope == scope, ProviderUpload.sha256 == digest)
+            .first()
+        )
+        if row is None:
+            row = ProviderUpload(provider=provider, scope=scope, sha256=digest)
+            db.add(row)
+        row.remote_url = remote_url
+        row.expires_at = expires_at
+        db.query(ProviderUpload).filter(ProviderUpload.expires_at < time.time()).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"[Uploads] Could not record upload of {digest[:12]}: {e}")
+    finally:
+        db.close()
+
+
+def _upload(formatter: Any, scope: str, info: Dict[str, Any]) -> Optional[str]:
+    key = (formatter.name, scope, info["sha256"])
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+
+    remote_url = None
+    try:
+        uploaded = formatter.upload_image(info["read"](), info["mime_type"], info["filename"])
+        if uploaded:
+            remote_url, expires_at = uploaded
+            _remember(formatter.name, scope, info["sha256"], remote_url, expires_at)
+            _stats["uploaded"] += 1
+            logger.info(f"[Uploads] {formatter.name}: uploaded {info['sha256'][:12]} -> {remote_url}")
+    except Exception as e:
+        _stats["upload_failed"] += 1
+        logger.warning(f"[Uploads] {formatter.name}: upload of {info['sha256'][:12]} failed: {e}")
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        future.set_result(remote_url)
+    return remote_url
+
+
+def public_url(image: Union[str, EncodedImage]) -> Optional[str]:
+    """`PUBLIC_BASE_URL/assets/...` for a local or in-memory image, if a public URL is configured."""
+    base = settings.PUBLIC_BASE_URL.strip().rstrip("/")
+    if not base:
+        return None
+    if isinstance(image, EncodedImage):
+        ext = os.path.splitext(image.filename)[1] or ".png"
+        asset_url = asset_store.put_bytes(image.data, ext)
+    elif image.split("?", 1)[0].startswith("/assets/"):
+        asset_url = image
+    else:
+        path = resolve_image_path(image)
+        if not path:
+            return None
+        assets_root = os.path.abspath(settings.ASSETS_DIR)
+        abs_path = os.path.abspath(path)
+        if os.path.commonpath([assets_root, abs_path]) != assets_root:
+            return None
+        asset_url = "/assets/" + os.path.relpath(abs_path, assets_root).replace(os.sep, "/")
+    _stats["public_url"] += 1
+    return f"{base}{asset_url}"
+
+
+def reference_url(formatter: Any, scope: str, image: Union[str, EncodedImage]) -> Optional[str]:
+    """A reusable URL for `image` on the formatter's provider, or None to inline it."""
+    info = _describe(image)
+    if info is None:
+        return None
+    if getattr(formatter, "supports_upload", False):
+        cached = _lookup(formatter.name, scope, info["sha256"])
+        if cached:
+            _stats["reused"] += 1
+            return cached
+        uploaded = _upload(formatter, scope, info)
+        if uploaded:
+            return uploaded
+    return public_url(image)
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
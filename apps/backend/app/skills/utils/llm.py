@@ -19,7 +19,7 @@ def stream_llm_response(
     logger.info(f"\n--- [LLM Request] Model: {model_name} ---")
     logger.info("------------------------------------------\n")
 
-    full_content = ""
+    parts = []
 
     try:
         with client.chat.completions.create(
@@ -30,11 +30,11 @@ def stream_llm_response(
                     delta = chunk.choices[0].delta
                     if hasattr(delta, "content") and delta.content:
                         token = delta.content
-                        full_content += token
+                        parts.append(token)
                         yield {"type": "token", "content": token}
     except GeneratorExit:
         # Stream closed by caller (e.g. user abort or response closed); treat as normal.
         logger.info("[LLM Stream] Closed by caller.")
-        return full_content
+        return "".join(parts)
 
-    return full_content
+    return "".join(parts)
@@ -1,12 +1,17 @@
 import os
+import time
 import logging
 from sqlalchemy.orm import Session
 from app.models.asset import Asset
 from app.db.session import SessionLocal
 from app.core.config import settings
+from app.utils import asset_store
+from app.utils.composite_cache import composite_cache
 
 logger = logging.getLogger(__name__)
 
+_STALE_PART_SECONDS = 24 * 3600
+
 def clean_orphan_assets():
     """
     Clean up asset files that are not recorded in the database.
@@ -46,6 +51,13 @@ def clean_orphan_assets():
                 continue
                 
             if filename.startswith("."): 
+                # 超过一天未续传的下载残片
+                if filename.endswith(".part") and time.time() - os.path.getmtime(file_path) > _STALE_PART_SECONDS:
+                    try:
+                        os.remove(file_path)
+                        logger.info(f"🗑️ Deleted stale partial download: {filename}")
+                    except OSError as e:
+                        logger.error(f"Error deleting file {file_path}: {e}")
                 continue
 
             if filename not in valid_files:
@@ -63,3 +75,25 @@ def clean_orphan_assets():
 
     except Exception as e:
         logger.error(f"Error during asset cleanup: {e}")
+
+
+def clean_unreferenced_blobs():
+    """
+    Garbage-collect content-addressed blobs (assets/cas) that no Asset row,
+    episode config or style references any more.
+    """
+    db: Session = SessionLocal()
+    try:
+        pruned = composite_cache.prune()
+        if pruned:
+            logger.info(f"Pruned {pruned} idle storyboard composites.")
+        stats = asset_store.collect_garbage(db)
+        if stats["deleted"]:
+            logger.info(
+                f"✅ Removed {stats['deleted']}/{stats['blobs']} unreferenced blobs "
+                f"({stats['freed_bytes'] / 1024 / 1024:.1f} MB)."
+            )
+    except Exception as e:
+        logger.error(f"Error during blob cleanup: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,275 @@
+"""
+Content-addressed storage for files under ASSETS_DIR.
+
+Blobs are stored once per sha256 at `assets/cas/ab/cd/<sha256>.<ext>` and
+served through the existing `/assets` mount, so the returned URLs look like
+any other asset URL. Legacy flat `/assets/<uuid>.<ext>` files keep resolving
+untouched.
+
+Reference counts are not stored: they are derived from the rows that point
+at a blob (`Asset.url`, URLs anywhere inside `Episode.ai_config`, and
+`Style.image_url`) plus live composite-cache entries. `collect_garbage`
+removes blobs nobody references.
+
+Derived variants (e.g. right-sized copies from utils/image_variants.py) sit
+next to their blob as `<sha256>~<tag>.<ext>` and live as long as it does.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CAS_DIRNAME = "cas"
+CAS_URL_PREFIX = f"/assets/{CAS_DIRNAME}/"
+VARIANT_SEP = "~"
+
+_CHUNK_SIZE = 1024 * 1024
+# Unreferenced blobs younger than this are kept: an upload is returned to the
+# client before anything in the database points at it.
+GC_GRACE_SECONDS = 24 * 3600
+
+
+def cas_root() -> str:
+    return os.path.join(settings.ASSETS_DIR, CAS_DIRNAME)
+
+
+def _normalize_ext(ext: Optional[str]) -> str:
+    ext = (ext or "").strip().lower().lstrip(".")
+    if not ext or len(ext) > 5 or not ext.isalnum():
+        return "bin"
+    return "jpg" if ext == "jpeg" else ext
+
+
+def relative_path(digest: str, ext: str) -> str:
+    return f"{CAS_DIRNAME}/{digest[:2]}/{digest[2:4]}/{digest}.{_normalize_ext(ext)}"
+
+
+def url_for(digest: str, ext: str) -> str:
+    return f"/assets/{relative_path(digest, ext)}"
+
+
+def is_cas_url(url: Optional[str]) -> bool:
+    return isinstance(url, str) and _strip_url(url).startswith(CAS_URL_PREFIX)
+
+
+def _strip_url(url: str) -> str:
+    # Accept "./assets/..", "assets/.." and absolute "/assets/.." spellings.
+    if url.startswith("./"):
+        url = url[1:]
+    elif url.startswith("assets/"):
+        url = "/" + url
+    return url.split("?", 1)[0]
+
+
+def path_for_url(url: str) -> Optional[str]:
+    """Filesystem path for a `/assets/cas/...` URL, or None for other URLs."""
+    if not is_cas_url(url):
+        return None
+    rel = _strip_url(url)[len("/assets/"):]
+    if ".." in rel:
+        return None
+    return os.path.join(settings.ASSETS_DIR, rel)
+
+
+def variant_path(path: str, tag: str, ext: str) -> str:
+    """Where a derived variant of the file at `path` is stored (same directory)."""
+    stem = os.path.splitext(os.path.basename(path))[0].split(VARIANT_SEP, 1)[0]
+    return os.path.join(os.path.dirname(path), f"{stem}{VARIANT_SEP}{tag}.{_normalize_ext(ext)}")
+
+
+def _remove_variants(path: str):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = os.path.dirname(path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(f"{stem}{VARIANT_SEP}"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _place(tmp_path: str, digest: str, ext: str) -> Tuple[str, bool]:
+    """Move a fully written temp file into the store. Returns (url, deduplicated)."""
+    rel = relative_path(digest, ext)
+    final_path = os.path.join(settings.ASSETS_DIR, rel)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        # Refresh mtime so GC's grace period starts over for re-used blobs.
+        os.utime(final_path, None)
+        return f"/assets/{rel}", True
+    os.replace(tmp_path, final_path)
+    return f"/assets/{rel}", False
+
+
+def _tmp_file() -> Tuple[int, str]:
+    root = cas_root()
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkstemp(prefix=".incoming-", dir=root)
+
+
+def put_bytes(data: bytes, ext: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    existing = os.path.join(settings.ASSETS_DIR, relative_path(digest, ext))
+    if os.path.exists(existing):
+        os.utime(existing, None)
+        return url_for(digest, ext)
+    fd, tmp_path = _tmp_file()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        url, _ = _place(tmp_path, digest, ext)
+        return url
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def put_stream(stream: BinaryIO, ext: str) -> str:
+    """Store a file-like object, hashing while it is copied to disk."""
+    hasher = hashlib.sha256()
+    fd, tmp_path = _tmp_file()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
+        url, deduped = _place(tmp_path, hasher.hexdigest(), ext)
+        if deduped:
+            logger.info(f"[CAS] Reused existing blob {url}")
+        return url
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def put_file(path: str, ext: Optional[str] = None, sha256: Optional[str] = None) -> str:
+    """
+    Move an existing file (e.g. a finished download) into the store.
+    Pass `sha256` when it is already known to skip re-reading the file.
+    """
+    if ext is None:
+        ext = os.path.splitext(path)[1]
+    if not sha256:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        sha256 = hasher.hexdigest()
+    url, deduped = _place(path, sha256, ext)
+    if deduped:
+        logger.info(f"[CAS] Reused existing blob {url}")
+    return url
+
+
+def _iter_urls(value) -> Iterable[str]:
+    if isinstance(value, str):
+        if is_cas_url(value):
+            yield _strip_url(value)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _iter_urls(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _iter_urls(v)
+
+
+def collect_references(db) -> Counter:
+    """Count every database reference to a CAS blob, keyed by URL."""
+    from app.models.asset import Asset
+    from app.models.project import Episode
+    from app.models.style import Style
+
+    refs: Counter = Counter()
+    for (url,) in db.query(Asset.url).filter(Asset.url.like(f"%{CAS_URL_PREFIX}%")):
+        refs.update(_iter_urls(url))
+    for (url,) in db.query(Style.image_url).filter(Style.image_url.like(f"%{CAS_URL_PREFIX}%")):
+        refs.update(_iter_urls(url))
+    for (config,) in db.query(Episode.ai_config).filter(Episode.ai_config.isnot(None)):
+        refs.update(_iter_urls(config))
+    # Memoized storyboard composites are live until pruned.
+    from app.utils.composite_cache import composite_cache
+    refs.update(_iter_urls(list(composite_cache.referenced_urls())))
+    return refs
+
+
+def refcount(db, url: str) -> int:
+    if not is_cas_url(url):
+        return 0
+    return collect_references(db).get(_strip_url(url), 0)
+
+
+def collect_garbage(db, grace_seconds: float = GC_GRACE_SECONDS) -> Dict[str, int]:
+    """Delete blobs with no references that are older than the grace period."""
+    root = cas_root()
+    stats = {"blobs": 0, "deleted": 0, "freed_bytes": 0}
+    if not os.path.isdir(root):
+        return stats
+
+    refs = collect_references(db)
+    live_digests = {os.path.basename(url).split(".", 1)[0] for url in refs}
+    now = time.time()
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            if filename.startswith(".incoming-"):
+                # Interrupted writes.
+                if now - st.st_mtime > grace_seconds:
+                    os.remove(file_path)
+                continue
+            if VARIANT_SEP in filename:
+                # Variants follow their blob.
+                if filename.split(VARIANT_SEP, 1)[0] in live_digests or now - st.st_mtime < grace_seconds:
+                    continue
+                try:
+                    os.remove(file_path)
+                    stats["freed_bytes"] += st.st_size
+                except OSError:
+                    pass
+                continue
+            stats["blobs"] += 1
+            rel = os.path.relpath(file_path, settings.ASSETS_DIR).replace(os.sep, "/")
+            if refs.get(f"/assets/{rel}"):
+                continue
+            if now - st.st_mtime < grace_seconds:
+                continue
+            try:
+                os.remove(file_path)
+                stats["deleted"] += 1
+                stats["freed_bytes"] += st.st_size
+            except OSError as e:
+                logger.error(f"[CAS] Failed to delete {file_path}: {e}")
+    return stats
+
+
+def remove_if_unreferenced(db, url: str) -> bool:
+    """Delete a blob right away when nothing references it any more."""
+    path = path_for_url(url)
+    if not path or not os.path.exists(path):
+        return False
+    if refcount(db, url) > 0:
+        return False
+    os.remove(path)
+    _remove_variants(path)
+    logger.info(f"[CAS] Deleted unreferenced blob {url}")
+    return True
@@ -0,0 +1,129 @@
+"""
+Memoized base64 data URIs for local image files.
+
+Templates and style images are sent to providers as data URIs on nearly
+every image request. Encoding a multi-megabyte file each time is wasted
+work, so encoded payloads are kept in an LRU keyed by (path, mtime, size):
+editing or replacing a file changes the key and the stale entry simply ages
+out.
+"""
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_Key = Tuple[str, int, int, str]
+
+
+def mime_type_for(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return "image/jpeg" if ext in (".jpg", ".jpeg") else "image/png"
+
+
+class Base64Cache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[_Key, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def encode_file(self, path: str, mime_type: Optional[str] = None) -> Optional[str]:
+        """`data:<mime>;base64,...` for `path`, or None if it is not a file."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        mime_type = mime_type or mime_type_for(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, mime_type)
+
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is not None:
+                self._items.move_to_end(key)
+                self._hits += 1
+                return cached
+            self._misses += 1
+
+        with open(path, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode("utf-8")
+        data_uri = f"data:{mime_type};base64,{encoded}"
+
+        size = len(data_uri)
+        if size > self.max_bytes:
+            return data_uri
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = data_uri
+                self._bytes += size
+                while self._bytes > self.max_bytes and self._items:
+                    _, evicted = self._items.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return data_uri
+
+    def prewarm(self, paths: Iterable[str]) -> int:
+        warmed = 0
+        for path in paths:
+            try:
+                if self.encode_file(path):
+                    warmed += 1
+            except Exception as e:
+                logger.debug(f"[Base64Cache] Prewarm skipped {path}: {e}")
+        return warmed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+base64_cache = Base64Cache(max_bytes=settings.BASE64_CACHE_MAX_BYTES)
+
+
+def prewarm_default_images() -> int:
+    """
+    Encode the generation templates and every local style image ahead of the
+    first request, in the right-sized variants the engine actually sends.
+    Called from a background thread at startup.
+    """
+    from app.db.session import SessionLocal
+    from app.models.style import Style
+    from app.utils.image_variants import variant_paths
+
+    static_dir = os.path.join(settings.ASSETS_DIR, "static")
+    paths = [
+        os.path.join(static_dir, "character_template.png"),
+        os.path.join(static_dir, "scene_template.png"),
+    ]
+
+    db = SessionLocal()
+    try:
+        for (url,) in db.query(Style.image_url).all():
+            if url and url.startswith("/assets/"):
+                path = os.path.join(settings.ASSETS_DIR, url.replace("/assets/", "", 1))
+                if os.path.isfile(path):
+                    paths.extend(variant_paths(path))
+    except Exception as e:
+        logger.warning(f"[Base64Cache] Could not list style images: {e}")
+    finally:
+        db.close()
+
+    warmed = base64_cache.prewarm(dict.fromkeys(paths))
+    logger.info(f"[Base64Cache] Prewarmed {warmed} image(s).")
+    return warmed
@@ -0,0 +1,148 @@
+"""
+Memo of `combine_image` outputs keyed by a fingerprint of the inputs.
+
+Consecutive storyboard shots usually share the same character / scene set,
+so the merged + compressed composite is stored once in the asset store and
+looked up by fingerprint on the next request. Entries idle for longer than
+COMPOSITE_CACHE_MAX_IDLE are pruned; while an entry is live its blob counts
+as a reference for asset-store garbage collection.
+
+Hits only bump `last_used` in memory; the index is written on `store()`, on
+`prune()`, or by a hit at most every _SAVE_INTERVAL seconds.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.utils import asset_store
+from app.utils.path_utils import get_writable_path
+
+logger = logging.getLogger(__name__)
+
+# Idle pruning works in hours, so hit timestamps may reach disk late.
+_SAVE_INTERVAL = 60.0
+
+
+def _source_identity(src: str) -> Any:
+    if src.startswith("data:"):
+        return ["data", hashlib.sha256(src.encode("utf-8")).hexdigest()]
+    if src.startswith(("http://", "https://")):
+        return ["url", src]
+    path = src
+    if src.startswith("/assets/"):
+        path = os.path.join(settings.ASSETS_DIR, src.replace("/assets/", "", 1))
+    try:
+        st = os.stat(path)
+        return ["file", os.path.abspath(path), st.st_mtime_ns, st.st_size]
+    except OSError:
+        return ["missing", src]
+
+
+def fingerprint(images: List[Dict[str, Any]], direction: str) -> str:
+    """Stable hash of the image groups, their layout and the final direction."""
+    spec = {
+        "direction": direction,
+        "groups": [
+            {
+                "direction": group.get("direction"),
+                "data": [_source_identity(str(src)) for src in group.get("data") or []],
+            }
+            for group in images
+        ],
+    }
+    raw = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CompositeCache:
+    def __init__(self, index_path: str, max_idle: float):
+        self.index_path = index_path
+        self.max_idle = max_idle
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._saved_at = 0.0
+        self._hits = 0
+        self._misses = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f).get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[Composite] Ignoring unreadable index: {e}")
+        self._loaded = True
+
+    def _save(self):
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": self._entries}, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.warning(f"[Composite] Failed to write index: {e}")
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry:
+                path = asset_store.path_for_url(entry["url"])
+                if path and os.path.exists(path):
+                    entry["last_used"] = time.time()
+                    self._hits += 1
+                    self._dirty = True
+                    if time.monotonic() - self._saved_at >= _SAVE_INTERVAL:
+                        self._save()
+                    return dict(entry)
+                self._entries.pop(key, None)
+                self._dirty = True
+            self._misses += 1
+            return None
+
+    def store(self, key: str, url: str, mime_type: str):
+        with self._lock:
+            self._ensure_loaded()
+            self._entries[key] = {"url": url, "mime_type": mime_type, "last_used": time.time()}
+            self._save()
+
+    def referenced_urls(self) -> Set[str]:
+        with self._lock:
+            self._ensure_loaded()
+            return {entry["url"] for entry in self._entries.values()}
+
+    def prune(self) -> int:
+        """Forget idle entries; their blobs become eligible for GC."""
+        cutoff = time.time() - self.max_idle
+        with self._lock:
+            self._ensure_loaded()
+            stale = [k for k, e in self._entries.items() if e.get("last_used", 0) < cutoff]
+            for key in stale:
+                self._entries.pop(key, None)
+            if stale or self._dirty:
+                self._save()
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._ensure_loaded()
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+composite_cache = CompositeCache(
+    index_path=get_writable_path(os.path.join("cache", "composites.json")),
+    max_idle=settings.COMPOSITE_CACHE_MAX_IDLE,
+)
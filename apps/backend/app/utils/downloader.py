@@ -0,0 +1,374 @@
+"""
+Chunked, resumable downloads of provider media straight to disk.
+
+Generated videos can be hundreds of MB, so nothing here buffers a whole body
+in memory: responses are streamed in chunks into a hidden `.part` file next
+to the destination, hashed (sha256) on the way, and atomically renamed when
+complete. Interrupted transfers resume with HTTP Range, and large files on
+servers that accept ranges are fetched over several connections.
+"""
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Generator, Optional, Tuple, Union
+
+import requests
+
+from app.core.config import settings
+from app.utils.http_client import request as http_request
+
+logger = logging.getLogger(__name__)
+
+# on_progress(bytes_done, total_bytes_or_None)
+ProgressFn = Callable[[int, Optional[int]], None]
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+_RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+@dataclass
+class DownloadResult:
+    path: str
+    size: int
+    sha256: str
+    content_type: Optional[str] = None
+    resumed: bool = False
+    connections: int = 1
+
+
+@dataclass
+class DownloadProgress:
+    done: int
+    total: Optional[int]
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if not self.total:
+            return None
+        return min(self.done / self.total, 1.0)
+
+
+def partial_path(dest_path: str) -> str:
+    """Hidden sibling file so orphan cleanup skips in-flight downloads."""
+    directory, name = os.path.split(dest_path)
+    return os.path.join(directory, f".{name}.part")
+
+
+def _parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Returns (start, total) from a Content-Range header."""
+    if not value:
+        return None, None
+    m = _CONTENT_RANGE_RE.match(value.strip())
+    if not m:
+        m_total = re.match(r"bytes\s+\*/(\d+)", value.strip())
+        return (None, int(m_total.group(1))) if m_total else (None, None)
+    total = None if m.group(3) == "*" else int(m.group(3))
+    return int(m.group(1)), total
+
+
+def _response_total(res: requests.Response, offset: int) -> Optional[int]:
+    if res.status_code == 206:
+        _, total = _parse_content_range(res.headers.get("Content-Range"))
+        if total is not None:
+            return total
+    length = res.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length) + (offset if res.status_code == 206 else 0)
+    return None
+
+
+def _hash_file_prefix(path: str, length: int, chunk_size: int):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h
+
+
+class _Counter:
+    """Thread-safe byte counter that forwards to an optional callback."""
+
+    def __init__(self, total: Optional[int], on_progress: Optional[ProgressFn], start: int = 0):
+        self.total = total
+        self.done = start
+        self._lock = threading.Lock()
+        self._on_progress = on_progress
+
+    def add(self, n: int):
+        with self._lock:
+            self.done += n
+            done = self.done
+        if self._on_progress:
+            try:
+                self._on_progress(done, self.total)
+            except Exception as e:
+                logger.debug(f"[Download] Progress callback failed: {e}")
+
+
+def _fetch_range(
+    url: str,
+    path: str,
+    start: int,
+    end: int,
+    headers: Dict[str, str],
+    timeout,
+    chunk_size: int,
+    counter: _Counter,
+    attempts: int,
+):
+    """Download bytes [start, end] into an already-allocated file."""
+    pos = start
+    for attempt in range(attempts):
+        if pos > end:
+            return
+        req_headers = dict(headers)
+        req_headers["Range"] = f"bytes={pos}-{end}"
+        try:
+            res = http_request("GET", url, stream=True, timeout=timeout, headers=req_headers)
+            try:
+                if res.status_code != 206:
+                    raise DownloadError(f"Range request not honoured ({res.status_code})")
+                with open(path, "r+b") as f:
+                    f.seek(pos)
+                    for chunk in res.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        chunk = chunk[: end + 1 - pos]
+                        f.write(chunk)
+                        pos += len(chunk)
+                        counter.add(len(chunk))
+                        if pos > end:
+                            break
+            finally:
+                res.close()
+        except _RETRYABLE_ERRORS as e:
+            logger.warning(f"[Download] Segment {start}-{end} interrupted at {pos} ({e}), retry {attempt + 1}/{attempts}")
+            time.sleep(min(2 ** attempt, 10))
+    if pos <= end:
+        raise DownloadError(f"Segment {start}-{end} incomplete after {attempts} attempts")
+
+
+def _download_parallel(
+    url: str,
+    part: str,
+    total: int,
+    connections: int,
+    headers: Dict[str, str],
+    timeout,
+    chunk_size: int,
+    on_progress: Optional[ProgressFn],
+    attempts: int,
+) -> str:
+    with open(part, "wb") as f:
+        f.truncate(total)
+
+    counter = _Counter(total, on_progress)
+    segment = -(-total // connections)
+    ranges = [(s, min(s + segment, total) - 1) for s in range(0, total, segment)]
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="download") as pool:
+        futures = [
+            pool.submit(_fetch_range, url, part, s, e, headers, timeout, chunk_size, counter, attempts)
+            for s, e in ranges
+        ]
+        for fut in futures:
+            fut.result()
+
+    # Segments land out of order, so hash once the file is complete.
+    return _hash_file_prefix(part, total, chunk_size).hexdigest()
+
+
+def download(
+    url: str,
+    dest_path: str,
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Union[Tuple[float, float], float] = (10, 600),
+    chunk_size: Optional[int] = None,
+    connections: Optional[int] = None,
+    on_progress: Optional[ProgressFn] = None,
+    attempts: int = 3,
+    keep_partial: bool = True,
+) -> DownloadResult:
+    """
+    Stream `url` to `dest_path`.
+
+    A leftover `.part` file from an earlier attempt is resumed with a Range
+    request. When the server advertises range support and the body is larger
+    than DOWNLOAD_PARALLEL_THRESHOLD, the file is split across `connections`
+    requests instead.
+    """
+    chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+    connections = connections if connections is not None else settings.DOWNLOAD_CONNECTIONS
+    base_headers = dict(headers or {})
+    # Byte offsets must refer to the stored representation.
+    base_headers["Accept-Encoding"] = "identity"
+
+    directory = os.path.dirname(dest_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    part = partial_path(dest_path)
+
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    resumed = False
+    total: Optional[int] = None
+    content_type: Optional[str] = None
+    hasher = None
+    counter: Optional[_Counter] = None
+
+    try:
+        for attempt in range(attempts):
+            req_headers = dict(base_headers)
+            if offset:
+                req_headers["Range"] = f"bytes={offset}-"
+            try:
+                res = http_request("GET", url, stream=True, timeout=timeout, headers=req_headers)
+            except _RETRYABLE_ERRORS as e:
+                logger.warning(f"[Download] {url} connect failed ({e}), retry {attempt + 1}/{attempts}")
+                time.sleep(min(2 ** attempt, 10))
+                continue
+
+            try:
+                if res.status_code == 416 and offset:
+                    _, remote_total = _parse_content_range(res.headers.get("Content-Range"))
+                    if remote_total == offset:
+                        # The partial file is already the whole body.
+                        total = offset
+                        hasher = _hash_file_prefix(part, offset, chunk_size)
+                        break
+                    offset = 0
+                    os.remove(part)
+                    continue
+                if res.status_code not in (200, 206):
+                    raise DownloadError(f"Failed to download {url} ({res.status_code})")
+
+                content_type = content_type or res.headers.get("Content-Type")
+                if res.status_code == 206:
+                    range_start, _ = _parse_content_range(res.headers.get("Content-Range"))
+                    if range_start != offset:
+                        raise DownloadError(f"Unexpected Content-Range for {url}: {res.headers.get('Content-Range')}")
+                    resumed = resumed or offset > 0
+                else:
+                    # Server ignored the Range header: start over.
+                    offset = 0
+                total = _response_total(res, offset)
+
+                accepts_ranges = res.status_code == 206 or res.headers.get("Accept-Ranges", "").lower() == "bytes"
+                if (
+                    offset == 0
+                    and connections > 1
+                    and accepts_ranges
+                    and total
+                    and total >= settings.DOWNLOAD_PARALLEL_THRESHOLD
+                ):
+                    res.close()
+                    digest = _download_parallel(
+                        url, part, total, connections, base_headers, timeout,
+                        chunk_size, on_progress, attempts,
+                    )
+                    os.replace(part, dest_path)
+                    logger.info(f"[Download] {url} -> {dest_path} ({total} bytes, {connections} connections)")
+                    return DownloadResult(dest_path, total, digest, content_type, False, connections)
+
+                if offset == 0:
+                    hasher = hashlib.sha256()
+                elif hasher is None:
+                    hasher = _hash_file_prefix(part, offset, chunk_size)
+                counter = _Counter(total, on_progress, start=offset)
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in res.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+                        counter.add(len(chunk))
+            except _RETRYABLE_ERRORS as e:
+                logger.warning(f"[Download] {url} interrupted at {offset} bytes ({e}), retry {attempt + 1}/{attempts}")
+                time.sleep(min(2 ** attempt, 10))
+                continue
+            finally:
+                res.close()
+
+            if total is not None and offset < total:
+                logger.warning(f"[Download] {url} ended early ({offset}/{total}), retry {attempt + 1}/{attempts}")
+                continue
+            break
+        else:
+            raise DownloadError(f"Failed to download {url} after {attempts} attempts")
+
+        if total is not None and offset < total:
+            raise DownloadError(f"Incomplete download of {url} ({offset}/{total} bytes)")
+
+        os.replace(part, dest_path)
+        size = offset
+        logger.info(f"[Download] {url} -> {dest_path} ({size} bytes{', resumed' if resumed else ''})")
+        return DownloadResult(dest_path, size, hasher.hexdigest(), content_type, resumed, 1)
+    except BaseException:
+        if not keep_partial and os.path.exists(part):
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+        raise
+
+
+def iter_download(
+    url: str,
+    dest_path: str,
+    *,
+    interval: float = 0.5,
+    **kwargs,
+) -> Generator[DownloadProgress, None, DownloadResult]:
+    """
+    Run `download` on a worker thread and yield byte progress every
+    `interval` seconds, for SSE generators. The result is the generator's
+    return value (use `yield from`).
+    """
+    updates: "queue.Queue[Tuple[int, Optional[int]]]" = queue.Queue()
+    result: Dict[str, object] = {}
+
+    def _target():
+        try:
+            result["value"] = download(
+                url, dest_path, on_progress=lambda done, total: updates.put((done, total)), **kwargs
+            )
+        except BaseException as e:
+            result["error"] = e
+
+    worker = threading.Thread(target=_target, daemon=True, name="download")
+    worker.start()
+    last: Optional[Tuple[int, Optional[int]]] = None
+    while worker.is_alive():
+        worker.join(interval)
+        latest = None
+        while True:
+            try:
+                latest = updates.get_nowait()
+            except queue.Empty:
+                break
+        if latest and latest != last:
+            last = latest
+            yield DownloadProgress(*latest)
+
+    if "error" in result:
+        raise result["error"]  # type: ignore[misc]
+    return result["value"]  # type: ignore[return-value]
@@ -1,20 +1,144 @@
+"""
+Shared HTTP session for provider and download calls.
+
+Retries happen here rather than in urllib3 so they can tell idempotent calls
+apart from the rest:
+
+- every call is retried when the connection could not be established (the
+  request never reached the provider);
+- idempotent calls (GET/HEAD/PUT/DELETE/OPTIONS, or POSTs sent with an
+  idempotency key and `idempotent=True`) are also retried on read timeouts,
+  dropped connections and 500/502/503/504;
+- a POST that may have been accepted (e.g. a video task creation that timed
+  out while waiting for the response) is never re-sent blindly.
+
+Retries stop after HTTP_RETRY_MAX attempts or once HTTP_RETRY_BUDGET seconds
+have passed since the first attempt, whichever comes first.
+
+Each host also has a circuit breaker: HTTP_BREAKER_THRESHOLD consecutive
+failures open it, calls then fail fast with CircuitOpenError for
+HTTP_BREAKER_COOLDOWN seconds, after which one trial call is let through.
+"""
 import logging
 import os
+import threading
 import time
-from typing import Any, Dict, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
 
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 # Default timeouts: (connect, read)
 DEFAULT_TIMEOUT: Tuple[float, float] = (10.0, 600.0)
 
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"})
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+# 429 is left to the per-key rate governor (utils/rate_governor.py),
+# which re-queues behind Retry-After instead of retrying blindly.
+
+_REQUEST_ARGS = ("headers", "files", "data", "params", "auth", "cookies", "hooks", "json")
+
 _session: Optional[requests.Session] = None
 
 
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The host's circuit breaker is open; the call was not sent."""
+
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    def __init__(self, host: str):
+        self.host = host
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class CircuitBreakers:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._breakers: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host: str) -> _Breaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = _Breaker(host)
+        return breaker
+
+    def before(self, host: str):
+        """Raise CircuitOpenError unless a call to `host` may go out now."""
+        with self._lock:
+            breaker = self._get(host)
+            if breaker.state == BREAKER_CLOSED:
+                return
+            if breaker.state == BREAKER_OPEN and time.monotonic() - breaker.opened_at >= self.cooldown:
+                # Let exactly one trial call through.
+                breaker.state = BREAKER_HALF_OPEN
+                return
+            breaker.rejected += 1
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - breaker.opened_at))
+        raise CircuitOpenError(f"Circuit open for {host} (retry in {retry_in:.0f}s): {breaker.last_error}")
+
+    def success(self, host: str):
+        with self._lock:
+            breaker = self._get(host)
+            if breaker.state != BREAKER_CLOSED:
+                logger.info(f"[HTTP] Circuit for {host} closed again.")
+            breaker.state = BREAKER_CLOSED
+            breaker.failures = 0
+            breaker.opened_at = None
+
+    def failure(self, host: str, error: str) -> bool:
+        """Record a failed call; True if the breaker is (now) open."""
+        with self._lock:
+            breaker = self._get(host)
+            breaker.failures += 1
+            breaker.last_error = error
+            if breaker.state == BREAKER_HALF_OPEN or (
+                breaker.state == BREAKER_CLOSED and breaker.failures >= self.threshold
+            ):
+                breaker.state = BREAKER_OPEN
+                breaker.opened_at = time.monotonic()
+                breaker.trips += 1
+                logger.warning(
+                    f"[HTTP] Circuit for {host} opened after {breaker.failures} consecutive failures: {error}"
+                )
+            return breaker.state == BREAKER_OPEN
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "host": b.host,
+                    "state": b.state,
+                    "consecutive_failures": b.failures,
+                    "trips": b.trips,
+                    "rejected": b.rejected,
+                    "last_error": b.last_error,
+                }
+                for b in sorted(self._breakers.values(), key=lambda b: b.host)
+            ]
+
+
+breakers = CircuitBreakers(settings.HTTP_BREAKER_THRESHOLD, settings.HTTP_BREAKER_COOLDOWN)
+_retry_counts = {"retries": 0, "budget_exhausted": 0}
+
+
 def _ensure_no_proxy_defaults() -> None:
     """
     Ensure localhost bypasses proxy to avoid self-call failures in Docker/Tauri.
@@ -50,16 +174,8 @@ def _build_session() -> requests.Session:
 
     session = requests.Session()
     # Keep default trust_env=True to honor proxy envs when present.
-    retries = Retry(
-        total=2,
-        connect=2,
-        read=2,
-        backoff_factor=0.6,
-        status_forcelist=(429, 500, 502, 503, 504),
-        allowed_methods=None,  # allow retries for all methods (POST included)
-        raise_on_status=False,
-    )
-    adapter = HTTPAdapter(max_retries=retries, pool_connections=20, pool_maxsize=20)
+    # No adapter-level retries: request() decides what is safe to re-send.
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     # A concise UA helps with some proxy/WAF setups.
@@ -83,25 +199,104 @@ def get_session() -> requests.Session:
     return _session
 
 
+def _is_connect_failure(exc: BaseException) -> bool:
+    """True when the request provably never reached the server."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.exceptions.ConnectionError) or isinstance(
+        exc, requests.exceptions.ProxyError
+    ):
+        return False
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, "reason", reason)  # MaxRetryError wraps the cause
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def _host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
 def request(
     method: str,
     url: str,
     *,
     timeout: Optional[Union[Tuple[float, float], float]] = None,
+    idempotent: Optional[bool] = None,
     **kwargs: Any,
 ) -> requests.Response:
     """
     Wrapper around requests with retry + sane defaults.
+
+    `idempotent` defaults to the HTTP method's semantics; pass True for a
+    POST that carries a provider idempotency key.
     """
     session = get_session()
     final_timeout = timeout if timeout is not None else DEFAULT_TIMEOUT
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    host = _host_of(url)
+
+    # Prepare once so the body (including multipart files) is re-sent as is.
+    prepared = session.prepare_request(
+        requests.Request(method, url, **{k: kwargs.pop(k) for k in _REQUEST_ARGS if k in kwargs})
+    )
+    send_kwargs = session.merge_environment_settings(
+        prepared.url,
+        kwargs.pop("proxies", None) or {},
+        kwargs.pop("stream", None),
+        kwargs.pop("verify", None),
+        kwargs.pop("cert", None),
+    )
+    send_kwargs["allow_redirects"] = kwargs.pop("allow_redirects", True)
+    if kwargs:
+        raise TypeError(f"Unexpected request arguments: {', '.join(kwargs)}")
+
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            breakers.before(host)
+            response = session.send(prepared.copy(), timeout=final_timeout, **send_kwargs)
+        except requests.exceptions.RequestException as e:
+            # No retry once the host's breaker is open: it would only fail fast.
+            is_open = isinstance(e, CircuitOpenError) or breakers.failure(host, str(e))
+            retryable = not is_open and (idempotent or _is_connect_failure(e))
+            if retryable and _may_retry(attempt, started):
+                logger.warning(f"[HTTP] {method} {url} failed ({e}), retry {attempt}/{settings.HTTP_RETRY_MAX}")
+                continue
+            # Add context for easier debugging
+            logger.error(f"[HTTP] {method} {url} failed: {e}")
+            raise
+
+        if response.status_code not in RETRY_STATUSES:
+            breakers.success(host)
+            return response
+        is_open = breakers.failure(host, f"HTTP {response.status_code}")
+        if is_open or not idempotent or not _may_retry(attempt, started):
+            return response
+        logger.warning(
+            f"[HTTP] {method} {url} returned {response.status_code}, retry {attempt}/{settings.HTTP_RETRY_MAX}"
+        )
+        response.close()
+
+
+def _may_retry(attempt: int, started: float) -> bool:
+    """Sleep the backoff and return True if another attempt fits the budget."""
+    if attempt > settings.HTTP_RETRY_MAX:
+        return False
+    backoff = settings.HTTP_RETRY_BACKOFF * (2 ** (attempt - 1))
+    if time.monotonic() - started + backoff > settings.HTTP_RETRY_BUDGET:
+        _retry_counts["budget_exhausted"] += 1
+        return False
+    _retry_counts["retries"] += 1
+    time.sleep(backoff)
+    return True
+
 
-    try:
-        return session.request(method, url, timeout=final_timeout, **kwargs)
-    except requests.exceptions.RequestException as e:
-        # Add context for easier debugging
-        logger.error(f"[HTTP] {method} {url} failed: {e}")
-        raise
+def stats() -> Dict[str, Any]:
+    return {**_retry_counts, "breakers": breakers.stats()}
 
 
 def download_headers() -> Dict[str, str]:
@@ -0,0 +1,180 @@
+"""
+Size-targeted image encoding.
+
+Providers cap upload sizes, so composites have to be squeezed under a byte
+budget. Rather than stepping JPEG quality down 5 points at a time (up to ~18
+full encodes), the encoder:
+
+1. tries a lossless PNG when a quick low-effort encode says it can fit,
+2. makes one lossy trial encode and uses its size to pick the search range,
+3. bisects quality within that range,
+4. if even the lowest quality is too big, derives a single resize factor
+   from the byte ratio and searches again at the new size.
+"""
+import io
+import math
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+_LOSSY_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+}
+
+# Lossless PNG rarely fits the budget once a composite gets this large, so
+# skip the (slow) trial encode entirely.
+_PNG_MAX_PIXELS = 4_000_000
+# Compression-level-1 PNGs come out ~10-15% larger than optimized ones.
+_PNG_OPTIMIZE_HEADROOM = 1.15
+_TRIAL_QUALITY = 85
+# JPEG/WebP at quality 95 is typically 1.5-2x the size at 85.
+_TRIAL_TO_MAX_GROWTH = 2.0
+_MAX_RESIZES = 3
+_MIN_SIDE = 100
+
+
+@dataclass
+class EncodeResult:
+    stream: io.BytesIO
+    ext: str
+    mime_type: str
+    size: int
+    quality: Optional[int]
+    scale: float
+    encodes: int
+
+
+class _Counter:
+    def __init__(self):
+        self.encodes = 0
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    if image.mode == "RGB":
+        return image
+    rgba = image.convert("RGBA")
+    background = Image.new("RGB", rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.split()[3])
+    return background
+
+
+def _encode(image: Image.Image, fmt: str, quality: int, counter: _Counter) -> io.BytesIO:
+    buf = io.BytesIO()
+    pil_format = _LOSSY_FORMATS[fmt][0]
+    if pil_format == "WEBP":
+        image.save(buf, format=pil_format, quality=quality, method=4)
+    else:
+        image.save(buf, format=pil_format, quality=quality, optimize=False)
+    counter.encodes += 1
+    return buf
+
+
+def _bisect_quality(
+    image: Image.Image,
+    fmt: str,
+    target_bytes: int,
+    lo: int,
+    hi: int,
+    counter: _Counter,
+) -> Optional[Tuple[io.BytesIO, int]]:
+    """Highest quality in [lo, hi] that fits, or None if `lo` does not fit."""
+    best: Optional[Tuple[io.BytesIO, int]] = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        buf = _encode(image, fmt, mid, counter)
+        if buf.tell() <= target_bytes:
+            best = (buf, mid)
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def _fit_lossy(
+    image: Image.Image,
+    fmt: str,
+    target_bytes: int,
+    min_quality: int,
+    max_quality: int,
+    counter: _Counter,
+) -> Tuple[Optional[Tuple[io.BytesIO, int]], int]:
+    """
+    Returns (best fit, size at min_quality). The trial encode at
+    _TRIAL_QUALITY decides which half of the quality range to search.
+    """
+    trial_q = min(max(_TRIAL_QUALITY, min_quality), max_quality)
+    trial = _encode(image, fmt, trial_q, counter)
+    trial_size = trial.tell()
+    if trial_size <= target_bytes:
+        if trial_q < max_quality and trial_size * _TRIAL_TO_MAX_GROWTH <= target_bytes:
+            # Plenty of room: the top quality almost certainly fits.
+            top = _encode(image, fmt, max_quality, counter)
+            if top.tell() <= target_bytes:
+                return (top, max_quality), trial_size
+        upper = _bisect_quality(image, fmt, target_bytes, trial_q + 1, max_quality, counter)
+        return (upper or (trial, trial_q)), trial_size
+
+    floor = _encode(image, fmt, min_quality, counter)
+    floor_size = floor.tell()
+    if floor_size > target_bytes:
+        return None, floor_size
+    best = _bisect_quality(image, fmt, target_bytes, min_quality + 1, trial_q - 1, counter)
+    return (best or (floor, min_quality)), floor_size
+
+
+def encode_to_target(
+    image: Image.Image,
+    target_bytes: int,
+    lossy_format: str = "jpeg",
+    min_quality: int = 10,
+    max_quality: int = 95,
+    allow_png: bool = True,
+) -> EncodeResult:
+    """Encode `image` as large (quality-wise) as possible within `target_bytes`."""
+    if lossy_format not in _LOSSY_FORMATS:
+        raise ValueError(f"Unsupported output format: {lossy_format}")
+    counter = _Counter()
+
+    if allow_png and image.width * image.height <= _PNG_MAX_PIXELS:
+        # A fast, low-effort PNG predicts whether the optimized one can fit.
+        buf = io.BytesIO()
+        image.save(buf, format="PNG", compress_level=1)
+        counter.encodes += 1
+        if buf.tell() <= target_bytes * _PNG_OPTIMIZE_HEADROOM:
+            if buf.tell() > target_bytes:
+                buf = io.BytesIO()
+                image.save(buf, format="PNG", optimize=True)
+                counter.encodes += 1
+            if buf.tell() <= target_bytes:
+                size = buf.tell()
+                buf.seek(0)
+                return EncodeResult(buf, "png", "image/png", size, None, 1.0, counter.encodes)
+
+    _, ext, mime_type = _LOSSY_FORMATS[lossy_format]
+    working = _flatten(image) if lossy_format == "jpeg" else image
+    if lossy_format == "webp" and working.mode not in ("RGB", "RGBA"):
+        working = working.convert("RGBA")
+
+    scale = 1.0
+    best = None
+    for _ in range(_MAX_RESIZES + 1):
+        best, floor_size = _fit_lossy(working, lossy_format, target_bytes, min_quality, max_quality, counter)
+        if best or min(working.size) <= _MIN_SIDE:
+            break
+        # Encoded size scales roughly with pixel count: one step, with margin.
+        factor = math.sqrt(target_bytes / floor_size) * 0.95
+        new_w = max(_MIN_SIDE, int(working.width * factor))
+        new_h = max(_MIN_SIDE, int(working.height * factor))
+        scale *= new_w / working.width
+        working = working.resize((new_w, new_h), Image.Resampling.LANCZOS)
+
+    if best is None:
+        # Cannot shrink further: return the smallest thing we can make.
+        best = (_encode(working, lossy_format, min_quality, counter), min_quality)
+
+    buf, quality = best
+    size = buf.tell()
+    buf.seek(0)
+    return EncodeResult(buf, ext, mime_type, size, quality, scale, counter.encodes)
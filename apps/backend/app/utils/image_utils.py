@@ -4,12 +4,18 @@ Image utilities for compositing and processing
 import base64
 import io
 import os
-import uuid
-import tempfile
-from app.utils.http_client import request as http_request, download_headers
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from PIL import Image
-from typing import List, Optional
+from typing import List, Optional, Union
 from app.core.config import settings
+from app.utils import asset_store
+from app.utils.composite_cache import composite_cache, fingerprint as composite_fingerprint
+from app.utils.base64_cache import base64_cache
+from app.utils.image_encoder import encode_to_target
+from app.utils.remote_cache import remote_cache
 
 
 
@@ -30,9 +36,13 @@ def load_image_from_url_or_path(url: str) -> Image.Image:
         img_data = base64.b64decode(base64_data)
         return Image.open(io.BytesIO(img_data))
     elif url.startswith('http://') or url.startswith('https://'):
-        # Remote URL
-        response = http_request("GET", url, timeout=30, headers=download_headers())
-        return Image.open(io.BytesIO(response.content))
+        # Remote URL - served from the shared remote cache
+        local_path = remote_cache.fetch(url, timeout=(10, 30))
+        if not local_path:
+            raise ValueError(f"Failed to fetch remote image: {url[:80]}")
+        img = Image.open(local_path)
+        img.load()
+        return img
     elif url.startswith('/assets/'):
         # Local asset path - convert to filesystem path
         filename = url.replace('/assets/', '')
@@ -190,30 +200,74 @@ def composite_reference_image(
     
     return data_uri
 
-def to_base64(image_file: str) -> Optional[str]:
+def resolve_image_path(image_file: str) -> Optional[str]:
+    """Existing filesystem path for a local image path or `/assets/...` URL."""
     # 1. First check if the file exists as-is (handles valid absolute paths and relative paths)
     if os.path.exists(image_file):
-        pass
+        return image_file
     # 2. If not, try stripping leading slash (handles /assets/... -> assets/...)
-    elif image_file.startswith('/'):
+    if image_file.startswith('/'):
         image_file = image_file.lstrip('/')
 
     # 3. Fallback: try relative to CWD if it still doesn't exist
     if not os.path.exists(image_file):
         image_file = os.path.join(os.getcwd(), image_file)
-    
-    if os.path.exists(image_file):
-        with open(image_file, "rb") as file:
-            encoded_string = base64.b64encode(file.read()).decode('utf-8')
-            encoded_string = f"data:image/png;base64,{encoded_string}"
-            return encoded_string
+    return image_file if os.path.exists(image_file) else None
+
+
+def to_base64(image_file: Union[str, "EncodedImage"]) -> Optional[str]:
+    if isinstance(image_file, EncodedImage):
+        return image_file.data_uri()
+    path = resolve_image_path(image_file)
+    if path:
+        return base64_cache.encode_file(path)
     else:
         return None
 
-def split_grid_image(image_path: str, rows: int = 3, cols: int = 3) -> List[str]:
+# 分镜宫格布局（16:9 画面）：6 宫格为 2x3，9 宫格为 3x3
+GRID_LAYOUTS = {6: (2, 3), 9: (3, 3)}
+
+_FRAME_CACHE_SIZE = 8
+_frame_cache: "OrderedDict[tuple, List[EncodedImage]]" = OrderedDict()
+_frame_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """An encoded image held in memory, usable wherever a file path was."""
+    data: bytes
+    mime_type: str = "image/png"
+    filename: str = "image.png"
+
+    def as_file(self) -> io.BytesIO:
+        return io.BytesIO(self.data)
+
+    def data_uri(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+def _encode_frame(crop: Image.Image, filename: str) -> EncodedImage:
+    buf = io.BytesIO()
+    crop.save(buf, format='PNG')
+    return EncodedImage(buf.getvalue(), "image/png", filename)
+
+
+def split_grid_frames(image_path: str, grid_count: int = 9) -> List[EncodedImage]:
     """
-    Split a grid image into individual frames and return file paths.
+    Split a storyboard grid into frames encoded in memory (no temp files).
+    Results are cached per source file so retries skip the split.
     """
+    rows, cols = GRID_LAYOUTS.get(grid_count, GRID_LAYOUTS[9])
+    cache_key = None
+    if os.path.isfile(image_path):
+        st = os.stat(image_path)
+        cache_key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size, rows, cols)
+        with _frame_cache_lock:
+            cached = _frame_cache.get(cache_key)
+            if cached is not None:
+                _frame_cache.move_to_end(cache_key)
+                return list(cached)
+
     img = load_image_from_url_or_path(image_path)
     if img.mode in ('RGBA', 'LA', 'P'):
         background = Image.new('RGB', img.size, (255, 255, 255))
@@ -228,19 +282,28 @@ def split_grid_image(image_path: str, rows: int = 3, cols: int = 3) -> List[str]
     cell_w = width // cols
     cell_h = height // rows
 
-    frames: List[str] = []
+    crops = []
     for r in range(rows):
         for c in range(cols):
             left = c * cell_w
             top = r * cell_h
             right = (c + 1) * cell_w if c < cols - 1 else width
             bottom = (r + 1) * cell_h if r < rows - 1 else height
-            crop = img.crop((left, top, right, bottom))
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            crop.save(tmp.name, format='PNG')
-            frames.append(tmp.name)
+            crops.append(img.crop((left, top, right, bottom)))
 
-    return frames
+    # PNG 编码会释放 GIL，多帧并行编码
+    with ThreadPoolExecutor(max_workers=min(len(crops), 4)) as pool:
+        frames = list(pool.map(
+            lambda pair: _encode_frame(pair[1], f"keyframe_{pair[0] + 1}.png"),
+            enumerate(crops),
+        ))
+
+    if cache_key is not None:
+        with _frame_cache_lock:
+            _frame_cache[cache_key] = frames
+            while len(_frame_cache) > _FRAME_CACHE_SIZE:
+                _frame_cache.popitem(last=False)
+    return list(frames)
 
 def _merge_images_list(img_objects, mode):
     if not img_objects: return None
@@ -263,42 +326,8 @@ def _merge_images_list(img_objects, mode):
     return new_img
 
 def _get_compressed_stream(image, target_size_mb=2):
-    target_bytes = target_size_mb * 1024 * 1024
-    img_byte_arr = io.BytesIO()
-    
-    # 1. 尝试 PNG
-    image.save(img_byte_arr, format='PNG', optimize=True)
-    if img_byte_arr.tell() <= target_bytes:
-        img_byte_arr.seek(0)
-        return img_byte_arr, 'png', 'image/png'
-
-    # 2. 转 JPEG 压缩
-    rgb_image = Image.new("RGB", image.size, (255, 255, 255))
-    rgb_image.paste(image, mask=image.split()[3] if image.mode == 'RGBA' else None)
-        
-    quality = 95
-    while quality >= 10:
-        img_byte_arr.seek(0)
-        img_byte_arr.truncate()
-        rgb_image.save(img_byte_arr, format='JPEG', quality=quality)
-        if img_byte_arr.tell() <= target_bytes:
-            img_byte_arr.seek(0)
-            return img_byte_arr, 'jpg', 'image/jpeg'
-        quality -= 5
-    
-    # 3. 缩放兜底
-    scale = 0.9
-    width, height = rgb_image.size
-    while img_byte_arr.tell() > target_bytes and width > 100:
-        width = int(width * scale)
-        height = int(height * scale)
-        resized = rgb_image.resize((width, height), Image.Resampling.LANCZOS)
-        img_byte_arr.seek(0)
-        img_byte_arr.truncate()
-        resized.save(img_byte_arr, format='JPEG', quality=quality)
-    
-    img_byte_arr.seek(0)
-    return img_byte_arr, 'jpg', 'image/jpeg'
+    result = encode_to_target(image, int(target_size_mb * 1024 * 1024))
+    return result.stream, result.ext, result.mime_type
 
 def combine_image(images, direction='vertical', return_type='blob'):
     """
@@ -310,6 +339,15 @@ def combine_image(images, direction='vertical', return_type='blob'):
         if return_type == 'blob': (io.BytesIO, str)
         if return_type == 'path': (str, str)
     """
+    # 相同的输入图片集合与布局直接复用上次的合成结果
+    cache_key = composite_fingerprint(images, direction)
+    cached = composite_cache.lookup(cache_key)
+    if cached:
+        if return_type == 'path':
+            return f".{cached['url']}", cached['mime_type']
+        with open(asset_store.path_for_url(cached['url']), 'rb') as f:
+            return io.BytesIO(f.read()), cached['mime_type']
+
     # base_path = os.getcwd() 
     group_images = []
 
@@ -337,22 +375,14 @@ def combine_image(images, direction='vertical', return_type='blob'):
     # 3. 压缩获取内存流 (假设 _get_compressed_stream 返回 stream, ext, mime)
     img_stream, ext, mime_type = _get_compressed_stream(final_image_obj)
 
-    # 4. 保存本地副本
-    output_dir = settings.ASSETS_DIR
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    filename = f"combine_{uuid.uuid4()}.{ext}"
-    full_save_path = os.path.join(output_dir, filename)
-
-    # 将内存流内容写入硬盘
-    with open(full_save_path, 'wb') as f:
-        f.write(img_stream.getvalue())
+    # 4. 保存本地副本（按内容寻址，相同拼图只存一份）
+    asset_url = asset_store.put_bytes(img_stream.getvalue(), ext)
+    composite_cache.store(cache_key, asset_url, mime_type)
 
     # 5. 处理返回值
     if return_type == 'path':
-        # Return path formatted as ./assets/filename.jpg
-        formatted_path = f"./assets/{filename}"
+        # Return path formatted as ./assets/cas/ab/cd/<sha256>.jpg
+        formatted_path = f".{asset_url}"
         return formatted_path, mime_type
     else:
         # 重置指针给内存流模式使用
@@ -0,0 +1,131 @@
+"""
+Right-sized variants of reference images (style, character, uploaded refs).
+
+Users upload references at any size, 4K PNGs included, but every provider
+downsamples its inputs to a bounded size anyway. `for_provider()` returns a
+copy scaled to the provider profile's longest edge and re-encoded (JPEG for
+opaque images, PNG when there is transparency). Variants are stored next to
+the original (`<name>~<tag>.<ext>`, see asset_store.variant_path) and
+created once, on upload via `prewarm()` or on first use. Images already
+within the profile are sent as they are, never re-encoded lossily, and so
+are downscaled copies that would not come out smaller. EXIF orientation is
+baked into the pixels, since providers do not reliably honour the tag;
+camera photos that carry one always get an upright copy.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.utils import asset_store
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class VariantProfile:
+    max_edge: int
+    jpeg_quality: int = 92
+
+    @property
+    def tag(self) -> str:
+        return f"{self.max_edge}"
+
+
+_DEFAULT_PROFILE = VariantProfile(max_edge=2048)
+# Platform keys (core/providers) and sora_api formatter names, lower case.
+PROFILES: Dict[str, VariantProfile] = {
+    "openai": VariantProfile(max_edge=2048),
+    "volcengine": VariantProfile(max_edge=2048),
+    # Sora 2 renders at most 1920 px wide; larger references add nothing.
+    "kie": VariantProfile(max_edge=1920),
+    "apiyi": VariantProfile(max_edge=1920),
+}
+
+_decisions: Dict[Tuple[str, int, int, str], str] = {}
+_lock = threading.Lock()
+_MAX_DECISIONS = 2048
+
+
+def profile_for(provider: Optional[str]) -> VariantProfile:
+    return PROFILES.get((provider or "").lower(), _DEFAULT_PROFILE)
+
+
+def _build(path: str, profile: VariantProfile) -> str:
+    with Image.open(path) as img:
+        img.load()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        oriented = img.getexif().get(0x0112, 1) != 1  # Orientation tag
+        upright = ImageOps.exif_transpose(img)
+        width, height = upright.size
+        scale = min(1.0, profile.max_edge / float(max(width, height)))
+        ext = "png" if has_alpha else "jpg"
+        if scale >= 1.0 and not oriented:
+            return path  # Already right-sized.
+
+        target = asset_store.variant_path(path, profile.tag, ext)
+        if os.path.exists(target):
+            return target
+
+        out = upright.convert("RGBA" if has_alpha else "RGB")
+        if scale < 1.0:
+            out = out.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.Resampling.LANCZOS)
+
+    tmp = f"{target}.tmp-{threading.get_ident()}"
+    try:
+        if has_alpha:
+            out.save(tmp, format="PNG", optimize=True)
+        else:
+            out.save(tmp, format="JPEG", quality=profile.jpeg_quality, optimize=True)
+        if not oriented and os.path.getsize(tmp) >= os.path.getsize(path):
+            os.remove(tmp)
+            return path
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logger.info(
+        f"[Variants] {os.path.basename(path)} -> {os.path.basename(target)} "
+        f"({os.path.getsize(path) // 1024} KB -> {os.path.getsize(target) // 1024} KB)"
+    )
+    return target
+
+
+def for_provider(path: str, provider: Optional[str]) -> str:
+    """Path of the variant of the local image `path` to send to `provider`."""
+    profile = profile_for(provider)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, profile.tag)
+    with _lock:
+        chosen = _decisions.get(key)
+    if chosen is not None and (chosen == path or os.path.exists(chosen)):
+        return chosen
+    try:
+        chosen = _build(path, profile)
+    except Exception as e:
+        logger.warning(f"[Variants] Could not right-size {path}: {e}")
+        return path
+    with _lock:
+        if len(_decisions) >= _MAX_DECISIONS:
+            _decisions.clear()
+        _decisions[key] = chosen
+    return chosen
+
+
+def variant_paths(path: str) -> List[str]:
+    """What `for_provider` sends for `path` under each distinct profile (built if missing)."""
+    providers = sorted({p.tag: name for name, p in PROFILES.items()}.values())
+    return list(dict.fromkeys(for_provider(path, provider) for provider in providers))
+
+
+def prewarm(path: Optional[str]):
+    """Build every profile's variant of a freshly uploaded image in the background."""
+    if not path:
+        return
+    threading.Thread(target=variant_paths, args=(path,), daemon=True, name="image-variants").start()
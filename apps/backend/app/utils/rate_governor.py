@@ -0,0 +1,504 @@
+"""
+Per-API-key rate and concurrency governor.
+
+Every provider call for a given (ApiKey.id, modality) passes through
+`rate_governor.slot(...)`, which enforces
+
+- a token bucket (requests per minute + burst), and
+- a cap on requests in flight,
+
+with waiters served strictly first-come-first-served. The state lives in a
+small SQLite file next to the main database (not in process memory) so the
+uvicorn workers of one deployment share a single budget per key; every
+decision runs inside a `BEGIN IMMEDIATE` transaction.
+
+On a 429 the bucket is emptied, the key is blocked for Retry-After (or
+RATE_GOVERNOR_429_COOLDOWN) and its effective rate is halved; each success
+gives back a little of the rate (AIMD), so a key settles just under what the
+provider actually sustains instead of oscillating around it.
+
+Leases and waiters carry their process's owner token ("pid:uuid"). The
+`process` table maps each pid to the token of the process currently using
+it, so rows left by a dead worker are purged even when a restarted worker
+got the same pid (as uvicorn workers in a container usually do).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.path_utils import get_writable_path
+from app.utils.process_utils import pid_alive
+
+logger = logging.getLogger(__name__)
+
+MODALITIES = ("text", "image", "video")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (
+    scope TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0,
+    factor REAL NOT NULL DEFAULT 1.0
+);
+CREATE TABLE IF NOT EXISTS lease (
+    id TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    acquired REAL NOT NULL,
+    expires REAL NOT NULL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS lease_scope ON lease (scope);
+CREATE TABLE IF NOT EXISTS waiter (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    enqueued REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS waiter_scope ON waiter (scope, id);
+CREATE TABLE IF NOT EXISTS process (
+    pid INTEGER PRIMARY KEY,
+    token TEXT NOT NULL,
+    started REAL NOT NULL
+);
+"""
+# Governor files written before owner tokens existed.
+_MIGRATIONS = (
+    ("lease", "owner", "ALTER TABLE lease ADD COLUMN owner TEXT"),
+    ("waiter", "owner", "ALTER TABLE waiter ADD COLUMN owner TEXT"),
+)
+
+# Waiters refresh their heartbeat on every poll; one that stops (killed
+# worker) is dropped so it cannot block the head of the queue.
+_WAITER_STALE_SECONDS = 30.0
+_MIN_FACTOR = 0.1
+_FACTOR_RECOVERY = 0.05
+_LIMITS_TTL = 5.0
+_MAX_POLL_INTERVAL = 1.0
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+class _Requeue(Exception):
+    pass
+
+
+class Limits:
+    __slots__ = ("rpm", "burst", "max_in_flight")
+
+    def __init__(self, rpm: float, burst: int, max_in_flight: int):
+        self.rpm = rpm
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"requests_per_minute": self.rpm, "burst": self.burst, "max_in_flight": self.max_in_flight}
+
+
+def default_limits(modality: str) -> Limits:
+    rpm = {
+        "text": settings.RATE_LIMIT_TEXT_RPM,
+        "image": settings.RATE_LIMIT_IMAGE_RPM,
+        "video": settings.RATE_LIMIT_VIDEO_RPM,
+    }.get(modality, 0.0)
+    in_flight = {
+        "text": settings.RATE_LIMIT_TEXT_CONCURRENCY,
+        "image": settings.RATE_LIMIT_IMAGE_CONCURRENCY,
+        "video": settings.RATE_LIMIT_VIDEO_CONCURRENCY,
+    }.get(modality, 0)
+    return Limits(rpm=rpm, burst=max(1, in_flight), max_in_flight=in_flight)
+
+
+def retry_after_seconds(response: Any) -> Optional[float]:
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_token: Tuple[int, str] = (0, "")
+
+
+def owner_token() -> str:
+    """Owner token ("pid:uuid") of this process; regenerated in forked children."""
+    global _token
+    pid = os.getpid()
+    if _token[0] != pid:
+        _token = (pid, f"{pid}:{uuid.uuid4().hex}")
+    return _token[1]
+
+
+class Slot:
+    """Handle for one acquired lease; `observe()` feeds 429s back."""
+
+    def __init__(self, governor: "RateGovernor", scope: Optional[str], lease_id: Optional[str]):
+        self._governor = governor
+        self.scope = scope
+        self.lease_id = lease_id
+        self.throttled = False
+
+    def observe(self, response: Any) -> Any:
+        if self.scope and getattr(response, "status_code", None) == 429:
+            self.throttled = True
+            self._governor.penalize(self.scope, retry_after_seconds(response))
+        return response
+
+
+class RateGovernor:
+    def __init__(self, db_path: str, enabled: bool = True):
+        self.db_path = db_path
+        self.enabled = enabled
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._registered_pid = 0
+        self._released = threading.Condition()
+        self._limits: Dict[str, Tuple[float, Limits]] = {}
+        self._limits_lock = threading.Lock()
+
+    # ---------- storage ----------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._init_lock:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                for table, column, ddl in _MIGRATIONS:
+                    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                        conn.execute(ddl)
+                self._initialized = True
+        self._local.conn = conn
+        if self._registered_pid != os.getpid():
+            self.register_process()
+        return conn
+
+    def register_process(self):
+        """Claim this pid in the process table; older rows for it become stale."""
+        pid = os.getpid()
+        self._registered_pid = pid
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO process (pid, token, started) VALUES (?, ?, ?)",
+                    (pid, owner_token(), time.time()),
+                )
+        except Exception as e:
+            self._registered_pid = 0
+            logger.warning(f"[Governor] Failed to register process {pid}: {e}")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- limits ----------
+
+    @staticmethod
+    def scope_for(key_id: int, modality: str) -> str:
+        return f"{int(key_id)}:{modality}"
+
+    def limits_for(self, scope: str) -> Limits:
+        now = time.monotonic()
+        with self._limits_lock:
+            cached = self._limits.get(scope)
+            if cached and now - cached[0] < _LIMITS_TTL:
+                return cached[1]
+
+        key_id, modality = scope.split(":", 1)
+        limits = default_limits(modality)
+        try:
+            from app.db.session import SessionLocal
+            from app.models.apikey_limit import ApiKeyLimit
+
+            db = SessionLocal()
+            try:
+                row = (
+                    db.query(ApiKeyLimit)
+                    .filter(ApiKeyLimit.api_key_id == int(key_id), ApiKeyLimit.modality == modality)
+                    .first()
+                )
+            finally:
+                db.close()
+            if row:
+                limits = Limits(
+                    rpm=row.requests_per_minute if row.requests_per_minute is not None else limits.rpm,
+                    burst=row.burst if row.burst is not None else limits.burst,
+                    max_in_flight=row.max_in_flight if row.max_in_flight is not None else limits.max_in_flight,
+                )
+        except Exception as e:
+            logger.warning(f"[Governor] Falling back to default limits for {scope}: {e}")
+
+        with self._limits_lock:
+            self._limits[scope] = (now, limits)
+        return limits
+
+    def invalidate_limits(self, key_id: Optional[int] = None):
+        with self._limits_lock:
+            if key_id is None:
+                self._limits.clear()
+            else:
+                for modality in MODALITIES:
+                    self._limits.pop(self.scope_for(key_id, modality), None)
+
+    # ---------- core ----------
+
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM waiter WHERE heartbeat < ?", (now - _WAITER_STALE_SECONDS,))
+        conn.execute("DELETE FROM lease WHERE expires < ?", (now,))
+        conn.execute("DELETE FROM lease WHERE owner IS NULL")
+        conn.execute("DELETE FROM waiter WHERE owner IS NULL")
+        registered = dict(conn.execute("SELECT pid, token FROM process"))
+        own = owner_token()
+        for (owner,) in conn.execute("SELECT DISTINCT owner FROM lease UNION SELECT DISTINCT owner FROM waiter").fetchall():
+            if owner == own:
+                continue
+            pid = int(owner.split(":", 1)[0])
+            if registered.get(pid) == owner and pid != os.getpid() and pid_alive(pid):
+                continue
+            conn.execute("DELETE FROM lease WHERE owner = ?", (owner,))
+            conn.execute("DELETE FROM waiter WHERE owner = ?", (owner,))
+
+    @staticmethod
+    def _refill(conn: sqlite3.Connection, scope: str, limits: Limits, now: float) -> Tuple[float, float, float]:
+        """Returns (tokens, blocked_until, factor) after refilling up to `now`."""
+        row = conn.execute(
+            "SELECT tokens, updated, blocked_until, factor FROM bucket WHERE scope = ?", (scope,)
+        ).fetchone()
+        capacity = float(max(1, limits.burst))
+        if row is None:
+            conn.execute(
+                "INSERT INTO bucket (scope, tokens, updated) VALUES (?, ?, ?)", (scope, capacity, now)
+            )
+            return capacity, 0.0, 1.0
+        tokens, updated, blocked_until, factor = row
+        if limits.rpm > 0:
+            rate = limits.rpm * factor / 60.0
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+        else:
+            tokens = capacity
+        conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE scope = ?", (tokens, now, scope))
+        return tokens, blocked_until, factor
+
+    def _try_acquire(self, scope: str, ticket: int, limits: Limits) -> Tuple[Optional[str], float]:
+        """One attempt. Returns (lease_id, 0) or (None, seconds to wait)."""
+        now = time.time()
+        with self._transaction() as conn:
+            self._purge(conn, now)
+            conn.execute("UPDATE waiter SET heartbeat = ? WHERE id = ?", (now, ticket))
+            if conn.execute("SELECT 1 FROM waiter WHERE id = ?", (ticket,)).fetchone() is None:
+                # Purged while we were not looking (e.g. a long GC pause): re-queue at the back.
+                raise _Requeue()
+
+            (head,) = conn.execute("SELECT MIN(id) FROM waiter WHERE scope = ?", (scope,)).fetchone()
+            if head != ticket:
+                return None, 0.25
+
+            tokens, blocked_until, factor = self._refill(conn, scope, limits, now)
+            if blocked_until > now:
+                return None, blocked_until - now
+            if limits.max_in_flight > 0:
+                (in_flight,) = conn.execute("SELECT COUNT(*) FROM lease WHERE scope = ?", (scope,)).fetchone()
+                if in_flight >= limits.max_in_flight:
+                    return None, 0.5
+            if limits.rpm > 0 and tokens < 1.0:
+                return None, (1.0 - tokens) / (limits.rpm * factor / 60.0)
+
+            lease_id = uuid.uuid4().hex
+            conn.execute("UPDATE bucket SET tokens = ? WHERE scope = ?", (tokens - 1.0, scope))
+            conn.execute(
+                "INSERT INTO lease (id, scope, pid, acquired, expires, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                (lease_id, scope, os.getpid(), now, now + settings.RATE_GOVERNOR_LEASE_TTL, owner_token()),
+            )
+            conn.execute("DELETE FROM waiter WHERE id = ?", (ticket,))
+            return lease_id, 0.0
+
+    def _enqueue(self, scope: str) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT INTO waiter (scope, pid, enqueued, heartbeat, owner) VALUES (?, ?, ?, ?, ?)",
+                (scope, os.getpid(), now, now, owner_token()),
+            )
+            return cur.lastrowid
+
+    def acquire(self, key_id: int, modality: str, timeout: Optional[float] = None) -> Slot:
+        if not self.enabled or key_id is None:
+            return Slot(self, None, None)
+        scope = self.scope_for(key_id, modality)
+        timeout = settings.RATE_GOVERNOR_WAIT_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        started = time.monotonic()
+        ticket = self._enqueue(scope)
+        try:
+            while True:
+                limits = self.limits_for(scope)
+                try:
+                    lease_id, wait = self._try_acquire(scope, ticket, limits)
+                except _Requeue:
+                    ticket = self._enqueue(scope)
+                    continue
+                if lease_id:
+                    waited = time.monotonic() - started
+                    if waited > 1.0:
+                        logger.info(f"[Governor] {scope} acquired after {waited:.1f}s in queue.")
+                    return Slot(self, scope, lease_id)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimitTimeout(f"Timed out after {timeout:.0f}s waiting for API key rate limit ({scope})")
+                with self._released:
+                    self._released.wait(min(wait, _MAX_POLL_INTERVAL, remaining))
+        except BaseException:
+            try:
+                with self._transaction() as conn:
+                    conn.execute("DELETE FROM waiter WHERE id = ?", (ticket,))
+            except Exception as e:
+                logger.warning(f"[Governor] Failed to dequeue waiter {ticket}: {e}")
+            raise
+
+    def release(self, slot: Slot):
+        if not slot.lease_id:
+            return
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM lease WHERE id = ?", (slot.lease_id,))
+                if not slot.throttled:
+                    conn.execute(
+                        "UPDATE bucket SET factor = MIN(1.0, factor + ?) WHERE scope = ?",
+                        (_FACTOR_RECOVERY, slot.scope),
+                    )
+        except Exception as e:
+            logger.warning(f"[Governor] Failed to release lease {slot.lease_id}: {e}")
+        slot.lease_id = None
+        with self._released:
+            self._released.notify_all()
+
+    def penalize(self, scope: str, retry_after: Optional[float] = None):
+        """Provider said 429: drain the bucket, pause the key and halve its rate."""
+        cooldown = retry_after if retry_after is not None else settings.RATE_GOVERNOR_429_COOLDOWN
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                self._refill(conn, scope, self.limits_for(scope), now)
+                conn.execute(
+                    "UPDATE bucket SET tokens = 0, blocked_until = MAX(blocked_until, ?), "
+                    "factor = MAX(?, factor * 0.5) WHERE scope = ?",
+                    (now + cooldown, _MIN_FACTOR, scope),
+                )
+        except Exception as e:
+            logger.warning(f"[Governor] Failed to record 429 for {scope}: {e}")
+            return
+        logger.warning(f"[Governor] {scope} throttled by provider, pausing {cooldown:.1f}s.")
+
+    @contextmanager
+    def slot(self, key_id: Optional[int], modality: str, timeout: Optional[float] = None) -> Iterator[Slot]:
+        handle = self.acquire(key_id, modality, timeout=timeout)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def call(self, key_id: Optional[int], modality: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` (returning a requests.Response) under a slot. A 429 goes back
+        through the queue, after the pause, instead of being retried blindly.
+        """
+        attempts = max(1, settings.RATE_GOVERNOR_MAX_ATTEMPTS)
+        response = None
+        for attempt in range(attempts):
+            with self.slot(key_id, modality) as handle:
+                response = handle.observe(fn())
+            if getattr(response, "status_code", None) != 429 or handle.scope is None:
+                return response
+            logger.info(f"[Governor] {handle.scope} got 429 (attempt {attempt + 1}/{attempts}).")
+        return response
+
+    # ---------- introspection ----------
+
+    def queue_depth(self, key_id: Optional[int], modality: str) -> int:
+        if not self.enabled or key_id is None:
+            return 0
+        scope = self.scope_for(key_id, modality)
+        try:
+            (depth,) = self._conn().execute("SELECT COUNT(*) FROM waiter WHERE scope = ?", (scope,)).fetchone()
+            return int(depth)
+        except Exception:
+            return 0
+
+    def load(self, key_id: Optional[int], modality: str) -> int:
+        """Queued + in-flight requests for a key, across all workers."""
+        if not self.enabled or key_id is None:
+            return 0
+        scope = self.scope_for(key_id, modality)
+        try:
+            conn = self._conn()
+            (queued,) = conn.execute("SELECT COUNT(*) FROM waiter WHERE scope = ?", (scope,)).fetchone()
+            (in_flight,) = conn.execute("SELECT COUNT(*) FROM lease WHERE scope = ?", (scope,)).fetchone()
+            return int(queued) + int(in_flight)
+        except Exception:
+            return 0
+
+    def stats(self, key_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        now = time.time()
+        scopes = {row[0] for row in conn.execute("SELECT scope FROM bucket")}
+        scopes.update(row[0] for row in conn.execute("SELECT DISTINCT scope FROM waiter"))
+        scopes.update(row[0] for row in conn.execute("SELECT DISTINCT scope FROM lease"))
+        allowed = {int(k) for k in key_ids} if key_ids is not None else None
+
+        results = []
+        for scope in sorted(scopes):
+            key_id, modality = scope.split(":", 1)
+            if allowed is not None and int(key_id) not in allowed:
+                continue
+            (queued,) = conn.execute("SELECT COUNT(*) FROM waiter WHERE scope = ?", (scope,)).fetchone()
+            (in_flight,) = conn.execute("SELECT COUNT(*) FROM lease WHERE scope = ?", (scope,)).fetchone()
+            bucket = conn.execute(
+                "SELECT tokens, blocked_until, factor FROM bucket WHERE scope = ?", (scope,)
+            ).fetchone() or (None, 0.0, 1.0)
+            results.append({
+                "key_id": int(key_id),
+                "modality": modality,
+                "queued": queued,
+                "in_flight": in_flight,
+                "tokens": round(bucket[0], 2) if bucket[0] is not None else None,
+                "rate_factor": round(bucket[2], 2),
+                "blocked_for": round(max(0.0, bucket[1] - now), 1),
+                "limits": self.limits_for(scope).as_dict(),
+            })
+        return results
+
+
+rate_governor = RateGovernor(
+    db_path=settings.RATE_GOVERNOR_DB or get_writable_path(os.path.join("cache", "rate_governor.db")),
+    enabled=settings.RATE_GOVERNOR_ENABLED,
+)
@@ -0,0 +1,272 @@
+"""
+Shared on-disk cache for remote reference images.
+
+Character / scene / style references are fetched again for every storyboard
+and video request. This cache keeps one local copy per URL, revalidates it
+with ETag / Last-Modified once it is older than REMOTE_CACHE_TTL, evicts by
+total size (least recently used first) and by idle age, and collapses
+concurrent fetches of the same URL into a single request.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from app.core.config import settings
+from app.utils.http_client import request as http_request, download_headers
+from app.utils.path_utils import get_writable_path
+
+logger = logging.getLogger(__name__)
+
+_INDEX_FILE = "index.json"
+_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class _Entry:
+    url: str
+    filename: str
+    size: int
+    fetched_at: float
+    last_access: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class RemoteCache:
+    def __init__(self, directory: str, max_bytes: int, ttl: float, max_idle: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._loaded = False
+        self._dirty = 0
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "revalidated": 0,
+            "shared": 0,
+            "errors": 0,
+            "evictions": 0,
+            "bytes_fetched": 0,
+        }
+
+    # ---------- index ----------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, _INDEX_FILE)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            for item in raw.get("entries", []):
+                entry = _Entry(**item)
+                if os.path.exists(os.path.join(self.directory, entry.filename)):
+                    self._entries[entry.url] = entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[RemoteCache] Ignoring unreadable index: {e}")
+        self._loaded = True
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, _INDEX_FILE)
+        payload = {"entries": [asdict(e) for e in self._entries.values()]}
+        tmp_path = f"{index_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, index_path)
+            self._dirty = 0
+        except Exception as e:
+            logger.warning(f"[RemoteCache] Failed to write index: {e}")
+
+    def _touch(self, entry: _Entry):
+        entry.last_access = time.time()
+        self._dirty += 1
+        # Access times only drive eviction order; no need to persist each one.
+        if self._dirty >= 20:
+            self._save_index()
+
+    # ---------- public ----------
+
+    def fetch(self, url: str, timeout=(10, 60)) -> Optional[str]:
+        """
+        Local path of a cached copy of `url`, downloading or revalidating it
+        when needed. Returns None when the resource cannot be fetched.
+        """
+        while True:
+            with self._lock:
+                self._ensure_loaded()
+                entry = self._entries.get(url)
+                now = time.time()
+                if entry and now - entry.fetched_at < self.ttl:
+                    path = os.path.join(self.directory, entry.filename)
+                    if os.path.exists(path):
+                        self._metrics["hits"] += 1
+                        self._touch(entry)
+                        return path
+                    self._entries.pop(url, None)
+                    entry = None
+
+                waiter = self._inflight.get(url)
+                if waiter is None:
+                    self._inflight[url] = threading.Event()
+                    break
+                self._metrics["shared"] += 1
+            # Someone else is fetching this URL: wait for them, then re-check.
+            waiter.wait(timeout=timeout[1] if isinstance(timeout, tuple) else timeout)
+
+        try:
+            return self._fetch(url, entry, timeout)
+        finally:
+            with self._lock:
+                event = self._inflight.pop(url, None)
+            if event:
+                event.set()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            self._ensure_loaded()
+            data = dict(self._metrics)
+            data["entries"] = len(self._entries)
+            data["bytes"] = sum(e.size for e in self._entries.values())
+        lookups = data["hits"] + data["misses"] + data["revalidated"]
+        data["hit_rate"] = round((data["hits"] + data["revalidated"]) / lookups, 4) if lookups else 0.0
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._ensure_loaded()
+            for entry in list(self._entries.values()):
+                self._remove(entry)
+            self._save_index()
+
+    # ---------- internals ----------
+
+    def _filename_for(self, url: str) -> str:
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if len(ext) > 5 or not ext[1:].isalnum():
+            ext = ""
+        return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}{ext or '.png'}"
+
+    def _fetch(self, url: str, stale: Optional[_Entry], timeout) -> Optional[str]:
+        headers = download_headers()
+        if stale:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        try:
+            res = http_request("GET", url, stream=True, timeout=timeout, headers=headers)
+        except Exception as e:
+            return self._fallback(url, stale, e)
+
+        try:
+            if res.status_code == 304 and stale:
+                with self._lock:
+                    stale.fetched_at = time.time()
+                    self._metrics["revalidated"] += 1
+                    self._touch(stale)
+                    self._save_index()
+                return os.path.join(self.directory, stale.filename)
+
+            if res.status_code != 200:
+                return self._fallback(url, stale, RuntimeError(f"status {res.status_code}"))
+
+            filename = self._filename_for(url)
+            fd, tmp_path = tempfile.mkstemp(prefix=".fetch-", dir=self.directory)
+            size = 0
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in res.iter_content(chunk_size=_CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            size += len(chunk)
+                os.replace(tmp_path, os.path.join(self.directory, filename))
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return self._fallback(url, stale, e)
+        finally:
+            res.close()
+
+        now = time.time()
+        entry = _Entry(
+            url=url,
+            filename=filename,
+            size=size,
+            fetched_at=now,
+            last_access=now,
+            etag=res.headers.get("ETag"),
+            last_modified=res.headers.get("Last-Modified"),
+        )
+        with self._lock:
+            self._entries[url] = entry
+            self._metrics["misses"] += 1
+            self._metrics["bytes_fetched"] += size
+            self._evict(keep=url)
+            self._save_index()
+        return os.path.join(self.directory, filename)
+
+    def _fallback(self, url: str, stale: Optional[_Entry], error: Exception) -> Optional[str]:
+        with self._lock:
+            self._metrics["errors"] += 1
+        if stale:
+            path = os.path.join(self.directory, stale.filename)
+            if os.path.exists(path):
+                # Better a slightly stale reference image than none.
+                logger.warning(f"[RemoteCache] Revalidation of {url} failed ({error}); serving cached copy")
+                return path
+        logger.error(f"[RemoteCache] Failed to fetch {url}: {error}")
+        return None
+
+    def _remove(self, entry: _Entry) -> bool:
+        try:
+            os.remove(os.path.join(self.directory, entry.filename))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Still open elsewhere (Windows): try again on the next eviction.
+            logger.debug(f"[RemoteCache] Could not evict {entry.filename}: {e}")
+            return False
+        self._entries.pop(entry.url, None)
+        self._metrics["evictions"] += 1
+        return True
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.time()
+        for entry in list(self._entries.values()):
+            if entry.url != keep and now - entry.last_access > self.max_idle:
+                self._remove(entry)
+
+        total = sum(e.size for e in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for entry in sorted(self._entries.values(), key=lambda e: e.last_access):
+            if total <= self.max_bytes:
+                break
+            if entry.url == keep:
+                continue
+            if self._remove(entry):
+                total -= entry.size
+
+
+remote_cache = RemoteCache(
+    directory=settings.REMOTE_CACHE_DIR or get_writable_path(os.path.join("cache", "remote")),
+    max_bytes=settings.REMOTE_CACHE_MAX_BYTES,
+    ttl=settings.REMOTE_CACHE_TTL,
+    max_idle=settings.REMOTE_CACHE_MAX_IDLE,
+)
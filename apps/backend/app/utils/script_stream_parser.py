@@ -0,0 +1,119 @@
+"""
+Incremental parser for the tagged sections the script skills stream back.
+
+The screenwriter answers with blocks such as
+
+    <|CHARACTERS|>
+    ```json
+    {"characters": [...]}
+    ```
+    <|CHARACTERS_END|>
+
+Instead of waiting for the whole answer and running the tag / JSON regexes
+over it, `ScriptSectionParser.feed()` takes each token as it arrives and
+returns the sections whose `_END` marker has just been seen, each parsed
+exactly once. `<think>` segments are dropped on the way in, and text of a
+closed section is discarded, so the buffer only ever holds the section that
+is still being written.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_THINK_OPEN_RE = re.compile(r"<think\b[^>]*>", re.IGNORECASE)
+_THINK_CLOSE_RE = re.compile(r"</think\s*>", re.IGNORECASE)
+_END_RE = re.compile(r"<\|([A-Z_]+)_END\|>")
+_MARKER_RE = re.compile(r"<\|.*?\|>")
+_FENCED_JSON_RE = re.compile(r"```json\s*([\s\S]*?)\s*```")
+
+# A "<" this close to the end of the raw text may be the start of a think
+# tag split across tokens; it waits for the next token.
+_HOLD = 16
+
+
+def parse_section_body(body: str) -> Optional[Dict[str, Any]]:
+    """JSON object(s) inside one section body, merged; None if nothing parses."""
+    blocks = _FENCED_JSON_RE.findall(body)
+    if not blocks:
+        blocks = [body.replace("```json", "").replace("```", "")]
+    merged: Dict[str, Any] = {}
+    for block in blocks:
+        try:
+            data = json.loads(_MARKER_RE.sub("", block))
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            merged.update(data)
+    return merged or None
+
+
+class ScriptSectionParser:
+    def __init__(self, tag_map: Dict[str, str]):
+        # {"CHARACTERS": "characters", ...}: tag name -> payload key
+        self.tag_map = tag_map
+        self.sections: Dict[str, Any] = {}
+        self._merged: Dict[str, Any] = {}
+        self._raw = ""
+        self._clean = ""
+        self._scanned = 0
+        self._in_think = False
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add streamed text; returns [(key, value), ...] for sections that just closed."""
+        if not text:
+            return []
+        self._raw += text
+        self._scrub()
+        return self._drain()
+
+    def merged(self) -> Dict[str, Any]:
+        """Everything parsed so far, shaped like the skill's combined JSON output."""
+        return dict(self._merged)
+
+    def _scrub(self):
+        """Move think-free text from `_raw` into `_clean`."""
+        while self._raw:
+            if self._in_think:
+                match = _THINK_CLOSE_RE.search(self._raw)
+                if not match:
+                    self._raw = self._raw[-_HOLD:]
+                    return
+                self._raw = self._raw[match.end():]
+                self._in_think = False
+                continue
+            match = _THINK_OPEN_RE.search(self._raw)
+            if match:
+                self._clean += self._raw[:match.start()]
+                self._raw = self._raw[match.end():]
+                self._in_think = True
+                continue
+            cut = self._raw.rfind("<")
+            if cut != -1 and len(self._raw) - cut < _HOLD and ">" not in self._raw[cut:]:
+                self._clean += self._raw[:cut]
+                self._raw = self._raw[cut:]
+            else:
+                self._clean += self._raw
+                self._raw = ""
+            return
+
+    def _drain(self) -> List[Tuple[str, Any]]:
+        closed: List[Tuple[str, Any]] = []
+        while True:
+            match = _END_RE.search(self._clean, self._scanned)
+            if not match:
+                # An end marker may still be arriving; rescan only its length.
+                self._scanned = max(0, len(self._clean) - 32)
+                return closed
+            tag = match.group(1)
+            key = self.tag_map.get(tag)
+            if key:
+                opening = self._clean.rfind(f"<|{tag}|>", 0, match.start())
+                body_start = opening + len(tag) + 4 if opening != -1 else 0
+                data = parse_section_body(self._clean[body_start:match.start()])
+                if data is not None:
+                    self._merged.update(data)
+                    value = data.get(key, data)
+                    self.sections[key] = value
+                    closed.append((key, value))
+            self._clean = self._clean[match.end():]
+            self._scanned = 0
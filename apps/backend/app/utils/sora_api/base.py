@@ -1,14 +1,25 @@
-import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Callable
+from typing import Dict, Any, List, Callable, Optional, Tuple, Union
 
 import logging
 
+from app.services import provider_callbacks, upload_reuse
+from app.services.task_poller import poller
+from app.utils import image_variants
+from app.utils.image_utils import EncodedImage, resolve_image_path, to_base64
+
 logger = logging.getLogger(__name__)
 
 class Base(ABC):
     name: str = "base"
     base_url_keyword: str = ""
+    # 任务是否可在进程重启后仅凭 task_id 继续轮询
+    resumable: bool = True
+    # 是否支持完成回调 (create 的 callback_url)；为 True 的子类需实现
+    # parse_callback(payload)，将回调转换为 `_query_status` 的返回结构
+    supports_callback: bool = False
+    # 是否支持上传参考图并以远程地址复用 (upload_image)
+    supports_upload: bool = False
     
     # Store context for queueing if needed (optional design, but helps if queue signature is restricted)
     _base_url: str = ""
@@ -27,14 +38,40 @@ class Base(ABC):
         }
 
     @abstractmethod
-    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any]) -> str:
+    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any], callback_url: Optional[str] = None) -> str:
         """
-        执行创建任务。
+        执行创建任务。callback_url 仅在 supports_callback 时传入。
         Returns: task_id
         Raises: Exception if failed
         """
         pass
 
+    def track(
+        self,
+        task_id: str,
+        timeout: Optional[float] = 600,
+        on_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+        callback_id: Optional[str] = None,
+    ) -> str:
+        """
+        将任务交给全局轮询器 (app.services.task_poller)。
+        带 callback_id 的任务以回调为准，轮询只作为低频兜底。
+        Returns: poller task key
+        """
+        check = lambda: self._query_status(task_id)
+        if callback_id:
+            check = provider_callbacks.wrap_check(callback_id, check)
+        task_key = poller.submit(
+            f"{self.name}:{task_id}",
+            check,
+            provider=self.name,
+            timeout=timeout,
+            on_done=on_done,
+        )
+        if callback_id:
+            provider_callbacks.bind(callback_id, task_key)
+        return task_key
+
     def queue(self, task_id: str, listener: Callable[[str, Any], None]) -> str:
         """
         监听任务状态。
@@ -42,36 +79,56 @@ class Base(ABC):
         Returns: video_url
         Raises: Exception if failed
         """
-        max_retries = 120 # 120 * 5s = 10 minutes
-        for i in range(max_retries):
-            time.sleep(5)
-            try:
-                # Use query logic here
-                result = self._query_status(task_id)
-                status = result.get("status")
-                
-                # Notify listener
-                listener(status, result)
-
-                if status == "completed":
-                    video_url = result.get("video_url")
-                    if not video_url:
-                         raise Exception("Video completed but URL not found")
-                    return video_url
-                
-                elif status == "failed":
-                    raise Exception(f"Video generation failed: {result.get('fail_reason')}")
-                
-            except Exception as e:
-                # If it's our own exception from failed status, re-raise
-                if "Video generation failed" in str(e) or "URL not found" in str(e):
-                    raise e
-                # Network errors during polling: log and continue
-                logger.info(f"Polling error: {e}")
+        task_key = self.track(task_id)
+        for result in poller.watch(task_key):
+            if result is None:
                 continue
-        
+            status = result.get("status")
+            if status == "polling_error":
+                # Network errors during polling: the poller backs off and retries
+                logger.info(f"Polling error: {result.get('error')}")
+                continue
+
+            # Notify listener
+            listener(status, result)
+
+            if status == "completed":
+                video_url = result.get("video_url")
+                if not video_url:
+                    raise Exception("Video completed but URL not found")
+                return video_url
+            elif status == "failed":
+                raise Exception(f"Video generation failed: {result.get('fail_reason')}")
+            elif status == "timeout":
+                break
+
         raise Exception("Video generation timed out")
 
+    def upload_image(self, data: bytes, mime_type: str, filename: str) -> Optional[Tuple[str, Optional[float]]]:
+        """
+        上传一张参考图到供应商。
+        Returns: (远程地址, 过期时间戳或 None)；不支持时返回 None
+        """
+        return None
+
+    def image_ref(self, image: Union[str, EncodedImage]) -> Optional[str]:
+        """
+        参考图在请求中的写法：远程地址原样使用；本地图片先换成适合该供应商尺寸的
+        变体 (app.utils.image_variants)，再优先复用已上传的文件或公网地址
+        (app.services.upload_reuse)，都不可用时内联为 data URI。
+        """
+        if isinstance(image, str) and image.startswith(("http://", "https://")):
+            return image
+        if isinstance(image, str):
+            local_path = resolve_image_path(image)
+            if local_path:
+                image = image_variants.for_provider(local_path, self.name)
+        scope = upload_reuse.scope_for(self._base_url, self._apikey)
+        return upload_reuse.reference_url(self, scope, image) or self._inline_image(image)
+
+    def _inline_image(self, image: Union[str, EncodedImage]) -> Optional[str]:
+        return to_base64(image)
+
     @abstractmethod
     def _query_status(self, task_id: str) -> Dict[str, Any]:
         """
@@ -1,19 +1,24 @@
 import json
+import time
 from app.utils.http_client import request as http_request
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from .base import Base
-from app.utils.image_utils import to_base64
 
 class Kie(Base):
     """
     Kie AI (Sora 2 Image-to-Video) Formatter
     API 文档: Kie AI Sora 2 Image-to-Video
-    架构: 原生异步轮询 (Create -> TaskID -> Poll)
+    架构: 原生异步轮询 (Create -> TaskID -> Poll)，配置 PUBLIC_BASE_URL 时改为完成回调 (callBackUrl)
     """
     name = "Kie"
     base_url_keyword = "https://api.kie.ai/api/v1"
+    supports_callback = True
+    supports_upload = True
+    # 文件上传服务 (File Upload API)；上传的文件保留 3 天
+    upload_url = "https://kieai.redpandaai.co/api/file-stream-upload"
+    upload_ttl = 3 * 24 * 3600
 
-    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any]) -> str:
+    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any], callback_url: Optional[str] = None) -> str:
         """
         提交图生视频任务
         """
@@ -28,11 +33,12 @@ class Kie(Base):
         if not images:
             raise Exception("Kie image-to-video model requires at least one image.")
         
+        # 已上传过的图片复用 Kie 文件地址，新图片先上传，失败时退回 base64
         image_urls: List[str] = []
         for img in images:
-            encoded = to_base64(img)
-            if encoded:
-                image_urls.append(encoded)
+            ref = self.image_ref(img)
+            if ref:
+                image_urls.append(ref)
 
         if not image_urls:
             raise Exception("Kie image-to-video model requires at least one valid image.")
@@ -68,6 +74,9 @@ class Kie(Base):
                 "upload_method": "s3"
             }
         }
+        if callback_url:
+            # 任务完成后 Kie 会 POST 与 recordInfo 相同结构的数据到此地址
+            payload["callBackUrl"] = callback_url
 
         # 4. 发送创建请求
         try:
@@ -87,76 +96,108 @@ class Kie(Base):
         except Exception as e:
             raise Exception(f"Kie Task Creation Failed: {str(e)}")
 
+    def upload_image(self, data: bytes, mime_type: str, filename: str) -> Optional[Tuple[str, Optional[float]]]:
+        """
+        上传参考图，返回可在 image_urls 中使用的下载地址
+        """
+        response = http_request(
+            "POST",
+            self.upload_url,
+            headers={"Authorization": f"Bearer {self._apikey}"},
+            data={"uploadPath": "sky-drama/references", "fileName": filename},
+            files={"file": (filename, data, mime_type)},
+            timeout=(10.0, 120.0),
+        )
+        response.raise_for_status()
+        res_json = response.json()
+        download_url = (res_json.get("data") or {}).get("downloadUrl")
+        if res_json.get("code") != 200 or not download_url:
+            raise Exception(f"Kie upload failed: {res_json.get('msg') or res_json}")
+        return download_url, time.time() + self.upload_ttl
+
     def _query_status(self, task_id: str) -> Dict[str, Any]:
         """
         查询任务状态
+        网络 / 熔断 / 解析错误直接抛出：轮询器记为 polling_error 并退避重试，
+        只有供应商明确返回的失败才会终止任务。
         """
         api_url = f"{self._base_url}/jobs/recordInfo"
-        
-        try:
-            response = http_request(
-                "GET",
-                api_url,
-                headers=self._headers,
-                params={"taskId": task_id},
-                timeout=30,
-            )
-            response.raise_for_status()
-            res_json = response.json()
-            
-            # API 返回非 200
-            if res_json.get("code") != 200:
-                return {
-                    "status": "failed",
-                    "fail_reason": res_json.get("message", "Unknown error"),
-                    "progress": 0
-                }
-
-            data = res_json.get("data", {})
-            state = data.get("state")
-            
-            # 状态映射
-            # Kie States: waiting, queuing, generating, success, fail
-            
-            if state == "success":
-                # 解析 resultJson (它是字符串化的 JSON)
-                video_url = ""
-                try:
-                    result_str = data.get("resultJson")
-                    if result_str:
-                        result_obj = json.loads(result_str)
-                        urls = result_obj.get("resultUrls", [])
-                        if urls:
-                            video_url = urls[0]
-                except json.JSONDecodeError:
-                    pass
-
-                return {
-                    "status": "completed",
-                    "progress": 100,
-                    "video_url": video_url,
-                    "raw": data
-                }
-            
-            elif state == "fail":
-                return {
-                    "status": "failed",
-                    "fail_reason": data.get("failMsg") or "Generation failed",
-                    "progress": 0,
-                    "raw": data
-                }
-            
-            else:
-                # waiting, queuing, generating -> processing
-                return {
-                    "status": "processing",
-                    "progress": 50, # 无法获取精确进度，返回 50
-                    "raw": data
-                }
 
-        except Exception as e:
+        response = http_request(
+            "GET",
+            api_url,
+            headers=self._headers,
+            params={"taskId": task_id},
+            timeout=30,
+        )
+        response.raise_for_status()
+        res_json = response.json()
+
+        code = res_json.get("code")
+        # 限流 / 服务端错误属于临时故障
+        if code == 429 or (isinstance(code, int) and code >= 500):
+            raise Exception(f"Kie recordInfo error {code}: {res_json.get('msg') or res_json.get('message')}")
+        # API 返回非 200
+        if code != 200:
             return {
                 "status": "failed",
-                "fail_reason": f"Network or Parse Error: {str(e)}",
+                "fail_reason": res_json.get("msg") or res_json.get("message") or "Unknown error",
                 "progress": 0
             }
+
+        return self._normalize_record(res_json.get("data", {}))
+
+    def parse_callback(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        解析完成回调 (结构同 recordInfo: {"code", "msg", "data": {...}})
+        """
+        if payload.get("code") != 200:
+            return {
+                "status": "failed",
+                "fail_reason": payload.get("msg") or payload.get("message") or "Generation failed",
+                "progress": 0,
+                "raw": payload.get("data"),
+            }
+        return self._normalize_record(payload.get("data") or {})
+
+    def _normalize_record(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        state = data.get("state")
+
+        # 状态映射
+        # Kie States: waiting, queuing, generating, success, fail
+
+        if state == "success":
+            # 解析 resultJson (它是字符串化的 JSON)
+            video_url = ""
+            try:
+                result_str = data.get("resultJson")
+                if result_str:
+                    result_obj = json.loads(result_str)
+                    urls = result_obj.get("resultUrls", [])
+                    if urls:
+                        video_url = urls[0]
+            except json.JSONDecodeError:
+                pass
+
+            return {
+                "status": "completed",
+                "progress": 100,
+                "video_url": video_url,
+                "raw": data
+            }
+
+        elif state == "fail":
+            return {
+                "status": "failed",
+                "fail_reason": data.get("failMsg") or "Generation failed",
+                "progress": 0,
+                "raw": data
+            }
+
+        else:
+            # waiting, queuing, generating -> processing
+            return {
+                "status": "processing",
+                "progress": 50, # 无法获取精确进度，返回 50
+                "raw": data
+            }
@@ -15,3 +15,11 @@ class SoraApiFormatter:
             if fmt.match(base_url_lower):
                 return fmt
         return None
+
+    @classmethod
+    def by_name(cls, name: str) -> Optional[Base]:
+        name_lower = (name or "").lower()
+        for fmt_cls in cls._formatters:
+            if fmt_cls.name.lower() == name_lower:
+                return fmt_cls()
+        return None
@@ -1,26 +1,87 @@
-
-import os
 import re
+import threading
+import time
 import uuid
 import json
-import base64
+import logging
+from collections import OrderedDict
 from app.utils.http_client import request as http_request
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Union
 from .base import Base
+from app.services.task_poller import poller
+from app.utils.base64_cache import base64_cache
+from app.utils.image_utils import EncodedImage, resolve_image_path
+
+logger = logging.getLogger(__name__)
+
+_PROGRESS_RE = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+_VIDEO_URL_RE = re.compile(r"\[点击这里\]\((https?://[^\)]+)\)")
+# 只保留流式文本的末尾用于匹配，避免长时间渲染时缓冲无限增长
+_TEXT_TAIL = 4096
+
+
+class _TaskStore:
+    """
+    有界、会过期的任务状态表 (task_id -> `_query_status` 结构)。
+    进行中的任务不会因过期被清除；结束的任务保留 ttl 秒，总数超过 max_entries 时
+    优先淘汰最旧的已结束任务，只有全部都在进行中时才淘汰最旧的进行中任务。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, task_id: str, result: Dict[str, Any]):
+        with self._lock:
+            self._items[task_id] = (time.monotonic(), dict(result))
+            self._items.move_to_end(task_id)
+            self._prune_locked()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._prune_locked()
+            item = self._items.get(task_id)
+            return dict(item[1]) if item else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def _prune_locked(self):
+        now = time.monotonic()
+        for task_id, (stored_at, result) in list(self._items.items()):
+            if result.get("status") != "processing" and now - stored_at > self.ttl:
+                del self._items[task_id]
+        overflow = len(self._items) - self.max_entries
+        if overflow <= 0:
+            return
+        finished = [
+            task_id for task_id, (_, result) in self._items.items()
+            if result.get("status") != "processing"
+        ]
+        for task_id in finished[:overflow]:
+            del self._items[task_id]
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
 
 class Yi(Base):
     """
     ApiYi (Sora 2) Formatter
-    适配流式输出接口到轮询架构
+    适配流式输出接口到轮询架构：create 打开流后立即返回虚拟 task_id，
+    后台线程逐块解析进度与结果，写入任务表并推送给轮询器。
     """
     name = "ApiYi"
     base_url_keyword = "https://api.apiyi.com/v1"
-    
-    # 用于缓存流式请求的最终结果，以适配 _query_status 的轮询机制
-    # Key: task_id, Value: Result Dict
-    _task_cache: Dict[str, Dict[str, Any]] = {}
+    # 结果只存在于本进程的任务表中，重启后无法继续
+    resumable = False
 
-    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any]) -> str:
+    # 流式请求的进度与最终结果，供 _query_status 读取 (所有实例共享)
+    _tasks = _TaskStore()
+
+    def create(self, base_url: str, apikey: str, model: str, prompt: str, seconds: int, size: str, watermark: bool, images: List[Any], callback_url: Optional[str] = None) -> str:
         self.set_auth(base_url, apikey)
         
         # 1. 构造请求 URL
@@ -31,27 +92,9 @@ class Yi(Base):
         if not images:
             raise Exception("ApiYi requires at least one image.")
         
-        image_urls: List[str] = []
-
-        def normalize_image_url(image_path_or_url: str) -> str:
-            if image_path_or_url.startswith(('http://', 'https://')):
-                return image_path_or_url
-            local_path = image_path_or_url
-            if image_path_or_url.startswith('/'):
-                local_path = f".{image_path_or_url}"
-            try:
-                if os.path.exists(local_path):
-                    with open(local_path, 'rb') as f:
-                        image_data = base64.b64encode(f.read()).decode('utf-8')
-                        ext = local_path.lower().split('.')[-1]
-                        mime_type = f"image/{ext}" if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp'] else "image/jpeg"
-                        return f"data:{mime_type};base64,{image_data}"
-            except Exception as e:
-                raise Exception(f"Image processing failed: {e}")
-            return image_path_or_url
-
-        for img in images:
-            image_urls.append(normalize_image_url(img))
+        image_urls: List[str] = [ref for ref in (self.image_ref(img) for img in images) if ref]
+        if not image_urls:
+            raise Exception("ApiYi requires at least one valid image.")
 
         # 3. 构造 Payload
         # 注意：Sora 2 API 似乎不接受 duration/seconds 参数，主要通过 model 控制 (如 hd, landscape)
@@ -71,85 +114,123 @@ class Yi(Base):
 
         # 4. 生成一个虚拟 Task ID
         task_id = str(uuid.uuid4())
-        
-        # 5. 执行流式请求并阻塞等待结果 (同步转伪异步)
-        # 因为 API 是流式的，无法直接获得 ID 后去轮询，必须在这里读完流
+
+        # 5. 打开流式请求 (鉴权 / 限流等错误在此处直接抛出)，随后交给后台线程读完
+        # 因为 API 是流式的，无法直接获得 ID 后去轮询，进度与结果都来自流本身
+        response = http_request(
+            "POST",
+            api_url,
+            headers=self._headers,
+            json=payload,
+            stream=True,
+            timeout=600,
+        )  # timeout 6000s from source
         try:
-            response = http_request(
-                "POST",
-                api_url,
-                headers=self._headers,
-                json=payload,
-                stream=True,
-                timeout=600,
-            )  # timeout 6000s from source
             response.raise_for_status()
-            
-            final_video_url = None
-            error_message = None
-            
+        except Exception:
+            response.close()
+            raise
+
+        self._tasks.put(task_id, {"status": "processing", "progress": 0})
+        threading.Thread(
+            target=self._consume_stream,
+            args=(task_id, response),
+            daemon=True,
+            name=f"apiyi-stream-{task_id[:8]}",
+        ).start()
+        return task_id
+
+    def _inline_image(self, image_path_or_url: Union[str, EncodedImage]) -> str:
+        if isinstance(image_path_or_url, EncodedImage):
+            return image_path_or_url.data_uri()
+        local_path = resolve_image_path(image_path_or_url)
+        try:
+            if local_path:
+                ext = local_path.lower().split('.')[-1]
+                mime_type = f"image/{ext}" if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp'] else "image/jpeg"
+                return base64_cache.encode_file(local_path, mime_type)
+        except Exception as e:
+            raise Exception(f"Image processing failed: {e}")
+        return image_path_or_url
+
+    def _update(self, task_id: str, result: Dict[str, Any]):
+        self._tasks.put(task_id, result)
+        # 若任务已交给轮询器，立即推送；否则下次 _query_status 会读到
+        poller.publish(f"{self.name}:{task_id}", result)
+
+    def _consume_stream(self, task_id: str, response):
+        final_video_url = None
+        error_message = None
+        progress = 0
+        text = ""
+
+        try:
             # 解析流式输出
             for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data_str = line[6:]
-                        if data_str == '[DONE]':
-                            break
-                        try:
-                            data_json = json.loads(data_str)
-                            content = data_json.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                            
-                            if content:
-                                # 检查错误
-                                if 'error' in content.lower() or '失败' in content:
-                                    # 此时可能还没有换行，先暂存错误
-                                    error_message = content.strip()
-                                
-                                # 提取视频链接
-                                # 使用源文件中的正则
-                                if '视频生成成功' in content:
-                                    match = re.search(r'\[点击这里\]\((https?://[^\)]+)\)', content)
-                                    if match:
-                                        final_video_url = match.group(1)
-                        except json.JSONDecodeError:
-                            continue
-            
-            # 存入缓存
-            if final_video_url:
-                self._task_cache[task_id] = {
-                    "status": "completed",
-                    "video_url": final_video_url,
-                    "progress": 100
-                }
-            else:
-                self._task_cache[task_id] = {
-                    "status": "failed",
-                    "fail_reason": error_message or "Stream ended without URL",
-                    "progress": 0
-                }
+                if not line:
+                    continue
+                line = line.decode('utf-8')
+                if not line.startswith('data: '):
+                    continue
+                data_str = line[6:]
+                if data_str == '[DONE]':
+                    break
+                try:
+                    data_json = json.loads(data_str)
+                except json.JSONDecodeError:
+                    continue
+                content = (data_json.get('choices') or [{}])[0].get('delta', {}).get('content', '')
+                if not content:
+                    continue
+
+                # 检查错误
+                if 'error' in content.lower() or '失败' in content:
+                    # 此时可能还没有换行，先暂存错误
+                    error_message = content.strip()
 
+                # 链接和百分比可能被拆在多个 delta 中，在累积的文本末尾上匹配
+                text = (text + content)[-_TEXT_TAIL:]
+                if '视频生成成功' in text:
+                    match = _VIDEO_URL_RE.search(text)
+                    if match:
+                        final_video_url = match.group(1)
+
+                percents = _PROGRESS_RE.findall(text)
+                if percents:
+                    value = min(99, int(float(percents[-1])))
+                    if value > progress:
+                        progress = value
+                        self._update(task_id, {"status": "processing", "progress": progress})
         except Exception as e:
-            self._task_cache[task_id] = {
-                "status": "failed",
-                "fail_reason": str(e),
-                "progress": 0
-            }
+            logger.warning(f"[ApiYi] Stream for task {task_id} failed: {e}")
+            error_message = str(e)
+        finally:
+            response.close()
 
-        return task_id
+        if final_video_url:
+            self._update(task_id, {
+                "status": "completed",
+                "video_url": final_video_url,
+                "progress": 100
+            })
+        else:
+            self._update(task_id, {
+                "status": "failed",
+                "fail_reason": error_message or "Stream ended without URL",
+                "progress": progress
+            })
 
     def _query_status(self, task_id: str) -> Dict[str, Any]:
-        # 从本地缓存读取结果
-        result = self._task_cache.get(task_id)
-        
+        # 从本地任务表读取后台线程写入的进度 / 结果
+        result = self._tasks.get(task_id)
+
         if not result:
             return {
                 "status": "failed",
                 "fail_reason": "Task ID not found in cache",
                 "progress": 0
             }
-            
-        # 既然 create 已经阻塞完成了任务，这里直接返回结果
+
         return {
             "status": result["status"],
             "progress": result["progress"],
@@ -0,0 +1,114 @@
+"""
+Server-sent event framing for the director console.
+
+`encode_text_event` is the hot path for streamed LLM text: the frame prefix
+per event type is built once, so a token costs one `json.dumps` of the string
+instead of a dict round-trip. Frames are byte-identical to
+
+    f"data: {json.dumps({'type': t, 'payload': text}, ensure_ascii=False)}\\n\\n"
+
+`TokenCoalescer` merges tokens into one frame per SSE_COALESCE_MS window or
+SSE_COALESCE_BYTES of text, whichever comes first. The first token after a
+quiet period goes out at once; text held back is released with the next
+token past the window, or by `flush()` when the stream changes event type or
+ends. `pump()` lets the caller flush on time too: it reads the token source
+on a separate thread and yields `TICK` once `due_in()` passes without a new
+token, so text held before a model pause is not hidden for the whole pause.
+"""
+import json
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+TICK = object()
+
+_PREFIXES: Dict[str, bytes] = {}
+_SUFFIX = b"}\n\n"
+
+
+def encode_text_event(event_type: str, text: str) -> bytes:
+    prefix = _PREFIXES.get(event_type)
+    if prefix is None:
+        prefix = f'data: {{"type": {json.dumps(event_type, ensure_ascii=False)}, "payload": '.encode("utf-8")
+        _PREFIXES[event_type] = prefix
+    return prefix + json.dumps(text, ensure_ascii=False).encode("utf-8") + _SUFFIX
+
+
+class TokenCoalescer:
+    def __init__(self, window_ms: float, max_bytes: int):
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_bytes = max(0, max_bytes)
+        self._parts: List[str] = []
+        self._size = 0
+        self._last_flush = 0.0
+
+    def add(self, text: str) -> Optional[str]:
+        """Buffer `text`; returns the merged text when a frame is due."""
+        if not text:
+            return None
+        if not self.window and not self.max_bytes:
+            return text
+        self._parts.append(text)
+        self._size += len(text.encode("utf-8"))
+        now = time.monotonic()
+        if (self.max_bytes and self._size >= self.max_bytes) or (self.window and now - self._last_flush >= self.window):
+            self._last_flush = now
+            return self.flush()
+        return None
+
+    def due_in(self) -> Optional[float]:
+        """Seconds until held text should go out; None when nothing is held."""
+        if not self._parts or not self.window:
+            return None
+        return max(0.0, self._last_flush + self.window - time.monotonic())
+
+    def flush(self) -> Optional[str]:
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        return text
+
+
+def pump(source: Iterable[Any], next_timeout: Callable[[], Optional[float]]) -> Iterator[Any]:
+    """
+    Iterate `source` on a reader thread. Yields its items, or TICK whenever
+    `next_timeout()` seconds pass without one. Exceptions from `source` are
+    re-raised here; closing the pump stops the reader after its current item.
+    """
+    items: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def _read():
+        iterator = iter(source)
+        try:
+            for item in iterator:
+                items.put((item, None))
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            items.put((done, e))
+            return
+        finally:
+            if stop.is_set() and hasattr(iterator, "close"):
+                iterator.close()
+        items.put((done, None))
+
+    threading.Thread(target=_read, daemon=True, name="sse-pump").start()
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=next_timeout())
+            except queue.Empty:
+                yield TICK
+                continue
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
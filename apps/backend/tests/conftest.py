@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The app reads its work dir / database from the environment at import time.
+_WORK_DIR = tempfile.mkdtemp(prefix="skydrama-tests-")
+os.environ.setdefault("APP_WORK_DIR", _WORK_DIR)
+os.environ.setdefault("ASSETS_DIR", os.path.join(_WORK_DIR, "assets"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_WORK_DIR, 'database.db')}")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,28 @@
+from PIL import Image
+
+from app.utils import image_variants
+from app.utils.base64_cache import Base64Cache, base64_cache
+from app.utils.image_utils import to_base64
+
+
+def test_prewarmed_jpeg_variant_is_hit_by_to_base64(tmp_path):
+    path = str(tmp_path / "style.jpg")
+    Image.new("RGB", (4096, 2304), (10, 120, 60)).save(path, format="JPEG")
+    base64_cache.clear()
+
+    assert base64_cache.prewarm(image_variants.variant_paths(path)) >= 1
+    misses = base64_cache.stats()["misses"]
+    uri = to_base64(image_variants.for_provider(path, "kie"))
+
+    assert uri.startswith("data:image/jpeg;base64,")
+    assert base64_cache.stats()["misses"] == misses
+
+
+def test_mime_type_follows_extension(tmp_path):
+    cache = Base64Cache(max_bytes=1 << 20)
+    png = tmp_path / "a.png"
+    png.write_bytes(b"x")
+    jpeg = tmp_path / "b.JPEG"
+    jpeg.write_bytes(b"x")
+    assert cache.encode_file(str(png)).startswith("data:image/png;")
+    assert cache.encode_file(str(jpeg)).startswith("data:image/jpeg;")
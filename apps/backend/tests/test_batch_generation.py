@@ -0,0 +1,31 @@
+import app.models  # noqa: F401
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.project import Episode, Project
+from app.services.batch_generation import BatchGeneration
+
+
+def test_write_back_skips_background_results():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    project = Project(user_id=1, name="p")
+    db.add(project)
+    db.flush()
+    episode = Episode(
+        project_id=project.id,
+        title="e",
+        ai_config={"generated_script": {"storyboard": [{"id": "s1"}, {"id": "s2"}]}},
+    )
+    db.add(episode)
+    db.commit()
+
+    batch = BatchGeneration(user_id=1, episode_id=episode.id, media_type="video", items=[])
+    batch._set_result("s1", {"status": "completed", "result": {"url": "/assets/a.mp4", "prompt": "p"}})
+    batch._set_result("s2", {"status": "completed", "result": {"job_id": 3, "type": "video", "background": True}})
+    assert batch._write_back() == 1
+
+    db.expire_all()
+    storyboard = db.get(Episode, episode.id).ai_config["generated_script"]["storyboard"]
+    assert storyboard[0]["video_url"] == "/assets/a.mp4"
+    assert "video_url" not in storyboard[1]
+    db.close()
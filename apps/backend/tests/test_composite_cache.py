@@ -0,0 +1,28 @@
+import json
+import os
+
+from app.utils import asset_store
+from app.utils.composite_cache import CompositeCache
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["entries"]
+
+
+def test_hits_do_not_rewrite_index_until_prune(tmp_path):
+    src = tmp_path / "composite.jpg"
+    src.write_bytes(b"jpg")
+    url = asset_store.put_file(str(src), "jpg")
+    index = str(tmp_path / "composites.json")
+    cache = CompositeCache(index, max_idle=3600)
+    cache.store("k", url, "image/jpeg")
+    stored_at = _read(index)["k"]["last_used"]
+    mtime = os.stat(index).st_mtime_ns
+
+    assert cache.lookup("k")["url"] == url
+    assert cache.lookup("k") is not None
+    assert os.stat(index).st_mtime_ns == mtime
+
+    assert cache.prune() == 0
+    assert _read(index)["k"]["last_used"] > stored_at
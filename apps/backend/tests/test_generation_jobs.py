@@ -0,0 +1,71 @@
+import subprocess
+import sys
+
+import pytest
+
+import app.models  # noqa: F401
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.apikey import ApiKey
+from app.models.generation_job import GenerationJob
+from app.services import generation_jobs
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    session.query(GenerationJob).delete()
+    session.query(ApiKey).delete()
+    key = ApiKey(user_id=1, platform="openai", encrypted_key="sk-test")
+    session.add(key)
+    session.commit()
+    yield session, key.id
+    session.close()
+
+
+def _dead_owner():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return f"{generation_jobs.current_owner().rpartition(':')[0]}:{proc.pid}"
+
+
+def _job(session, key_id, status, owner):
+    job = GenerationJob(user_id=1, key_id=key_id, status=status, owner=owner, task_id="t", poll_url="http://x")
+    session.add(job)
+    session.commit()
+    return job.id
+
+
+def test_resume_only_takes_over_orphaned_jobs(db, monkeypatch):
+    session, key_id = db
+    resumed = []
+    monkeypatch.setattr(generation_jobs, "_resume_job", lambda job, api_key: resumed.append(job.id) or True)
+
+    with subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]) as live:
+        live_owner = f"{generation_jobs.current_owner().rpartition(':')[0]}:{live.pid}"
+        live_running = _job(session, key_id, generation_jobs.JOB_RUNNING, live_owner)
+        live_downloading = _job(session, key_id, generation_jobs.JOB_DOWNLOADING, live_owner)
+        orphan_running = _job(session, key_id, generation_jobs.JOB_RUNNING, _dead_owner())
+        orphan_downloading = _job(session, key_id, generation_jobs.JOB_DOWNLOADING, None)
+        try:
+            assert generation_jobs.resume_pending_jobs() == 2
+        finally:
+            live.kill()
+
+    assert sorted(resumed) == sorted([orphan_running, orphan_downloading])
+    session.expire_all()
+    jobs = {job.id: job for job in session.query(GenerationJob).all()}
+    assert jobs[live_running].status == generation_jobs.JOB_RUNNING
+    assert jobs[live_downloading].status == generation_jobs.JOB_DOWNLOADING
+    assert jobs[live_downloading].owner == live_owner
+    assert jobs[orphan_downloading].status == generation_jobs.JOB_RUNNING
+    assert jobs[orphan_running].owner == generation_jobs.current_owner()
+
+
+def test_claim_for_attach_only_once(db):
+    session, key_id = db
+    job_id = _job(session, key_id, generation_jobs.JOB_RUNNING, generation_jobs.current_owner())
+    assert generation_jobs.claim_for_attach(job_id)
+    assert not generation_jobs.claim_for_attach(job_id)
+    assert generation_jobs.job_outcome(job_id) == (generation_jobs.JOB_DOWNLOADING, None)
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+import requests
+
+from app.core.config import settings
+from app.utils import http_client
+
+
+class FakeSession(requests.Session):
+    """Real request preparation; `send` plays back scripted outcomes."""
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.request = request
+        return response
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_RETRY_MAX", 3)
+    monkeypatch.setattr(settings, "HTTP_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(settings, "HTTP_RETRY_BUDGET", 60.0)
+    monkeypatch.setattr(http_client, "breakers", http_client.CircuitBreakers(threshold=100, cooldown=60))
+
+    def install(*outcomes):
+        session = FakeSession(outcomes)
+        monkeypatch.setattr(http_client, "_session", session)
+        return session
+
+    return install
+
+
+def test_post_is_not_resent_after_read_timeout(client):
+    session = client(requests.exceptions.ReadTimeout("read timed out"), 200)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http_client.request("POST", "http://provider.test/videos", json={"prompt": "p"})
+    assert session.sent == 1
+
+
+def test_idempotent_post_is_retried_after_read_timeout(client):
+    session = client(requests.exceptions.ReadTimeout("read timed out"), 200)
+    response = http_client.request("POST", "http://provider.test/videos", json={}, idempotent=True)
+    assert response.status_code == 200
+    assert session.sent == 2
+
+
+def test_retries_stop_when_budget_is_spent(client, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_RETRY_BACKOFF", 5.0)
+    monkeypatch.setattr(settings, "HTTP_RETRY_BUDGET", 1.0)
+    session = client(503)
+    before = http_client.stats()["budget_exhausted"]
+    started = time.monotonic()
+    response = http_client.request("GET", "http://provider.test/status")
+    assert response.status_code == 503
+    assert session.sent == 1
+    assert time.monotonic() - started < 1.0
+    assert http_client.stats()["budget_exhausted"] == before + 1
+
+
+def test_breaker_lets_one_trial_through_after_cooldown(client, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_RETRY_MAX", 0)
+    breakers = http_client.CircuitBreakers(threshold=2, cooldown=0.2)
+    monkeypatch.setattr(http_client, "breakers", breakers)
+    session = client(503, 503, 200)
+
+    http_client.request("GET", "http://provider.test/status")
+    http_client.request("GET", "http://provider.test/status")
+    with pytest.raises(http_client.CircuitOpenError):
+        http_client.request("GET", "http://provider.test/status")
+    assert session.sent == 2
+
+    time.sleep(0.25)
+    breakers.before("provider.test")  # the trial call
+    with pytest.raises(http_client.CircuitOpenError):
+        breakers.before("provider.test")  # everyone else waits for it
+    breakers.failure("provider.test", "HTTP 503")
+    assert breakers.stats()[0]["state"] == http_client.BREAKER_OPEN
+
+    time.sleep(0.25)
+    assert http_client.request("GET", "http://provider.test/status").status_code == 200
+    assert breakers.stats()[0]["state"] == http_client.BREAKER_CLOSED
+    assert session.sent == 3
@@ -0,0 +1,50 @@
+import os
+
+from PIL import Image
+
+from app.utils import image_variants
+
+
+def _png(tmp_path, name, size):
+    path = str(tmp_path / name)
+    Image.new("RGB", size, (120, 40, 200)).save(path, format="PNG")
+    return path
+
+
+def test_image_within_profile_is_not_reencoded(tmp_path):
+    path = _png(tmp_path, "small.png", (1024, 576))
+    assert image_variants.for_provider(path, "openai") == path
+    assert os.listdir(tmp_path) == ["small.png"]
+
+
+def test_oversized_image_is_downscaled(tmp_path):
+    path = _png(tmp_path, "big.png", (4096, 2304))
+    variant = image_variants.for_provider(path, "kie")
+    assert variant != path
+    with Image.open(variant) as img:
+        assert max(img.size) == 1920
+
+
+def _oriented_jpeg(tmp_path, name, size, orientation):
+    path = str(tmp_path / name)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.new("RGB", size, (200, 160, 40)).save(path, format="JPEG", exif=exif)
+    return path
+
+
+def test_exif_orientation_is_applied_before_sizing(tmp_path):
+    # Stored landscape, displayed portrait (rotated 90°).
+    path = _oriented_jpeg(tmp_path, "photo.jpg", (4096, 2304), 6)
+    variant = image_variants.for_provider(path, "kie")
+    with Image.open(variant) as img:
+        assert img.size == (1080, 1920)
+        assert img.getexif().get(0x0112, 1) == 1
+
+
+def test_oriented_image_within_profile_gets_upright_copy(tmp_path):
+    path = _oriented_jpeg(tmp_path, "small.jpg", (640, 360), 8)
+    variant = image_variants.for_provider(path, "openai")
+    assert variant != path
+    with Image.open(variant) as img:
+        assert img.size == (360, 640)
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import app.models  # noqa: F401
+from app.core.config import settings
+from app.db.base import Base
+from app.db.session import engine
+from app.services import key_pool
+from app.utils.rate_governor import RateGovernor
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class _Client:
+    """Answers after `delay`, or never if `delay` is None (stuck before headers)."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.http = None
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, http_client=None):
+        self.http = http_client
+        return self
+
+    def create(self, **kwargs):
+        deadline = None if self.delay is None else time.monotonic() + self.delay
+        while deadline is None or time.monotonic() < deadline:
+            if self.http is not None and self.http.is_closed:
+                raise ConnectionError("connection closed")
+            time.sleep(0.01)
+        return _Stream(["token"])
+
+
+def test_losing_hedge_is_cut_off_before_headers(tmp_path, monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    governor = RateGovernor(str(tmp_path / "governor.db"))
+    monkeypatch.setattr(key_pool, "rate_governor", governor)
+    monkeypatch.setattr(settings, "KEY_POOL_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(settings, "KEY_POOL_HEDGE_MIN_DELAY", 0.05)
+
+    stuck, fast = _Client(None), _Client(0.05)
+    pool = key_pool.PooledChatClient([(101, stuck), (102, fast)], policy=key_pool.POLICY_HEDGED)
+    with pool.chat.completions.create(model="m", stream=True) as stream:
+        assert list(stream) == ["token"]
+
+    # Released by abort() itself, not when the stuck request gives up.
+    assert governor.load(101, "text") == 0
+    assert stuck.http.is_closed
+    for thread in threading.enumerate():
+        if thread.name == "key-pool-attempt":
+            thread.join(timeout=2)
+            assert not thread.is_alive()
@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+from app.utils.sora_api import kie
+from app.utils.sora_api.kie import Kie
+
+
+class _Response:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def _formatter():
+    formatter = Kie()
+    formatter.set_auth("http://kie.test/api/v1", "key")
+    return formatter
+
+
+def test_transport_errors_are_left_to_the_poller(monkeypatch):
+    def fail(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("circuit open")
+
+    monkeypatch.setattr(kie, "http_request", fail)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _formatter()._query_status("t1")
+
+
+def test_provider_failure_fails_the_task(monkeypatch):
+    monkeypatch.setattr(kie, "http_request", lambda *a, **k: _Response({"code": 422, "msg": "bad prompt"}))
+    assert _formatter()._query_status("t1")["status"] == "failed"
+    monkeypatch.setattr(kie, "http_request", lambda *a, **k: _Response({"code": 500, "msg": "busy"}))
+    with pytest.raises(Exception):
+        _formatter()._query_status("t1")
@@ -0,0 +1,41 @@
+from app.services import model_catalog as model_catalog_module
+from app.services.model_catalog import Catalog, ModelCatalogCache
+
+
+def _fake_fetch(monkeypatch):
+    calls = []
+
+    def fetch(platform, base_url, real_key):
+        calls.append((base_url, real_key))
+        return Catalog([real_key], {}, {})
+
+    monkeypatch.setattr(model_catalog_module, "fetch_catalog", fetch)
+    return calls
+
+
+def test_cache_is_bounded_lru(monkeypatch):
+    calls = _fake_fetch(monkeypatch)
+    cache = ModelCatalogCache(ttl=600, stale=600, max_entries=2)
+    cache.get("openai", "https://a/v1", "k1")
+    cache.get("openai", "https://a/v1", "k2")
+    cache.get("openai", "https://a/v1", "k1")  # k1 most recently used
+    cache.get("openai", "https://a/v1", "k3")
+
+    assert cache.stats()["entries"] == 2
+    cache.get("openai", "https://a/v1", "k1")
+    assert len(calls) == 3
+    cache.get("openai", "https://a/v1", "k2")
+    assert len(calls) == 4
+
+
+def test_invalidate_by_credential(monkeypatch):
+    calls = _fake_fetch(monkeypatch)
+    cache = ModelCatalogCache(ttl=600, stale=600)
+    cache.get("openai", "https://a/v1/", "k1")
+    cache.get("openai", "https://a/v1", "k2")
+
+    cache.invalidate("https://a/v1", "k1")
+    cache.get("openai", "https://a/v1", "k2")
+    assert len(calls) == 2
+    cache.get("openai", "https://a/v1", "k1")
+    assert len(calls) == 3
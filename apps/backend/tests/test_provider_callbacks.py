@@ -0,0 +1,17 @@
+from app.core.config import settings
+from app.services import provider_callbacks
+from app.utils.sora_api.kie import Kie
+
+
+def test_callbacks_need_a_real_secret(monkeypatch):
+    monkeypatch.setattr(settings, "PUBLIC_BASE_URL", "https://drama.example.com")
+    assert not provider_callbacks.enabled()
+    assert provider_callbacks.prepare(Kie()) == (None, None)
+    token = provider_callbacks.token_for("kie", "abc")
+    assert not provider_callbacks.verify("kie", "abc", token)
+
+    monkeypatch.setattr(settings, "SECRET_KEY", "s3cret-for-this-deployment")
+    assert provider_callbacks.enabled()
+    callback_id, url = provider_callbacks.prepare(Kie())
+    token = url.rsplit("token=", 1)[1]
+    assert provider_callbacks.verify("kie", callback_id, token)
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import time
+
+from app.utils import rate_governor as rg
+
+
+def _lease(conn, lease_id, pid, owner):
+    now = time.time()
+    conn.execute(
+        "INSERT INTO lease (id, scope, pid, acquired, expires, owner) VALUES (?, '1:video', ?, ?, ?, ?)",
+        (lease_id, pid, now, now + 3600, owner),
+    )
+
+
+def test_leases_of_a_previous_process_with_our_pid_are_purged(tmp_path):
+    governor = rg.RateGovernor(str(tmp_path / "governor.db"))
+    pid = os.getpid()
+    with subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]) as other:
+        try:
+            with governor._transaction() as conn:
+                conn.execute("INSERT INTO process (pid, token, started) VALUES (?, ?, ?)", (other.pid, f"{other.pid}:live", 0))
+                _lease(conn, "previous-self", pid, f"{pid}:previous")
+                _lease(conn, "legacy", pid, None)
+                _lease(conn, "other-live", other.pid, f"{other.pid}:live")
+                _lease(conn, "other-reused", other.pid, f"{other.pid}:dead")
+                _lease(conn, "mine", pid, rg.owner_token())
+                governor._purge(conn, time.time())
+                left = sorted(row[0] for row in conn.execute("SELECT id FROM lease"))
+        finally:
+            other.kill()
+    assert left == ["mine", "other-live"]
+
+
+def test_slot_round_trip(tmp_path):
+    governor = rg.RateGovernor(str(tmp_path / "governor.db"))
+    with governor.slot(7, "video") as slot:
+        assert slot.lease_id
+        assert governor.load(7, "video") == 1
+    assert governor.load(7, "video") == 0
@@ -0,0 +1,46 @@
+import json
+
+from app.services.ai_engine import AIEngine, _SCRIPT_SECTIONS
+from app.utils.script_stream_parser import ScriptSectionParser
+
+TOOL = "short-video-screenwriter"
+
+
+def _section(tag, key, value, closed=True):
+    body = f"<|{tag}|>\n```json\n{json.dumps({key: value}, ensure_ascii=False)}\n```\n"
+    return body + (f"<|{tag}_END|>\n" if closed else "")
+
+
+def _stream(text, size=7):
+    parser = ScriptSectionParser(_SCRIPT_SECTIONS[TOOL])
+    closed = []
+    for i in range(0, len(text), size):
+        closed += parser.feed(text[i:i + size])
+    return parser, closed
+
+
+def test_sections_emitted_as_they_close():
+    text = (
+        "<think>draft <|META|> ```json {bad``` <|META_END|></think>\n"
+        + _section("META", "meta", {"project_title": "t"})
+        + _section("CHARACTERS", "characters", [{"name": "甲"}])
+    )
+    parser, closed = _stream(text)
+    assert [key for key, _ in closed] == ["meta", "characters"]
+    assert parser.sections["meta"] == {"project_title": "t"}
+
+
+def test_section_without_end_tag_is_kept():
+    storyboard = [{"action": "推门"}]
+    text = (
+        _section("META", "meta", {"project_title": "t"})
+        + _section("CHARACTERS", "characters", [{"name": "甲"}])
+        + _section("STORYBOARD", "storyboard", storyboard, closed=False)
+    )
+    parser, closed = _stream(text)
+    assert "storyboard" not in parser.sections
+
+    data = AIEngine(None, None, {})._parse_script_output(TOOL, text, parser)
+    assert data["meta"] == {"project_title": "t"}
+    assert data["characters"] == [{"name": "甲"}]
+    assert data["storyboard"] == storyboard
@@ -0,0 +1,42 @@
+import time
+
+from app.core.config import settings
+from app.services.ai_engine import AIEngine
+from app.utils import sse
+
+
+def _model(pause):
+    yield {"type": "token", "content": "a"}
+    yield {"type": "token", "content": "b"}  # held: inside the window
+    time.sleep(pause)  # the model thinks
+    yield {"type": "token", "content": "c"}
+
+
+def test_held_text_is_flushed_when_the_window_expires(monkeypatch):
+    monkeypatch.setattr(settings, "SSE_COALESCE_MS", 50)
+    monkeypatch.setattr(settings, "SSE_COALESCE_BYTES", 1024)
+    engine = AIEngine(None, None, {})
+    started = time.monotonic()
+    seen = []
+    for frame in engine._priint_at_director_console("short-video-screenwriter", _model(0.6)):
+        text = frame.decode("utf-8") if isinstance(frame, bytes) else frame
+        if '"thought"' in text:
+            seen.append((time.monotonic() - started, text))
+    assert [t for t in seen if '"b"' in t[1]][0][0] < 0.4
+    assert any('"c"' in text for _, text in seen)
+
+
+def test_pump_reraises_source_errors():
+    def broken():
+        yield 1
+        raise ValueError("boom")
+
+    items = []
+    try:
+        for item in sse.pump(broken(), lambda: None):
+            items.append(item)
+    except ValueError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("error was swallowed")
+    assert items == [1]
@@ -0,0 +1,21 @@
+import pytest
+
+from app.utils.sora_api.yi import Yi, _TaskStore
+
+
+def test_task_store_evicts_finished_before_processing():
+    store = _TaskStore(max_entries=2)
+    store.put("running", {"status": "processing"})
+    store.put("done", {"status": "completed"})
+    store.put("new", {"status": "processing"})
+
+    assert store.get("running") is not None
+    assert store.get("new") is not None
+    assert store.get("done") is None
+
+
+def test_create_rejects_unresolvable_images(monkeypatch):
+    yi = Yi()
+    monkeypatch.setattr(yi, "image_ref", lambda image: None)
+    with pytest.raises(Exception, match="valid image"):
+        yi.create("https://api.apiyi.com/v1", "key", "sora_video2", "p", 10, "720x1280", False, ["/missing.png"])
@@ -28,7 +28,7 @@ export const authApi = {
 }
 
 export const aiApi = {
-    testConnection: (apiKeyId: number) => request.post('/ai/test-connection', { api_key_id: apiKeyId }),
+    testConnection: (apiKeyId: number, refresh = false) => request.post('/ai/test-connection', { api_key_id: apiKeyId, refresh }),
     updateScriptItem: (data: { episode_id: number, item_id: string, updates: any }) => request.post('/ai/script/update_item', data),
     deleteScriptItem: (data: { episode_id: number, item_id: string }) => request.post('/ai/script/delete_item', data),
     getStoryboardPrompts: (episodeId: number) => request.get('/ai/script/storyboard_prompts', { params: { episode_id: episodeId } }),
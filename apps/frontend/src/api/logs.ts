@@ -24,6 +24,26 @@ export interface DirectorRunSummary {
 
 export interface DirectorRunsResponse {
   runs: DirectorRunSummary[]
+  next_cursor?: string | null
+}
+
+export interface DirectorRunFilters {
+  project_id?: number
+  episode_id?: number
+  skill?: string
+  status?: string
+  since?: string
+  until?: string
+}
+
+export interface DirectorRunStats {
+  runs: number
+  by_status: Record<string, number>
+  by_skill: Record<string, number>
+  duration_avg_ms: number | null
+  duration_max_ms: number | null
+  thought_chars: number
+  errors: number
 }
 
 export interface DirectorRunDetail {
@@ -45,16 +65,21 @@ export function getLatestLogs(limit: number = 100) {
   })
 }
 
-export function getDirectorRuns(params?: {
+export function getDirectorRuns(params?: DirectorRunFilters & {
   limit?: number
-  project_id?: number
-  episode_id?: number
+  cursor?: string
 }) {
   return request.get<any, DirectorRunsResponse>('/logs/director-runs', {
     params
   })
 }
 
+export function getDirectorRunStats(params?: DirectorRunFilters) {
+  return request.get<any, DirectorRunStats>('/logs/director-runs/stats', {
+    params
+  })
+}
+
 export function getDirectorRunDetail(runId: string) {
   return request.get<any, DirectorRunDetail>(`/logs/director-runs/${runId}`)
 }
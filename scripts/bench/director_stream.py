@@ -0,0 +1,142 @@
+"""
+Benchmark the director console's token -> SSE path.
+
+Usage (from the repository root):
+    python scripts/bench/director_stream.py [--tokens 40000] [--rate 80] [--repeat 3]
+
+A synthetic screenwriter answer (short Chinese tokens with the tagged JSON
+sections) is streamed through the previous one-frame-per-token loop and
+through `AIEngine._priint_at_director_console` with the configured
+coalescing, both with a DirectorTrace attached. `--rate` is the simulated
+model speed in tokens/s: the coalescer reads a fake clock that advances by
+1/rate per token, so the run itself is not slowed down. For the same reason
+the model is read inline rather than through `sse.pump`: its reader thread
+would run ahead of the simulated clock, and its timer flush needs real time.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "apps", "backend"))
+WORK_DIR = tempfile.mkdtemp(prefix="skydrama-bench-")
+os.environ.setdefault("APP_WORK_DIR", WORK_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORK_DIR, 'database.db')}")
+
+import app.models  # noqa: E402,F401
+from app.core.config import settings  # noqa: E402
+from app.core.director_trace import DirectorTrace  # noqa: E402
+from app.db.base import Base  # noqa: E402
+from app.db.session import engine  # noqa: E402
+from app.services.ai_engine import AIEngine  # noqa: E402
+from app.utils import sse  # noqa: E402
+
+_WORDS = "镜头 缓缓 推进 少女 回头 雨夜 街道 霓虹 倒影 沉默 对视 心跳 脚步 远处 警笛 灯光".split()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def build_tokens(count, seed=7):
+    rnd = random.Random(seed)
+    shots = [{"shot_id": i + 1, "duration": "3s", "shot_type": "特写", "action": "".join(rnd.choices(_WORDS, k=12)), "visual_prompt": ""} for i in range(10)]
+    tail = "\n<|STORYBOARD|>\n```json\n" + json.dumps({"storyboard": shots}, ensure_ascii=False) + "\n```\n<|STORYBOARD_END|>\n"
+    tokens = [rnd.choice(_WORDS) if rnd.random() < 0.85 else "，" for _ in range(max(0, count - len(tail) // 3))]
+    tokens += [tail[i:i + 3] for i in range(0, len(tail), 3)]
+    return tokens
+
+
+def director_gen(tokens, clock, rate):
+    step = 1.0 / rate
+    for token in tokens:
+        clock.now += step
+        yield {"type": "token", "content": token}
+
+
+def legacy_console(engine, tool_name, gen):
+    """The old _priint_at_director_console: one frame per token, `+=` accumulation."""
+    final_output_accumulator = ""
+    start_time = time.time()
+    last_progress = 0
+    for chunk in gen:
+        elapsed = time.time() - start_time
+        current_progress = min(int(elapsed), 98)
+        if current_progress > last_progress:
+            yield engine._format_sse("progress", current_progress)
+            last_progress = current_progress
+        if not isinstance(chunk, dict):
+            continue
+        if chunk.get("type") == "token":
+            content = chunk.get("content", "")
+            final_output_accumulator += content
+            yield engine._format_sse("thought", content)
+    return final_output_accumulator
+
+
+def inline_pump(source, next_timeout):
+    return iter(source)
+
+
+def run(impl, tokens, rate):
+    clock = FakeClock()
+    sse.time = clock  # coalescing windows follow the simulated model speed
+    sse.pump = inline_pump
+    engine = AIEngine(None, None, {})
+    trace = DirectorTrace(run_id=f"bench_{impl}_{os.getpid()}")
+    trace.start({"skill": "short-video-screenwriter"})
+    engine.set_trace(trace)
+    gen = director_gen(tokens, clock, rate)
+    if impl == "legacy":
+        stream = legacy_console(engine, "short-video-screenwriter", gen)
+    else:
+        stream = engine._priint_at_director_console("short-video-screenwriter", gen)
+
+    frames = 0
+    size = 0
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for frame in stream:
+        frames += 1
+        size += len(frame) if isinstance(frame, bytes) else len(frame.encode("utf-8"))
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    trace.finish()
+    return frames, size, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=40000)
+    parser.add_argument("--rate", type=float, default=80.0, help="simulated tokens per second")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    Base.metadata.create_all(bind=engine)  # traces index their runs
+    tokens = build_tokens(args.tokens)
+
+    print(f"tokens: {len(tokens)}, rate: {args.rate:g}/s, coalesce: {settings.SSE_COALESCE_MS:g} ms / {settings.SSE_COALESCE_BYTES} bytes")
+    print(f"{'impl':<11}{'frames':>8}{'KiB':>9}{'wall ms':>9}{'cpu ms':>9}{'frames/s':>11}{'cpu us/token':>14}")
+    for impl in ("legacy", "coalesced"):
+        best = None
+        for _ in range(args.repeat):
+            result = run(impl, tokens, args.rate)
+            if best is None or result[3] < best[3]:
+                best = result
+        frames, size, wall, cpu = best
+        print(
+            f"{impl:<11}{frames:>8}{size / 1024:>9.0f}{wall * 1000:>9.0f}{cpu * 1000:>9.0f}"
+            f"{frames / wall:>11.0f}{cpu * 1e6 / len(tokens):>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
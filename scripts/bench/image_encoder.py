@@ -0,0 +1,131 @@
+"""
+Benchmark the size-targeted encoder against the previous stepwise loop.
+
+Usage (from the repository root):
+    python scripts/bench/image_encoder.py [--target-mb 2] [--repeat 3]
+
+Composites are synthesized to look like storyboard context images: rows of
+character portraits and scene frames with photographic noise and gradients.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "apps", "backend"))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from app.utils.image_encoder import encode_to_target  # noqa: E402
+
+
+def legacy_compress(image, target_bytes):
+    """The old _get_compressed_stream, instrumented to count encodes."""
+    encodes = 0
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    encodes += 1
+    if buf.tell() <= target_bytes:
+        return buf.tell(), None, encodes
+
+    rgb = Image.new("RGB", image.size, (255, 255, 255))
+    rgb.paste(image, mask=image.split()[3] if image.mode == "RGBA" else None)
+    quality = 95
+    while quality >= 10:
+        buf.seek(0)
+        buf.truncate()
+        rgb.save(buf, format="JPEG", quality=quality)
+        encodes += 1
+        if buf.tell() <= target_bytes:
+            return buf.tell(), quality, encodes
+        quality -= 5
+
+    scale = 0.9
+    width, height = rgb.size
+    while buf.tell() > target_bytes and width > 100:
+        width = int(width * scale)
+        height = int(height * scale)
+        resized = rgb.resize((width, height), Image.Resampling.LANCZOS)
+        buf.seek(0)
+        buf.truncate()
+        resized.save(buf, format="JPEG", quality=quality)
+        encodes += 1
+    return buf.tell(), quality, encodes
+
+
+def _tile(w, h, seed):
+    rnd = random.Random(seed)
+    img = Image.effect_noise((w, h), rnd.randint(30, 80)).convert("RGB")
+    overlay = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    img = Image.blend(img, overlay, 0.5)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rnd.randint(0, w), rnd.randint(0, h)
+        x1, y1 = x0 + rnd.randint(20, w // 2), y0 + rnd.randint(20, h // 2)
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+    return img.filter(ImageFilter.GaussianBlur(0.6)).convert("RGBA")
+
+
+def _composite(rows):
+    row_images = []
+    for row in rows:
+        width = sum(t.width for t in row)
+        height = max(t.height for t in row)
+        canvas = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+        x = 0
+        for t in row:
+            canvas.paste(t, (x, 0))
+            x += t.width
+        row_images.append(canvas)
+    width = max(r.width for r in row_images)
+    height = sum(r.height for r in row_images)
+    canvas = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    y = 0
+    for r in row_images:
+        canvas.paste(r, (0, y))
+        y += r.height
+    return canvas
+
+
+def build_cases():
+    return {
+        "2 chars + 1 scene": _composite([
+            [_tile(768, 1024, 1), _tile(768, 1024, 2)],
+            [_tile(1536, 864, 3)],
+        ]),
+        "4 chars + 2 scenes": _composite([
+            [_tile(768, 1024, s) for s in range(4)],
+            [_tile(1536, 864, 10), _tile(1536, 864, 11)],
+        ]),
+        "3x3 grid 1080p": _composite([[_tile(1920, 1080, r * 3 + c) for c in range(3)] for r in range(3)]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-mb", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    target = int(args.target_mb * 1024 * 1024)
+
+    print(f"target: {args.target_mb} MB, repeat: {args.repeat}")
+    print(f"{'case':<22}{'size':>12}  {'impl':<8}{'encodes':>8}{'quality':>9}{'bytes':>10}{'ms':>9}")
+    for name, image in build_cases().items():
+        dims = f"{image.width}x{image.height}"
+        for impl in ("legacy", "bisect"):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                if impl == "legacy":
+                    size, quality, encodes = legacy_compress(image, target)
+                else:
+                    result = encode_to_target(image, target)
+                    size, quality, encodes = result.size, result.quality, result.encodes
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{name:<22}{dims:>12}  {impl:<8}{encodes:>8}{str(quality):>9}{size:>10}{min(timings):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
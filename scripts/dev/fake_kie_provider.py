@@ -0,0 +1,214 @@
+"""
+Local stand-in for Kie's job API, for exercising completion callbacks.
+
+Usage (from the repository root):
+    python scripts/dev/fake_kie_provider.py [--port 18080] [--delay 3]
+    python scripts/dev/fake_kie_provider.py --check
+
+The server answers `POST /api/v1/jobs/createTask` with a task id and, `delay`
+seconds later, POSTs the Kie completion body to the request's `callBackUrl`.
+`GET /api/v1/jobs/recordInfo` keeps working as the polling fallback.
+
+`--check` runs an end-to-end round trip in a temporary work dir: it starts
+the backend (with PUBLIC_BASE_URL pointing at itself and a non-default
+SECRET_KEY, without which callbacks stay off) and the fake provider, creates
+a task through the Kie formatter and reports how long completion took and
+how many status polls the provider received. Reference uploads are stubbed,
+so nothing leaves the machine. The check fails unless the callback was
+accepted and the task completed through it rather than through a poll.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "apps", "backend")
+
+
+class FakeKie:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.polls = 0
+        self.success_polls = 0
+        self.callbacks_accepted = 0
+        self.lock = threading.Lock()
+
+    def record(self, task_id: str) -> Dict[str, Any]:
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            return {"taskId": task_id, "state": "fail", "failMsg": "Unknown task"}
+        if time.time() - task["created"] < self.delay:
+            return {"taskId": task_id, "state": "generating"}
+        result = {"resultUrls": [f"https://example.com/videos/{task_id}.mp4"]}
+        return {"taskId": task_id, "state": "success", "resultJson": json.dumps(result)}
+
+    def complete_later(self, task_id: str, callback_url: str):
+        time.sleep(self.delay)
+        body = json.dumps({"code": 200, "msg": "success", "data": self.record(task_id)}).encode("utf-8")
+        req = urllib.request.Request(callback_url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as res:
+                print(f"[fake-kie] callback for {task_id} -> {res.status}")
+                if res.status == 200:
+                    with self.lock:
+                        self.callbacks_accepted += 1
+        except Exception as e:
+            print(f"[fake-kie] callback for {task_id} failed: {e}")
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload: Dict[str, Any]):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.endswith("/jobs/createTask"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                task_id = uuid.uuid4().hex
+                with fake.lock:
+                    fake.tasks[task_id] = {"created": time.time()}
+                callback_url = payload.get("callBackUrl")
+                if callback_url:
+                    threading.Thread(target=fake.complete_later, args=(task_id, callback_url), daemon=True).start()
+                self._send({"code": 200, "msg": "success", "data": {"taskId": task_id}})
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if not parsed.path.endswith("/jobs/recordInfo"):
+                    self.send_error(404)
+                    return
+                with fake.lock:
+                    fake.polls += 1
+                task_id = (parse_qs(parsed.query).get("taskId") or [""])[0]
+                record = fake.record(task_id)
+                if record.get("state") == "success":
+                    with fake.lock:
+                        fake.success_polls += 1
+                self._send({"code": 200, "msg": "success", "data": record})
+
+        return Handler
+
+
+def _serve(fake: FakeKie, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), fake.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def check(delay: float) -> int:
+    work_dir = tempfile.mkdtemp(prefix="skydrama-callback-")
+    backend_port = _free_port()
+    os.environ.update({
+        "APP_WORK_DIR": work_dir,
+        "ASSETS_DIR": os.path.join(work_dir, "assets"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'database.db')}",
+        "PUBLIC_BASE_URL": f"http://127.0.0.1:{backend_port}",
+        "SECRET_KEY": uuid.uuid4().hex,
+        "PROVIDER_HEALTH_ENABLED": "false",
+        "BASE64_CACHE_PREWARM": "false",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+
+    import uvicorn
+
+    from app.main import app
+    from app.services import provider_callbacks
+    from app.services.task_poller import poller
+    from app.utils.sora_api import Kie
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=backend_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    fake = FakeKie(delay)
+    provider = _serve(fake, _free_port())
+    base_url = f"http://127.0.0.1:{provider.server_port}/api/v1"
+
+    image = os.path.join(work_dir, "frame.png")
+    from PIL import Image
+
+    Image.new("RGB", (64, 36), (40, 40, 40)).save(image)
+
+    formatter = Kie()
+    # The real upload host is hard-coded; hand out a local URL instead.
+    formatter.upload_image = lambda data, mime_type, filename: (f"{base_url}/files/{filename}", None)
+    callback_id, callback_url = provider_callbacks.prepare(formatter)
+    if not callback_url:
+        print("callbacks are disabled (PUBLIC_BASE_URL / SECRET_KEY)")
+        return 1
+    started = time.time()
+    task_id = formatter.create(base_url, "test-key", "", "a quiet street", 10, "1280x720", False, [image], callback_url=callback_url)
+    task_key = formatter.track(task_id, callback_id=callback_id)
+    final = None
+    for update in poller.watch(task_key, heartbeat=1.0):
+        if update and update.get("status") in ("completed", "failed", "timeout"):
+            final = update
+    elapsed = time.time() - started
+
+    server.should_exit = True
+    provider.shutdown()
+    print(f"status={final and final.get('status')} video_url={final and final.get('video_url')}")
+    print(f"completed in {elapsed:.2f}s (provider delay {delay:.1f}s), recordInfo polls: {fake.polls}")
+    print(f"callbacks accepted: {fake.callbacks_accepted}, polls that saw the result: {fake.success_polls}")
+    if not final or final.get("status") != "completed":
+        return 1
+    if not fake.callbacks_accepted or fake.success_polls or provider_callbacks.lookup(callback_id) is None:
+        print("completion did not come from the callback")
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--delay", type=float, default=3.0, help="seconds until a task completes")
+    parser.add_argument("--check", action="store_true", help="run an end-to-end callback round trip")
+    args = parser.parse_args()
+
+    if args.check:
+        return check(args.delay)
+
+    fake = FakeKie(args.delay)
+    server = _serve(fake, args.port)
+    print(f"[fake-kie] listening on http://127.0.0.1:{server.server_port}/api/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())